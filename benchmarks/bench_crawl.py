@@ -0,0 +1,172 @@
+'''Measures the retrieval and the processing of the articles and the comments against the local
+replay server, without the NYT APIs: the time, the throughput and the peak memory allocated by
+each phase (traced with tracemalloc, so the phases are slower than without the benchmark). The
+replay server runs in its own process and is not counted. The results can be saved as JSON and
+compared with earlier results to catch the regressions.
+
+Usage: python benchmarks/bench_crawl.py [--articles 100] [--workers 4] [--page-workers 4]
+                                        [--latency 0.005] [--json results.json]
+                                        [--compare baseline.json] [--tolerance 0.25]
+                                        [--memory-tolerance 0.1]
+
+The options of benchmarks/replay_server.py (such as --error-rate or --recordings) are accepted too.'''
+
+import os
+import sys
+import json
+import argparse
+import tracemalloc
+import multiprocessing
+
+from time import perf_counter
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nytcomments.nytcomments import get_dataset, get_comments
+from nytcomments.dataprocessing import get_replies, preprocess_comments_dataframe, preprocess_articles_dataframe, \
+    preprocess_articles
+from nytcomments.accumulator import CommentAccumulator
+from nytcomments.client import Client
+from nytcomments.ratelimit import RateLimiter
+from replay_server import add_arguments, server_from_arguments
+
+
+def serve(args, connection):
+    '''Runs the replay server for the options until it is asked to stop, then sends back the
+    numbers of requests served.'''
+
+    server = server_from_arguments(args).start()
+    connection.send((server.url, server.articles, server.comments, server.number_comments))
+    connection.recv()
+    server.stop()
+    connection.send(server.requests)
+
+
+def measure(results, phase, unit, function):
+    '''Runs the function, which returns the number of items processed, and records the phase with
+    the peak of the memory allocated while it ran.'''
+
+    tracemalloc.start()
+    try:
+        start = perf_counter()
+        items = function()
+        seconds = perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    results[phase] = {'seconds': seconds, 'items': items, 'unit': unit,
+                      'rate': items / seconds if seconds else 0., 'peak_mb': peak / 1024**2}
+    print('{:<32} {:>8.3f} s {:>9} {:<9} {:>10.0f}/s {:>8.1f} MB'.format(
+        phase, seconds, items, unit, results[phase]['rate'], results[phase]['peak_mb']))
+
+
+def run(args):
+    connection, server_connection = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, args=(args, server_connection), daemon=True)
+    server.start()
+    url, articles, comments, number_comments = connection.recv()
+    client = Client(rate_limiter=RateLimiter(1e6, 1e6), base_url=url, backoff_factor=0.01)
+    article_urls = [article['web_url'] for article in articles]
+    pages = min(200, -(-len(articles) // 10))
+    results = {}
+    print('Serving {} articles and {} comments at {}'.format(len(articles), number_comments, url))
+    print()
+
+    try:
+        def dataset():
+            articles_df, comments_df = get_dataset('key', page_upper=pages, begin_date='20000101', end_date='20301231',
+                                                   printout=False, workers=args.workers, page_workers=args.page_workers,
+                                                   client=client)
+            results['get_dataset (articles)'] = {'items': articles_df.shape[0]}
+            return comments_df.shape[0]
+        client.metrics.reset()
+        measure(results, 'get_dataset', 'comments', dataset)
+        results['get_dataset']['phases'] = client.metrics.stats()['phases']
+        articles_seconds = results['get_dataset']['seconds']
+        number_articles = results.pop('get_dataset (articles)')['items']
+        results['get_dataset']['articles_rate'] = number_articles / articles_seconds if articles_seconds else 0.
+
+        measure(results, 'get_comments', 'comments',
+                lambda: get_comments(article_urls, max_comments=10**9, printout=False, workers=args.workers,
+                                     page_workers=args.page_workers, client=client).shape[0])
+    finally:
+        connection.send('stop')
+        requests = connection.recv()
+        server.join()
+
+    raw_df = pd.DataFrame([comment for article_comments in comments.values() for comment in article_comments])
+    raw_df['inReplyTo'] = None
+    flattened = {}
+
+    def replies():
+        flattened['df'] = get_replies(raw_df.copy())
+        return flattened['df'].shape[0]
+    measure(results, 'get_replies', 'comments', replies)
+    measure(results, 'preprocess_comments_dataframe', 'comments',
+            lambda: preprocess_comments_dataframe(flattened['df']).shape[0])
+
+    def accumulate():
+        comments_data = CommentAccumulator()
+        for article_comments in comments.values():
+            comments_data.append(article_comments)
+        return comments_data.to_dataframe().shape[0]
+    measure(results, 'CommentAccumulator', 'comments', accumulate)
+    measure(results, 'preprocess_articles_dataframe', 'articles',
+            lambda: preprocess_articles_dataframe(pd.DataFrame(articles)).shape[0])
+    measure(results, 'preprocess_articles', 'articles', lambda: preprocess_articles(articles).shape[0])
+
+    print()
+    print('get_dataset retrieved {:.0f} articles/s. Requests served: {}'.format(results['get_dataset']['articles_rate'], requests))
+    print('Time of the phases of get_dataset, summed over the threads:')
+    for phase, timer in sorted(results['get_dataset']['phases'].items()):
+        print('    {:<20} {:>8.3f} s {:>8} calls'.format(phase, timer['seconds'], timer['calls']))
+    return results
+
+
+def compare(results, baseline, tolerance, memory_tolerance):
+    '''Prints the phases that are slower than in the baseline by more than the tolerance, or that
+    allocate more memory by more than memory_tolerance, and returns their number.'''
+
+    regressions = 0
+    for phase, result in results.items():
+        if phase not in baseline:
+            continue
+        if baseline[phase].get('seconds'):
+            change = result['seconds'] / baseline[phase]['seconds'] - 1
+            if change > tolerance:
+                regressions += 1
+                print('Regression in {}: {:.3f} s instead of {:.3f} s ({:+.0%})'.format(
+                    phase, result['seconds'], baseline[phase]['seconds'], change))
+        if baseline[phase].get('peak_mb'):
+            change = result['peak_mb'] / baseline[phase]['peak_mb'] - 1
+            if change > memory_tolerance:
+                regressions += 1
+                print('Regression in {}: {:.1f} MB instead of {:.1f} MB ({:+.0%})'.format(
+                    phase, result['peak_mb'], baseline[phase]['peak_mb'], change))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--page-workers', type=int, default=4)
+    parser.add_argument('--json', help='file to save the results to')
+    parser.add_argument('--compare', help='file with earlier results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown of a phase')
+    parser.add_argument('--memory-tolerance', type=float, default=0.1,
+                        help='allowed increase of the peak memory of a phase')
+    add_arguments(parser)
+    parser.set_defaults(latency=0.005)
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if compare(results, baseline, args.tolerance, args.memory_tolerance):
+            sys.exit(1)
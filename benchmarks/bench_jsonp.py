@@ -0,0 +1,80 @@
+'''Compares the decoding of the pages of comments by jsonp.parse_comments_page with the earlier
+string replacements and json.loads, on recorded responses of the community endpoint or, if none
+are given, on synthetic pages of 25 comments.
+
+Usage: python benchmarks/bench_jsonp.py [response files] [--pages 200] [--repeat 5]'''
+
+import os
+import sys
+import json
+import argparse
+
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nytcomments import jsonp
+from bench_replies import make_comments
+
+
+def parse_replace(content):
+    '''The earlier decoding of the pages of comments, kept as the baseline.'''
+
+    text = content.decode('utf-8')
+    file = text.replace('NYTD.commentsInstance.drawComments(','').replace('      /**/ ','')[:-2]
+    return json.loads(file)
+
+
+def parse_stdlib(content):
+    return json.loads(jsonp.unwrap_jsonp(content).tobytes())
+
+
+def make_payloads(number_pages, depth):
+    payloads = []
+    for page in range(number_pages):
+        comments = make_comments(25, depth, 2)
+        results = {'comments': comments, 'totalCommentsReturned': 25, 'totalReplyCommentsReturned': 0}
+        body = json.dumps({'status': 'OK', 'results': results})
+        payloads.append(('NYTD.commentsInstance.drawComments(      /**/ ' + body + ');').encode())
+    return payloads
+
+
+def best_time(function, payloads, repeat):
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        for content in payloads:
+            function(content)
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help='files with the raw responses of the community endpoint')
+    parser.add_argument('--pages', type=int, default=200, help='number of synthetic pages')
+    parser.add_argument('--depth', type=int, default=3, help='depth of the synthetic threads')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.files:
+        payloads = []
+        for filename in args.files:
+            with open(filename, 'rb') as file:
+                payloads.append(file.read())
+    else:
+        payloads = make_payloads(args.pages, args.depth)
+    for content in payloads:
+        assert parse_replace(content) == jsonp.parse_comments_page(content)
+
+    megabytes = sum(len(content) for content in payloads) / 1e6
+    print('Pages: {}, size: {:.1f} MB'.format(len(payloads), megabytes))
+    replace_time = best_time(parse_replace, payloads, args.repeat)
+    print('Replacements and json.loads: {:.3f} s'.format(replace_time))
+    stdlib_time = best_time(parse_stdlib, payloads, args.repeat)
+    print('Unwrapped with json.loads:   {:.3f} s ({:.1f}x)'.format(stdlib_time, replace_time / stdlib_time))
+    if jsonp.orjson is not None:
+        orjson_time = best_time(jsonp.parse_comments_page, payloads, args.repeat)
+        print('Unwrapped with orjson:       {:.3f} s ({:.1f}x)'.format(orjson_time, replace_time / orjson_time))
+    else:
+        print('orjson is not installed.')
@@ -0,0 +1,95 @@
+'''Compares the reply flattening of dataprocessing.get_replies with the earlier recursive 
+implementation on synthetic comment threads.
+
+Usage: python benchmarks/bench_replies.py [--comments 500] [--depth 4] [--branching 2]'''
+
+import os
+import sys
+import argparse
+
+from time import perf_counter
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nytcomments.dataprocessing import get_replies
+
+
+def get_replies_recursive(df):
+    '''The earlier implementation of get_replies, kept as the baseline.'''
+    
+    if 'replyCount' in df.columns:
+        selected_df = df.loc[df.replyCount>0]
+        if selected_df.shape[0] > 0:
+            df_list = []
+            for idx, row in selected_df.iterrows():
+                replies_df = pd.DataFrame(row.replies)
+                replies_df['inReplyTo'] = row.commentID
+                df_list.append(replies_df)
+            all_replies_df = pd.concat([replies_df for replies_df in df_list])
+            all_replies_df = get_replies_recursive(all_replies_df)
+            df = pd.concat([df, all_replies_df])
+    return df
+
+
+def make_comment(comment_id, depth):
+    return {'commentID': comment_id, 'commentBody': 'Comment {}'.format(comment_id), 
+            'createDate': str(1500000000 + comment_id), 'recommendations': comment_id % 50, 
+            'userDisplayName': 'User {}'.format(comment_id % 97), 'replyCount': 0, 'replies': [], 
+            'depth': depth}
+
+
+def make_thread(comment_id, depth, max_depth, branching):
+    '''Returns a comment with `branching` replies at every level up to max_depth, and the next ID.'''
+    
+    comment = make_comment(comment_id, depth)
+    next_id = comment_id + 1
+    if depth < max_depth:
+        for _ in range(branching):
+            reply, next_id = make_thread(next_id, depth + 1, max_depth, branching)
+            comment['replies'].append(reply)
+        comment['replyCount'] = branching
+    return comment, next_id
+
+
+def make_comments(number_comments, max_depth, branching):
+    comments = []
+    next_id = 1
+    for i in range(number_comments):
+        if i % 2: # Every other comment starts a thread
+            comment, next_id = make_thread(next_id, 1, max_depth, branching)
+        else:
+            comment, next_id = make_comment(next_id, 1), next_id + 1
+        comments.append(comment)
+    return comments
+
+
+def best_time(function, comments, repeat):
+    times = []
+    for _ in range(repeat):
+        df = pd.DataFrame(comments)
+        df['inReplyTo'] = None
+        start = perf_counter()
+        result = function(df)
+        times.append(perf_counter() - start)
+    return min(times), result.shape[0]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--comments', type=int, default=500, help='number of comments on the article')
+    parser.add_argument('--depth', type=int, default=4, help='depth of the threads')
+    parser.add_argument('--branching', type=int, default=2, help='number of replies to each reply')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    
+    comments = make_comments(args.comments, args.depth, args.branching)
+    recursive_time, recursive_rows = best_time(get_replies_recursive, comments, args.repeat)
+    iterative_time, iterative_rows = best_time(get_replies, comments, args.repeat)
+    assert recursive_rows == iterative_rows
+    
+    print('Rows: {}, thread depth: {}'.format(iterative_rows, args.depth))
+    print('Recursive get_replies: {:.3f} s'.format(recursive_time))
+    print('Iterative get_replies: {:.3f} s'.format(iterative_time))
+    print('Speedup: {:.1f}x'.format(recursive_time / iterative_time))
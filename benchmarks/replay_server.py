@@ -0,0 +1,248 @@
+'''A local stand-in for the NYT Article Search API and the community endpoint of the comments,
+serving synthetic or recorded articles and comments with configurable latency, error rates and
+quota responses. Pass its url as the base_url of nytcomments.client.Client to use it.
+
+Usage: python benchmarks/replay_server.py [--port 8000] [--articles 100] [--recordings DIR]
+
+A directory of recordings holds articles.json, the list of docs returned by the article search,
+and comments.json, a dictionary mapping the URLs of the articles to the lists of their comments
+as returned by the community endpoint (with the replies nested in them).'''
+
+import os
+import json
+import time
+import random
+import argparse
+import threading
+
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+JSONP_CALLBACK = 'NYTD.commentsInstance.drawComments('
+SECTIONS = ['World', 'U.S.', 'Opinion', 'Business', None]
+FIRST_DAY = datetime(2018, 1, 1)
+
+
+def make_articles(number_articles, days=365):
+    '''Returns the docs of the given number of synthetic articles published over the given days.'''
+
+    articles = []
+    for i in range(number_articles):
+        pub_date = FIRST_DAY + timedelta(days=i * days // max(number_articles, 1))
+        articles.append({'_id': 'nyt://article/{}'.format(i), 'web_url': 'https://www.nytimes.com/{}/article-{}.html'.format(pub_date.strftime('%Y/%m/%d'), i),
+                         'document_type': 'article', 'section_name': SECTIONS[i % len(SECTIONS)], 'new_desk': 'Desk',
+                         'word_count': 500 + i % 1000, 'print_page': str(i % 30) if i % 2 else None,
+                         'type_of_material': 'News', 'pub_date': pub_date.strftime('%Y-%m-%dT%H:%M:%S+0000'),
+                         'blog': {}, 'score': 1, 'uri': 'nyt://article/{}'.format(i), 'source': 'The New York Times',
+                         'byline': {'original': 'By Reporter {}'.format(i % 50)} if i % 7 else None,
+                         'headline': {'main': 'Headline {}'.format(i), 'print_headline': 'Headline {}'.format(i)},
+                         'keywords': [{'name': 'subject', 'value': 'Keyword {}'.format(i % k), 'rank': k} for k in range(1, 4)],
+                         'multimedia': [{}] * (i % 3), 'snippet': 'Snippet {}'.format(i)})
+    return articles
+
+
+def make_comment(comment_id, depth, parent_id=None):
+    return {'approveDate': str(1514764800 + comment_id), 'commentBody': 'Comment {}'.format(comment_id),
+            'commentID': comment_id, 'commentSequence': comment_id, 'commentTitle': '<br/>',
+            'commentType': 'comment' if depth == 1 else 'userReply', 'createDate': str(1514764800 + comment_id),
+            'depth': depth, 'editorsSelection': False, 'parentID': parent_id, 'parentUserDisplayName': None,
+            'permID': str(comment_id), 'picURL': None, 'recommendations': comment_id % 100,
+            'recommendedFlag': None, 'replies': [], 'replyCount': 0, 'reportAbuseFlag': None, 'sharing': 0,
+            'status': 'approved', 'timespeople': 1, 'trusted': 0, 'updateDate': str(1514764800 + comment_id),
+            'userDisplayName': 'User {}'.format(comment_id % 997), 'userID': comment_id % 997,
+            'userLocation': 'New York', 'userTitle': None, 'userURL': None}
+
+
+def make_comments(article_index, number_comments, depth, branching):
+    '''Returns the synthetic comments on an article, newest first, where every fifth comment
+    starts a thread of replies with the given depth and branching.'''
+
+    next_id = [article_index * 1000000]
+
+    def thread(comment_depth, parent_id):
+        next_id[0] += 1
+        comment = make_comment(next_id[0], comment_depth, parent_id)
+        if comment_depth < depth:
+            comment['replies'] = [thread(comment_depth + 1, comment['commentID']) for _ in range(branching)]
+            comment['replyCount'] = branching
+        return comment
+
+    comments = []
+    for i in range(number_comments):
+        if i % 5 == 0:
+            comments.append(thread(1, None))
+        else:
+            next_id[0] += 1
+            comments.append(make_comment(next_id[0], 1))
+    return comments[::-1]
+
+
+def count_replies(comments):
+    return sum(len(comment['replies']) + count_replies(comment['replies']) for comment in comments)
+
+
+class ReplayServer(object):
+    '''Serves the article search and the pages of comments from a background thread on a local
+    port. Every response waits for `latency` seconds, a share of error_rate of the requests fail
+    with HTTP 503 and a share of throttle_rate with HTTP 429, and the article search reports that
+    the daily quota is exceeded after quota article requests.'''
+
+    def __init__(self, articles=None, comments=None, number_articles=100, comments_per_article=(0, 300),
+                 depth=3, branching=1, latency=0., error_rate=0., throttle_rate=0., quota=None, port=0, seed=0):
+        self.random = random.Random(seed)
+        if articles is None:
+            articles = make_articles(number_articles)
+        if comments is None:
+            comments = {}
+            for i, article in enumerate(articles):
+                number_comments = self.random.randint(*comments_per_article)
+                comments[article['web_url']] = make_comments(i, number_comments, depth, branching)
+        self.articles = articles
+        self.comments = comments
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.quota = quota
+        self.lock = threading.Lock()
+        self.requests = {'articles': 0, 'comments': 0, 'errors': 0, 'throttled': 0}
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                status, body, content_type = server.respond(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                if status == 429:
+                    self.send_header('Retry-After', '0')
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.httpd.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}'.format(self.httpd.server_port)
+        self.thread = None
+
+    @property
+    def number_comments(self):
+        '''The total number of comments served, including the replies.'''
+
+        return sum(len(comments) + count_replies(comments) for comments in self.comments.values())
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def respond(self, path):
+        '''Returns the status, body and content type of the response to the request.'''
+
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            draw = self.random.random()
+            if draw < self.error_rate:
+                self.requests['errors'] += 1
+                return 503, b'{}', 'application/json'
+            if draw < self.error_rate + self.throttle_rate:
+                self.requests['throttled'] += 1
+                return 429, b'{}', 'application/json'
+
+        parts = urlsplit(path)
+        query = parse_qs(parts.query)
+        if parts.path.endswith('articlesearch.json'):
+            with self.lock:
+                self.requests['articles'] += 1
+                over_quota = (self.quota is not None) and (self.requests['articles'] > self.quota)
+            if over_quota:
+                return 200, json.dumps({'message': 'API rate limit exceeded'}).encode(), 'application/json'
+            return 200, json.dumps(self.search(query)).encode(), 'application/json'
+
+        with self.lock:
+            self.requests['comments'] += 1
+        body = JSONP_CALLBACK + json.dumps(self.comments_page(query)) + ');'
+        return 200, body.encode(), 'application/javascript'
+
+    def search(self, query):
+        begin_date = query.get('begin_date', ['00000000'])[0]
+        end_date = query.get('end_date', ['99999999'])[0]
+        page = int(query.get('page', ['0'])[0])
+        articles = [article for article in self.articles
+                    if begin_date <= article['pub_date'][:10].replace('-', '') <= end_date]
+        if query.get('sort', ['newest'])[0] == 'newest':
+            articles = articles[::-1]
+        docs = articles[page * 10:page * 10 + 10]
+        return {'status': 'OK', 'response': {'docs': docs, 'meta': {'hits': len(articles), 'offset': page * 10}}}
+
+    def comments_page(self, query):
+        article_url = query['url'][-1]
+        offset = int(query.get('offset', ['0'])[0])
+        comments = self.comments.get(article_url, [])
+        page = comments[offset:offset + 25]
+        replies = count_replies(comments)
+        results = {'comments': page, 'totalCommentsFound': len(comments) + replies,
+                   'totalParentCommentsFound': len(comments), 'totalCommentsReturned': len(page),
+                   'totalReplyCommentsReturned': count_replies(page), 'totalParentCommentsReturned': len(page)}
+        return {'status': 'OK', 'results': results}
+
+
+def load_recordings(directory):
+    '''Returns the articles and the comments recorded in the directory.'''
+
+    with open(os.path.join(directory, 'articles.json')) as file:
+        articles = json.load(file)
+    with open(os.path.join(directory, 'comments.json')) as file:
+        comments = json.load(file)
+    return articles, comments
+
+
+def add_arguments(parser):
+    '''Adds the options of the replay server to the argument parser.'''
+
+    parser.add_argument('--recordings', help='directory of recorded articles and comments')
+    parser.add_argument('--articles', type=int, default=100, help='number of synthetic articles')
+    parser.add_argument('--max-comments', type=int, default=300, help='maximum number of comments on an article')
+    parser.add_argument('--depth', type=int, default=3, help='depth of the threads of replies')
+    parser.add_argument('--branching', type=int, default=1, help='number of replies to each reply')
+    parser.add_argument('--latency', type=float, default=0., help='seconds before every response')
+    parser.add_argument('--error-rate', type=float, default=0., help='share of HTTP 503 responses')
+    parser.add_argument('--throttle-rate', type=float, default=0., help='share of HTTP 429 responses')
+    parser.add_argument('--quota', type=int, help='number of article searches before the quota is exceeded')
+
+
+def server_from_arguments(args, port=0):
+    '''Returns the ReplayServer for the options added by add_arguments.'''
+
+    articles, comments = load_recordings(args.recordings) if args.recordings else (None, None)
+    return ReplayServer(articles, comments, number_articles=args.articles, comments_per_article=(0, args.max_comments),
+                        depth=args.depth, branching=args.branching, latency=args.latency, error_rate=args.error_rate,
+                        throttle_rate=args.throttle_rate, quota=args.quota, port=port)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8000)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = server_from_arguments(args, port=args.port)
+    print('Serving {} articles and {} comments at {}'.format(len(server.articles), server.number_comments, server.url))
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,294 @@
+import os
+import sys
+import gzip
+import pickle
+import tempfile
+
+from nytcomments.lazy import pd, np
+
+from nytcomments.dataprocessing import comment_rows
+from nytcomments.metrics import Metrics
+
+# The final dtypes of the columns of the comments' dataframe, as set by preprocess_comments_dataframe,
+# along with the values used for the missing ones. The columns of the kind 'codes' are stored as the
+# codes of their sorted categories and the other columns are left as they come from the API.
+COMMENTS_SCHEMA = {
+    'approveDate': ('int64', 0),
+    'articleID': ('category', None),
+    'articleWordCount': ('int64', 0),
+    'commentID': ('int32', 0),
+    'commentTitle': ('category', None),
+    'commentType': ('category', None),
+    'createDate': ('int64', 0),
+    'depth': ('int8', 1),
+    'inReplyTo': ('int32', 0),
+    'newDesk': ('category', 'Unknown'),
+    'parentID': ('category', 0),
+    'parentUserDisplayName': ('category', None),
+    'permID': ('category', None),
+    'picURL': ('category', None),
+    'printPage': ('int32', 0),
+    'recommendations': ('int16', 0),
+    'recommendedFlag': ('category', None),
+    'replyCount': ('int8', 0),
+    'reportAbuseFlag': ('category', None),
+    'sectionName': ('category', 'Unknown'),
+    'sharing': ('codes', None),
+    'status': ('category', None),
+    'timespeople': ('codes', None),
+    'trusted': ('codes', None),
+    'typeOfMaterial': ('category', 'Unknown'),
+    'updateDate': ('int64', 0),
+    'userDisplayName': ('category', None),
+    'userID': ('category', None),
+    'userLocation': ('category', None),
+    'userTitle': ('category', None),
+    'userURL': ('category', None),
+}
+
+
+class CommentAccumulator(object):
+    '''Collects the comments as returned by the API, along with all their nested replies, directly
+    into per-column buffers that already have the final dtypes of the comments' dataframe: numpy
+    arrays for the numeric columns and integer codes with a dictionary of values for the categorical
+    ones. The buffers grow by doubling, and to_dataframe builds the dataframe from them once, with
+    the same dtypes as preprocess_comments_dataframe, so no intermediate dataframes are created.
+    The time spent is added to the phases 'accumulate' and 'comments_dataframe' of the metrics.
+
+    If max_memory is given (in bytes), the buffers are written to a compressed chunk in a temporary
+    directory (in spill_dir, if given) and emptied whenever they take more memory than that. The
+    chunks are read back one at a time by to_dataframe, and deleted with the accumulator.
+
+    If a vocabulary is given (see nytcomments.vocabulary.Vocabulary), the values of its columns are
+    coded by it, and the categories of each of them are the values used, in the order of their codes.'''
+
+    def __init__(self, capacity=1024, schema=COMMENTS_SCHEMA, metrics=None, max_memory=None, spill_dir=None,
+                 vocabulary=None):
+        self.schema = schema
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.initial_capacity = capacity
+        self.capacity = capacity
+        self.size = 0
+        self.columns = {} # Column name -> numpy array, or list for the columns outside the schema
+        self.categories = {} # Column name -> dictionary mapping each value to its code
+        self.object_bytes = 0 # Approximate size of the values in the lists
+        self.max_memory = max_memory
+        self.spill_dir = spill_dir
+        self.spilled = None # The temporary directory of the chunks
+        self.chunks = [] # The tuples (filename, number of rows) of the chunks
+        self.vocabulary = vocabulary
+
+    def __len__(self):
+        return self.size + sum(rows for _, rows in self.chunks)
+
+    @property
+    def nbytes(self):
+        '''The approximate memory taken by the buffers in bytes.'''
+
+        return self.object_bytes + sum(column.nbytes if isinstance(column, np.ndarray) else 8 * len(column)
+                                       for column in self.columns.values())
+
+    def append(self, comments, **constants):
+        '''Appends the comments on an article (as returned by the API) and all the replies nested in
+        them. The keyword arguments give the values of the columns shared by all the comments, such
+        as articleID.'''
+
+        with self.metrics.timer('accumulate'):
+            self._append(comments, constants)
+        if self.max_memory and (self.nbytes > self.max_memory):
+            self.spill()
+
+    def _append(self, comments, constants):
+        rows, in_reply_to, depths = comment_rows(comments)
+        if not rows:
+            return
+
+        number_rows = len(rows)
+        self._reserve(number_rows)
+        start, end = self.size, self.size + number_rows
+
+        names = {'inReplyTo', 'depth'}
+        for row in rows:
+            names.update(row)
+        names.discard('replies')
+        names.update(constants)
+        for name in self.columns:
+            names.add(name)
+
+        for name in names:
+            if name == 'inReplyTo':
+                values = in_reply_to
+            elif name == 'depth':
+                values = depths
+            elif name in constants:
+                values = [constants[name]] * number_rows
+            else:
+                values = [row.get(name) for row in rows]
+            self._write(name, start, end, values)
+        self.size = end
+
+    def _reserve(self, number_rows):
+        '''Makes room in the buffers for the given number of rows.'''
+
+        if self.size + number_rows <= self.capacity:
+            return
+        while self.size + number_rows > self.capacity:
+            self.capacity *= 2
+        for name, column in self.columns.items():
+            if isinstance(column, np.ndarray):
+                buffer = np.empty(self.capacity, dtype=column.dtype)
+                buffer[:self.size] = column[:self.size]
+                self.columns[name] = buffer
+
+    def _write(self, name, start, end, values):
+        '''Writes the values of the column in the rows from start to end.'''
+
+        kind, default = self.schema.get(name, ('object', None))
+        column = self.columns.get(name)
+        if column is None:
+            column = self._new_column(name, kind, default)
+
+        if kind in ('category', 'codes'):
+            codes = self.categories[name]
+            if default is not None:
+                values = [default if value is None else value for value in values]
+            column[start:end] = [-1 if value is None else codes.setdefault(value, len(codes)) for value in values]
+        elif kind == 'object':
+            column.extend(values)
+            self.object_bytes += sum(map(sys.getsizeof, values))
+        else:
+            column[start:end] = [default if value is None else int(value) for value in values]
+
+    def _new_column(self, name, kind, default):
+        '''Creates the buffer of a column, with the missing values for the rows appended earlier.'''
+
+        if kind == 'object':
+            column = [None] * self.size
+        elif kind in ('category', 'codes'):
+            codes = self._codes(name) # The codes are kept when the buffers are spilled
+            column = np.full(self.capacity, -1, dtype='int32')
+            if (default is not None) & (self.size > 0):
+                column[:self.size] = codes.setdefault(default, len(codes))
+        else:
+            column = np.full(self.capacity, default, dtype=kind)
+        self.columns[name] = column
+        return column
+
+    def _codes(self, name):
+        '''Returns the dictionary mapping the values of the categorical column to their codes.'''
+
+        if name not in self.categories:
+            self.categories[name] = self.vocabulary.codes(name) if self._coded(name) else {}
+        return self.categories[name]
+
+    def _coded(self, name):
+        '''Returns whether the categorical column is coded by the vocabulary.'''
+
+        return (self.vocabulary is not None) and (name in self.vocabulary)
+
+    def spill(self):
+        '''Writes the rows in the buffers to a compressed chunk on disk and empties the buffers.
+        The dictionaries of the categorical values stay in memory.'''
+
+        if not self.size:
+            return
+        with self.metrics.timer('spill'):
+            if self.spilled is None:
+                self.spilled = tempfile.TemporaryDirectory(prefix='nytcomments-', dir=self.spill_dir)
+            filename = os.path.join(self.spilled.name, 'chunk-{}.pickle.gz'.format(len(self.chunks)))
+            with gzip.open(filename, 'wb', compresslevel=3) as file:
+                pickle.dump(self._buffered_columns(), file, protocol=pickle.HIGHEST_PROTOCOL)
+            self.chunks.append((filename, self.size))
+            self.metrics.count('spilled_rows', self.size)
+        self.size = 0
+        self.capacity = self.initial_capacity
+        self.columns = {}
+        self.object_bytes = 0
+
+    def _buffered_columns(self):
+        '''Returns the columns of the rows in the buffers.'''
+
+        return {name: column[:self.size] if isinstance(column, np.ndarray) else column
+                for name, column in self.columns.items()}
+
+    def _merged_columns(self):
+        '''Reads the chunks back one at a time and returns the columns of all the rows.'''
+
+        parts = {}
+        rows = 0
+        chunks = [(filename, None) for filename, _ in self.chunks]
+        if self.size:
+            chunks.append((None, self._buffered_columns()))
+        for filename, columns in chunks:
+            if filename is not None:
+                with gzip.open(filename, 'rb') as file:
+                    columns = pickle.load(file)
+            chunk_rows = len(next(iter(columns.values()))) if columns else 0
+            for name in list(parts) + [name for name in columns if name not in parts]:
+                if name not in parts: # A column missing in the earlier chunks
+                    parts[name] = [self._missing_values(name, rows)] if rows else []
+                parts[name].append(columns[name] if name in columns else self._missing_values(name, chunk_rows))
+            rows += chunk_rows
+
+        merged = {}
+        for name, column_parts in parts.items():
+            if self.schema.get(name, ('object', None))[0] == 'object':
+                merged[name] = [value for part in column_parts for value in part]
+            else:
+                merged[name] = np.concatenate(column_parts)
+        return merged
+
+    def _missing_values(self, name, rows):
+        '''Returns the values of a column for the rows of a chunk that does not have it.'''
+
+        kind, default = self.schema.get(name, ('object', None))
+        if kind == 'object':
+            return [None] * rows
+        if kind in ('category', 'codes'):
+            codes = self._codes(name)
+            return np.full(rows, -1 if default is None else codes.setdefault(default, len(codes)), dtype='int32')
+        return np.full(rows, default, dtype=kind)
+
+    def to_dataframe(self):
+        '''Returns the dataframe of all the comments appended so far.'''
+
+        with self.metrics.timer('comments_dataframe'):
+            return self._to_dataframe()
+
+    def _to_dataframe(self):
+        if self.chunks:
+            columns = self._merged_columns()
+        else:
+            columns = self._buffered_columns()
+        data = {}
+        for name, column in columns.items():
+            kind, _ = self.schema.get(name, ('object', None))
+            if kind == 'object':
+                data[name] = pd.Series(column, dtype=None)
+            elif kind in ('category', 'codes'):
+                if self._coded(name) and (kind == 'codes'): # The codes of the vocabulary never change
+                    data[name] = column.copy() if not self.chunks else column
+                    continue
+                if self._coded(name):
+                    categorical = self.vocabulary.categorical(name, column)
+                else:
+                    categorical = _sorted_categorical(column, list(self.categories[name]))
+                data[name] = categorical.codes if kind == 'codes' else categorical
+            else:
+                data[name] = column.copy() if not self.chunks else column
+        return pd.DataFrame(data)
+
+
+def _sorted_categorical(codes, values):
+    '''Returns the categorical with the given codes into the values, with its categories sorted
+    as they are by astype('category').'''
+
+    categories = pd.Index(values)
+    try:
+        order = categories.argsort()
+    except TypeError: # The values can not be compared
+        return pd.Categorical.from_codes(codes, categories=categories)
+    new_codes = np.empty(len(order), dtype='int32')
+    new_codes[order] = np.arange(len(order), dtype='int32')
+    codes = np.where(codes >= 0, new_codes[np.maximum(codes, 0)] if len(order) else -1, -1)
+    return pd.Categorical.from_codes(codes, categories=categories[order])
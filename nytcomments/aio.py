@@ -0,0 +1,475 @@
+'''The asyncio counterparts of get_dataset, get_comments, get_articles and retrieve_comments. They
+send the requests through an AsyncClient (see nytcomments.aioclient) and share the parsing and
+the processing with the synchronous functions, so they return the same dataframes. The retrieval
+stops cleanly when the task running it is cancelled. Checkpointing, sharding and saving are only
+available in the synchronous functions.'''
+
+import sys
+import asyncio
+
+from json.decoder import JSONDecodeError
+from requests.exceptions import HTTPError, ConnectionError as RequestsConnectionError
+
+from nytcomments.lazy import pd
+
+from nytcomments.dataprocessing import get_replies, preprocess_articles, count_comments, limit_comments, article_columns, \
+    count_old_comments, merge_pages, dataset_batch
+from nytcomments.accumulator import CommentAccumulator
+from nytcomments.ratelimit import ARTICLES, COMMENTS
+from nytcomments.aioclient import AsyncClient
+from nytcomments.jsonp import parse_comments_page
+from nytcomments.metrics import QUOTA_HIT
+from nytcomments.nytcomments import NYT_ARTICLE_API_URL, COMMENTS_URL, set_parameters
+
+
+async def aget_dataset(ARTICLE_API_KEY, page_lower=0, page_upper=30, begin_date=None, end_date=None,
+                       sort='newest', query=None, filter_query=None, max_comments=100000, max_articles=10000,
+                       printout=True, workers=1, page_workers=1, client=None, normalized=False,
+                       vocabulary=None, keywords_table=False):
+    '''Returns the same dataframes as get_dataset. The comments on up to `workers` articles
+    are retrieved at a time, and the pages of comments on each article up to `page_workers`
+    at a time. If no client is given, one is opened for the call with the default rate limiter.'''
+
+    async with _client(client) as client:
+        articles_list = []
+        comments_data = CommentAccumulator(metrics=client.metrics, vocabulary=vocabulary)
+        results = _acrawl_dataset(ARTICLE_API_KEY, page_lower, page_upper, begin_date, end_date, sort, query,
+                                  filter_query, max_comments, max_articles, printout, workers, page_workers, client)
+        try:
+            async for article, comments in results:
+                articles_list.append(article)
+                comments_data.append(comments, **article_columns(article, normalized))
+        finally:
+            await results.aclose()
+
+        if articles_list:
+            batch = dataset_batch(articles_list, comments_data, client.metrics, vocabulary, keywords_table)
+        elif keywords_table:
+            batch = pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
+        else:
+            batch = pd.DataFrame(), pd.DataFrame()
+    if printout:
+        print()
+        print("Total articles stored: ", batch[0].shape[0])
+        print("Total comments retrieved: ", batch[1].shape[0])
+    return batch
+
+
+async def aget_comments(article_urls, max_comments=50000, printout=True, workers=1, page_workers=1, client=None,
+                        last_seen=None, refresh_window=0, vocabulary=None):
+    '''Returns the same dataframe of the comments on the article(s) as get_comments.'''
+
+    async with _client(client) as client:
+        comments_df = pd.DataFrame()
+        comments_data = CommentAccumulator(metrics=client.metrics, vocabulary=vocabulary)
+        results = _acrawl_comments(article_urls, max_comments, printout, workers, page_workers, client,
+                                   last_seen, refresh_window)
+        try:
+            async for comments in results:
+                comments_data.append(comments)
+        finally:
+            await results.aclose()
+        if len(comments_data):
+            comments_df = comments_data.to_dataframe()
+    if printout:
+        print()
+        print("Total comments retrieved: ", comments_df.shape[0])
+    return comments_df
+
+
+async def aget_articles(ARTICLE_API_KEY, page_lower=0, page_upper=50, begin_date=None, end_date=None,
+                        sort='newest', query=None, filter_query=None, max_articles=10000, printout=True,
+                        client=None, keywords_table=False):
+    '''Returns the same dataframe of the articles as get_articles.'''
+
+    articles_df = pd.DataFrame()
+    keywords_df = pd.DataFrame()
+    params, DateError = set_parameters(ARTICLE_API_KEY, page_lower, page_upper, begin_date, end_date,
+                    sort, query, filter_query)
+    if not DateError:
+        async with _client(client) as client:
+            articles_list = await _acrawl_articles(params, page_lower, page_upper, max_articles, printout, client)
+        if articles_list and keywords_table:
+            articles_df, keywords_df = preprocess_articles(articles_list, keywords_table=True)
+        elif articles_list:
+            articles_df = preprocess_articles(articles_list)
+        if printout:
+            print()
+            print("Total articles stored: ", articles_df.shape[0])
+    if keywords_table:
+        return articles_df, keywords_df
+    return articles_df
+
+
+async def aretrieve_comments(article_url, printout=True, page_workers=1, client=None, since=None, refresh_window=0):
+    '''Returns the same tuple (comments_df, error) for the article as retrieve_comments.'''
+
+    async with _client(client) as client:
+        comments_df = pd.DataFrame()
+        comments, error = await _aretrieve_records(article_url, printout, page_workers, client, since, refresh_window)
+        if comments:
+            with client.metrics.timer('replies'):
+                comments_df = pd.DataFrame(comments)
+                comments_df['inReplyTo'] = None
+                comments_df = get_replies(comments_df)
+    return comments_df, error
+
+
+class _client(object):
+    '''Uses the given client, or opens one for the call and closes it at the end.'''
+
+    def __init__(self, client):
+        self.client = client
+        self.owned = client is None
+
+    async def __aenter__(self):
+        if self.owned:
+            self.client = AsyncClient()
+        return self.client
+
+    async def __aexit__(self, *exc_info):
+        if self.owned:
+            await self.client.close()
+
+
+async def _acrawl_dataset(ARTICLE_API_KEY, page_lower, page_upper, begin_date, end_date, sort, query, filter_query,
+                          max_comments, max_articles, printout, workers, page_workers, client):
+    '''Yields the tuples (article, comments) like _crawl_dataset.'''
+
+    total_comments = 0
+    total_articles = 0
+    HTTPErrorCount = 0
+    error = False
+
+    params, DateError = set_parameters(ARTICLE_API_KEY, page_lower, page_upper, begin_date, end_date,
+                    sort, query, filter_query)
+    if DateError:
+        return
+
+    for page in range(page_lower, page_upper):
+        if total_articles >= max_articles:
+            if printout:
+                print('Maximum limit of {} for the articles have exceeded. Terminating retrieval.'.format(max_articles))
+                print()
+            break
+        if total_comments >= max_comments:
+            if printout:
+                print('Maximum limit of {} for the comments have exceeded. Terminating retrieval.'.format(max_comments))
+                print()
+            break
+        params['page'] = page # Every page has 10 articles
+        if printout:
+            print("Page: ", page)
+        try:
+            response = await client.get(NYT_ARTICLE_API_URL, params, ARTICLES)
+            with client.metrics.timer('parse'):
+                js = response.json()
+
+            # Check whether API rate limit has exceeded
+            if js.get('message'):
+                client.metrics.emit(QUOTA_HIT, endpoint=ARTICLES, message=js.get('message'))
+                if printout:
+                    print()
+                    print(js.get('message') + ' for today. No more comments can be retrieved using the article search today, however the function get_comments can be used to retrieve further comments w/o limit if the list of URL(s) of the article(s) are provided to the function.')
+                break
+
+            if js.get('status') == 'OK':
+                docs = js['response']['docs']
+                if not docs:
+                    if printout:
+                        print("No aricles found on page", page)
+                    break
+                articles = [doc for doc in docs if doc['document_type'] != 'multimedia'] # Ignore multimedia articles
+                article_urls = [article['web_url'] for article in articles]
+
+                results = _aretrieve_in_order(article_urls, workers=workers, page_workers=page_workers,
+                                              client=client, printout=printout,
+                                              remaining=lambda: max_comments - total_comments)
+                try:
+                    index = 0
+                    async for _, comments, error in results:
+                        article = articles[index]
+                        index += 1
+                        comments = limit_comments(comments, max_comments - total_comments)
+                        number_comments = count_comments(comments)
+                        if number_comments: # Check if the article has comments
+                            total_articles += 1
+                            total_comments += number_comments
+                            yield article, comments
+                        if error:
+                            break
+                        if (total_articles >= max_articles) or (total_comments >= max_comments):
+                            break # The limits are checked before the next page
+                finally:
+                    await results.aclose()
+                if error:
+                    break
+        except (ConnectionError, RequestsConnectionError):
+            if printout:
+                print('ConnectionError: Retrieval interrupted.')
+                print()
+            break
+        except HTTPError:
+            HTTPErrorCount += 1
+            if HTTPErrorCount < 5:
+                if printout:
+                    print('HTTPError:', sys.exc_info()[1])
+                    print("Page {} is skipped. Retrival is continued from the next page.".format(page))
+                    print()
+            else:
+                if printout:
+                    print(sys.exc_info()[1])
+                    print("Retrival is terminated due to repeated HTTP errors.")
+                    print()
+                break
+        except JSONDecodeError:
+            if printout:
+                print('JSONDecodeError: Retrieval interrupted.')
+                print()
+            break
+        except Exception: # The cancellation is not caught
+            if printout:
+                print(sys.exc_info()[0], sys.exc_info()[1])
+                print("Page {} is skipped. Retrival is continued from the next page.".format(page))
+                print()
+
+
+async def _acrawl_comments(article_urls, max_comments, printout, workers, page_workers, client,
+                           last_seen, refresh_window):
+    '''Yields the lists of comments on the given articles that have comments, like _crawl_comments.'''
+
+    total_comments = 0
+    if type(article_urls) is str:
+        since = last_seen.get(article_urls) if last_seen else None
+        comments, _ = await _aretrieve_records(article_urls, printout, page_workers, client, since,
+                                               refresh_window, max_comments)
+        if count_comments(comments):
+            yield comments
+        return
+
+    results = _aretrieve_in_order(article_urls, workers=workers, page_workers=page_workers, client=client,
+                                  printout=printout, last_seen=last_seen, refresh_window=refresh_window,
+                                  remaining=lambda: max_comments - total_comments)
+    try:
+        async for _, comments, error in results:
+            comments = limit_comments(comments, max_comments - total_comments)
+            number_comments = count_comments(comments)
+            if number_comments: # Check if the article has comments
+                total_comments += number_comments
+                yield comments
+            if error:
+                break
+            if total_comments >= max_comments:
+                if printout:
+                    print('Maximum limit of {} for the comments have exceeded. Terminating retrieval.'.format(max_comments))
+                    print()
+                break
+    finally:
+        await results.aclose()
+
+
+async def _acrawl_articles(params, page_lower, page_upper, max_articles, printout, client):
+    '''Returns the list of the articles found on the pages of the article search, like _crawl_articles.'''
+
+    articles_list = []
+    HTTPErrorCount = 0
+
+    for page in range(page_lower, page_upper):
+        if len(articles_list) >= max_articles:
+            if printout:
+                print('Maximum limit of {} for the articles have exceeded. Terminating retrieval.'.format(max_articles))
+            break
+        params['page'] = page # Every page has 10 articles
+        if printout:
+            print("Page: ", page)
+        try:
+            response = await client.get(NYT_ARTICLE_API_URL, params, ARTICLES)
+            with client.metrics.timer('parse'):
+                js = response.json()
+
+            if js.get('message'):
+                client.metrics.emit(QUOTA_HIT, endpoint=ARTICLES, message=js.get('message'))
+                if printout:
+                    print('NYT' + js.get('message') + 'for today. No more comments can be retrieved using the article search today, however the function get_comments can be used to retrieve further comments w/o limit if the URLs of the articles are given to the function manually.')
+                break
+
+            if js.get('status') == 'OK':
+                docs = js['response']['docs']
+                if not docs:
+                    if printout:
+                        print("No articles found on page", page)
+                    break
+                articles_list.extend(docs)
+                if printout:
+                    for article in docs:
+                        print("Article url:", article['web_url'])
+        except (ConnectionError, RequestsConnectionError):
+            if printout:
+                print('ConnectionError: Retrieval interrupted.')
+            break
+        except HTTPError:
+            HTTPErrorCount += 1
+            if HTTPErrorCount < 5:
+                if printout:
+                    print(sys.exc_info()[1], ". Page {} is skipped. Retrival is continued from the next page.".format(page))
+                    print()
+            else:
+                if printout:
+                    print(sys.exc_info()[1], ". Retrival is terminated due to repeated HTTP errors.")
+                    print()
+                break
+        except Exception: # The cancellation is not caught
+            if printout:
+                print(sys.exc_info()[0], sys.exc_info()[1])
+                print("Page {} is skipped. Retrival is continued from the next page.".format(page))
+                print()
+    return articles_list
+
+
+async def _aretrieve_records(article_url, printout=True, page_workers=1, client=None, since=None,
+                             refresh_window=0, max_comments=None):
+    '''Returns the tuple (comments, error) for the article like _retrieve_records.'''
+
+    if (max_comments is not None) and (max_comments <= 0):
+        return [], False
+
+    offset = 0
+    pages = []
+    error = False
+    retrieved = 0
+    old_comments = 0
+    while True:
+        if (max_comments is not None) and (retrieved >= max_comments):
+            break # Stop paging once there are enough comments
+        try:
+            results = await _arequest_comments_page(article_url, offset, client)
+            if results is not None:
+                if not results['totalCommentsReturned']:
+                    break # Break when no comments are returned
+                comments = results['comments']
+                pages.append(comments)
+                retrieved += count_comments(comments)
+                if since:
+                    old_comments += count_old_comments(comments, since)
+                    if old_comments > refresh_window:
+                        break # Break when the older comments are reached
+                if (page_workers > 1) & (offset == 0) & (since is None):
+                    async for offset, results in _aprefetch_comments_pages(article_url, results, page_workers,
+                                                                           client, max_comments):
+                        if results['totalCommentsReturned']:
+                            pages.append(results['comments'])
+                            retrieved += count_comments(results['comments'])
+                    if (max_comments is not None) and (retrieved >= max_comments):
+                        break
+                    if results['totalCommentsReturned'] < 25:
+                        break # The last page is not full, so there are no more comments
+            offset = offset + 25
+        except (ConnectionError, RequestsConnectionError):
+            error = True
+            if printout:
+                print('ConnectionError: Retrieval interrupted.')
+                print()
+            break
+        except HTTPError:
+            if printout:
+                print(sys.exc_info()[1])
+                print("Article with the URL {} is skipped. Retrival is continued from the next article.".format(article_url))
+                print()
+            break
+        except JSONDecodeError:
+            error = True
+            if printout:
+                print('JSONDecodeError: Retrieval interrupted.')
+                print()
+            break
+        except Exception: # The cancellation is not caught
+            error = True
+            if printout:
+                print(sys.exc_info()[0], sys.exc_info()[1])
+            break
+
+    comments = merge_pages(article_url, pages, error, printout, client.metrics, since, refresh_window, max_comments)
+    return comments, error
+
+
+async def _arequest_comments_page(article_url, offset, client):
+    '''Requests a page of comments on the article like _request_comments_page.'''
+
+    params = {'sort': "newest", 'offset': offset, 'url': article_url}
+    response = await client.get(COMMENTS_URL, params, COMMENTS)
+    with client.metrics.timer('parse'):
+        js = parse_comments_page(response.content)
+    if js['status'] == 'OK':
+        return js['results']
+    return None
+
+
+async def _aprefetch_comments_pages(article_url, results, page_workers, client, max_comments=None):
+    '''Requests the remaining pages of comments on the article, up to page_workers at a time,
+    and yields the tuples (offset, results) in the order of the offsets, like
+    _prefetch_comments_pages.'''
+
+    total_comments = results.get('totalParentCommentsFound', results.get('totalCommentsFound', 0))
+    if max_comments is not None:
+        total_comments = min(total_comments, max_comments)
+    offsets = range(25, total_comments, 25)
+    semaphore = asyncio.Semaphore(page_workers)
+
+    async def request(offset):
+        async with semaphore:
+            return await _arequest_comments_page(article_url, offset, client)
+
+    tasks = [asyncio.ensure_future(request(offset)) for offset in offsets]
+    try:
+        for offset, task in zip(offsets, tasks):
+            results = await task
+            if results is not None:
+                yield offset, results
+    finally:
+        await _cancel(tasks)
+
+
+async def _aretrieve_in_order(article_urls, workers=1, printout=True, last_seen=None, remaining=None, **kwargs):
+    '''Yields the tuples (article_url, comments, error) for the given urls in the same order as the
+    urls, retrieving the comments on up to `workers` articles at a time, like _retrieve_in_order.'''
+
+    semaphore = asyncio.Semaphore(max(workers, 1))
+
+    async def retrieve(article_url):
+        async with semaphore:
+            since = last_seen.get(article_url) if last_seen else None
+            max_comments = remaining() if remaining else None
+            return await _aretrieve_records(article_url, printout=printout, since=since, max_comments=max_comments,
+                                            **kwargs)
+
+    if workers <= 1:
+        for article_url in article_urls:
+            comments, error = await retrieve(article_url)
+            yield article_url, comments, error
+        return
+
+    article_urls = iter(article_urls)
+    pending = []
+    try:
+        for article_url in article_urls:
+            pending.append((article_url, asyncio.ensure_future(retrieve(article_url))))
+            if len(pending) >= workers:
+                break
+        while pending:
+            article_url, task = pending.pop(0)
+            for next_url in article_urls: # Keep the workers busy
+                pending.append((next_url, asyncio.ensure_future(retrieve(next_url))))
+                break
+            comments, error = await task
+            yield article_url, comments, error
+    finally:
+        await _cancel([task for _, task in pending])
+
+
+async def _cancel(tasks):
+    '''Cancels the tasks that are not done and waits for them to finish.'''
+
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,213 @@
+import asyncio
+import requests
+
+from time import perf_counter
+from urllib.parse import urlencode, urlsplit, urlunsplit
+
+from nytcomments.client import build_response
+from nytcomments.ratelimit import default_rate_limiter, parse_retry_after
+from nytcomments.metrics import Metrics, PAGE_FETCHED, RETRY, QUOTA_HIT
+
+TRANSPORTS = ('aiohttp', 'httpx')
+
+
+class AsyncClient(object):
+    '''The asyncio counterpart of nytcomments.client.Client, used by the functions of
+    nytcomments.aio. The requests are sent with aiohttp or httpx (whichever is installed, or
+    the one given as transport), at most `concurrency` at a time, and wait for the rate limiter
+    with asyncio.sleep, so nothing blocks the event loop and the retrieval can be cancelled at
+    any point. The retries, the backoff, the metrics, the archive and the cache work as in
+    Client, with the disk access of the archive and the cache run in the default executor of
+    the loop, and the rate limiter can be shared with the synchronous clients.
+
+    The connections are opened in the running event loop, so a client is used in a single loop
+    and closed with `await client.close()` (or used with `async with`).'''
+
+    def __init__(self, transport=None, rate_limiter=None, timeout=(10, 60), max_retries=5,
+                 backoff_factor=1., concurrency=16, base_url=None, metrics=None, archive=None, cache=None):
+        if transport is None:
+            transport = _installed_transport()
+        elif transport not in TRANSPORTS:
+            raise ValueError('Invalid transport {}. The transport must be one of: {}.'.format(
+                transport, ', '.join(TRANSPORTS)))
+        if rate_limiter is None:
+            rate_limiter = default_rate_limiter
+        if not isinstance(timeout, tuple):
+            timeout = (timeout, timeout)
+        self.transport = transport
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.concurrency = concurrency
+        self.base_url = base_url
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.archive = archive
+        self.cache = cache
+        self.session = None
+        self.semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _open(self):
+        '''Opens the session of the transport in the running event loop.'''
+
+        if self.transport == 'aiohttp':
+            self.session = _AiohttpSession(self.timeout, self.concurrency)
+        else:
+            self.session = _HttpxSession(self.timeout, self.concurrency)
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+
+    async def get(self, url, params, endpoint):
+        '''Requests the url with the given parameters from the endpoint (ARTICLES or COMMENTS)
+        and returns the response as a requests.Response. Raises the same exceptions as
+        Client.get: requests.HTTPError for the error responses, including HTTP 429, and
+        requests.ConnectionError or requests.Timeout once the retries are exhausted.'''
+
+        if self.session is None:
+            self._open()
+        metrics = self.metrics
+        loop = asyncio.get_running_loop()
+        if self.cache is not None:
+            with metrics.timer('cache'):
+                content = await loop.run_in_executor(None, self.cache.get, endpoint, url, params)
+            if content is not None:
+                metrics.count('cache_hits')
+                await self._archive(endpoint, params, content)
+                return build_response(url, content)
+            metrics.count('cache_misses')
+
+        if self.base_url:
+            url = urlunsplit(urlsplit(self.base_url)[:2] + urlsplit(url)[2:])
+        full_url = url + ('&' if '?' in url else '?') + urlencode(params) # Appended like requests does
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            with metrics.timer('throttle'):
+                await asyncio.sleep(self.rate_limiter.reserve(endpoint))
+            start = perf_counter()
+            try:
+                async with self.semaphore:
+                    status_code, headers, content = await self.session.get(full_url)
+            except self.session.timeouts as error:
+                metrics.add_time('network', perf_counter() - start)
+                if last_attempt:
+                    raise requests.Timeout(str(error) or type(error).__name__) from error
+                await self._retry(endpoint, url, attempt, type(error).__name__)
+                continue
+            except self.session.errors as error:
+                metrics.add_time('network', perf_counter() - start)
+                if last_attempt:
+                    raise requests.ConnectionError(str(error) or type(error).__name__) from error
+                await self._retry(endpoint, url, attempt, type(error).__name__)
+                continue
+            seconds = perf_counter() - start
+            metrics.add_time('network', seconds)
+            metrics.count('requests')
+            metrics.count('{}_requests'.format(endpoint))
+            metrics.count('bytes', len(content))
+            response = build_response(full_url, content, status_code, headers)
+
+            if status_code == 429:
+                self.rate_limiter.penalize(endpoint, parse_retry_after(response.headers.get('Retry-After')))
+                metrics.count('throttled')
+                if last_attempt:
+                    metrics.emit(QUOTA_HIT, endpoint=endpoint, message='HTTP 429 Too Many Requests')
+                    response.raise_for_status()
+                await self._retry(endpoint, url, attempt, 'HTTP 429', backoff=False)
+                continue
+
+            if (status_code >= 500) & (not last_attempt):
+                await self._retry(endpoint, url, attempt, 'HTTP {}'.format(status_code))
+                continue
+
+            self.rate_limiter.reward(endpoint)
+            response.raise_for_status()
+            metrics.emit(PAGE_FETCHED, endpoint=endpoint, url=url, status=status_code,
+                         bytes=len(content), seconds=seconds)
+            await self._archive(endpoint, params, content)
+            if self.cache is not None:
+                with metrics.timer('cache'):
+                    await loop.run_in_executor(None, self.cache.put, endpoint, url, params, content)
+            return response
+
+    async def _archive(self, endpoint, params, content):
+        '''Adds the content of a response, requested or read from the cache, to the archive.'''
+
+        if self.archive is not None:
+            with self.metrics.timer('archive'):
+                await asyncio.get_running_loop().run_in_executor(None, self.archive.add, endpoint, params, content)
+
+    async def _retry(self, endpoint, url, attempt, reason, backoff=True):
+        '''Records the retry of a request and, unless the rate limiter backs off instead, waits
+        before it with exponential backoff.'''
+
+        self.metrics.count('retries')
+        self.metrics.emit(RETRY, endpoint=endpoint, url=url, attempt=attempt + 1, reason=reason)
+        if backoff:
+            with self.metrics.timer('backoff'):
+                await asyncio.sleep(self.backoff_factor * 2**attempt)
+
+    async def close(self):
+        '''Closes the pooled connections.'''
+
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+def _installed_transport():
+    '''Returns the name of the first transport that is installed.'''
+
+    for transport in TRANSPORTS:
+        try:
+            __import__(transport)
+            return transport
+        except ImportError:
+            pass
+    raise ImportError('aiohttp or httpx is required for the asyncio functions. '
+                      'One of them can be installed with: pip install aiohttp')
+
+
+class _AiohttpSession(object):
+    '''Sends the requests with an aiohttp session.'''
+
+    def __init__(self, timeout, pool_size):
+        import aiohttp
+        import yarl
+        self.timeouts = (asyncio.TimeoutError,)
+        self.errors = (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)
+        self.session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1]),
+            connector=aiohttp.TCPConnector(limit=pool_size),
+            headers={'Accept-Encoding': 'gzip, deflate'})
+        self.url = yarl.URL
+
+    async def get(self, url):
+        async with self.session.get(self.url(url, encoded=True)) as response:
+            return response.status, dict(response.headers), await response.read()
+
+    async def close(self):
+        await self.session.close()
+
+
+class _HttpxSession(object):
+    '''Sends the requests with an httpx client.'''
+
+    def __init__(self, timeout, pool_size):
+        import httpx
+        self.timeouts = (httpx.TimeoutException,)
+        self.errors = (httpx.TransportError,)
+        self.session = httpx.AsyncClient(timeout=httpx.Timeout(timeout[1], connect=timeout[0]),
+                                         limits=httpx.Limits(max_connections=pool_size),
+                                         headers={'Accept-Encoding': 'gzip, deflate'})
+
+    async def get(self, url):
+        response = await self.session.get(url)
+        return response.status_code, dict(response.headers), response.content
+
+    async def close(self):
+        await self.session.aclose()
@@ -0,0 +1,201 @@
+import os
+import glob
+import gzip
+import json
+import time
+import uuid
+import sqlite3
+import threading
+
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+
+from nytcomments.lazy import pd
+
+from nytcomments.ratelimit import ARTICLES, COMMENTS
+from nytcomments.jsonp import loads, unwrap_jsonp
+from nytcomments.accumulator import CommentAccumulator
+from nytcomments.dataprocessing import preprocess_articles, article_columns
+
+INDEX_FILENAME = 'index.sqlite'
+SEGMENT_SIZE = 64 * 1024**2 # Uncompressed bytes written to a segment before the next one is started
+
+
+class PayloadArchive(object):
+    '''Stores the raw payloads of the article search and the comments endpoint in the given
+    directory, as they arrive, so that the datasets can be rebuilt later without requesting them
+    again (see rebuild_dataset). Pass it as the archive of nytcomments.client.Client.
+
+    Every payload is appended as a line of JSON, with the endpoint, the parameters of the request
+    (without the API key) and the time, to gzipped segments that are never modified once written.
+    Every run writes its own segments, so several processes can share the directory. An index in
+    a SQLite database records the segment and line of each payload by the URL of the article and
+    the offset (or by the search and the page), along with the ID of every article found.'''
+
+    def __init__(self, directory, segment_size=SEGMENT_SIZE):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_size = segment_size
+        self.run = uuid.uuid4().hex[:8]
+        self.lock = threading.Lock()
+        self.segment = -1
+        self.file = None
+        self.line = 0
+        self.written = 0
+        self.connection = sqlite3.connect(os.path.join(directory, INDEX_FILENAME), timeout=60,
+                                          check_same_thread=False)
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS payloads (segment TEXT, line INTEGER, endpoint TEXT, '
+                                    'url TEXT, offset INTEGER, fetched REAL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS payloads_url ON payloads (url, offset)')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS articles (article_id TEXT PRIMARY KEY, url TEXT)')
+
+    def add(self, endpoint, params, content):
+        '''Appends the raw content of a response from the endpoint (ARTICLES or COMMENTS) to the
+        requests with the given parameters.'''
+
+        params = {key: value for key, value in params.items() if key != 'api-key'}
+        if endpoint == COMMENTS:
+            payload = unwrap_jsonp(content).tobytes()
+            url, offset = params.get('url'), params.get('offset', 0)
+            articles = []
+        else:
+            payload = bytes(content)
+            page_params = {key: value for key, value in params.items() if key != 'page'}
+            url, offset = json.dumps(page_params, sort_keys=True), params.get('page', 0)
+            articles = [(doc['_id'], doc.get('web_url')) for doc in loads(payload).get('response', {}).get('docs', [])]
+        fetched = time.time()
+        # The payload is valid JSON, so replacing the line breaks (which can only be whitespace) keeps it valid
+        line = b'{"endpoint": %s, "params": %s, "fetched": %r, "payload": %s}\n' % (
+            json.dumps(endpoint).encode(), json.dumps(params, sort_keys=True).encode(), fetched,
+            payload.replace(b'\n', b' ').replace(b'\r', b' '))
+
+        with self.lock:
+            if (self.file is None) or (self.written >= self.segment_size):
+                self._next_segment()
+            self.file.write(line)
+            self.file.flush()
+            self.written += len(line)
+            with self.connection:
+                self.connection.execute('INSERT INTO payloads VALUES (?, ?, ?, ?, ?, ?)',
+                                        (self.segment_name, self.line, endpoint, url, offset, fetched))
+                self.connection.executemany('INSERT OR REPLACE INTO articles VALUES (?, ?)', articles)
+            self.line += 1
+
+    def _next_segment(self):
+        '''Closes the current segment and starts the next one.'''
+
+        if self.file is not None:
+            self.file.close()
+        self.segment += 1
+        self.segment_name = 'segment-{}-{:04d}.jsonl.gz'.format(self.run, self.segment)
+        self.file = gzip.open(os.path.join(self.directory, self.segment_name), 'ab')
+        self.line = 0
+        self.written = 0
+
+    def comment_pages(self, article):
+        '''Returns the list of tuples (offset, payload) of the pages of comments archived for the
+        article, given its URL or ID, sorted by offset (the latest payload of each offset).'''
+
+        with self.lock:
+            row = self.connection.execute('SELECT url FROM articles WHERE article_id = ?', (article,)).fetchone()
+            article_url = row[0] if row else article
+            rows = self.connection.execute('SELECT segment, line, offset FROM payloads WHERE endpoint = ? AND url = ? '
+                                           'ORDER BY offset, fetched', (COMMENTS, article_url)).fetchall()
+        pages = {}
+        for segment, line, offset in rows:
+            pages[offset] = read_payload(os.path.join(self.directory, segment), line)['payload']
+        return sorted(pages.items())
+
+    def close(self):
+        '''Closes the current segment and the index.'''
+
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self.connection.close()
+
+
+def read_payload(filename, line):
+    '''Returns the record at the given line of a segment.'''
+
+    with gzip.open(filename, 'rb') as file:
+        for record in islice(file, line, line + 1):
+            return loads(record)
+    raise KeyError('No line {} in the segment {}'.format(line, filename))
+
+
+def parse_segment(filename):
+    '''Parses a segment and returns the tuple (docs, pages), where docs maps the IDs of the articles
+    found to their latest docs, along with the time they were fetched, and pages maps the tuples
+    (article URL, offset) to the latest comments archived and the time they were fetched. A segment
+    cut short (by a crash during the retrieval) is read up to the last complete line.'''
+
+    docs = {}
+    pages = {}
+    try:
+        with gzip.open(filename, 'rb') as file:
+            for line in file:
+                try:
+                    record = loads(line)
+                except ValueError: # An incomplete last line
+                    break
+                payload, fetched = record['payload'], record['fetched']
+                if record['endpoint'] == ARTICLES:
+                    for doc in payload.get('response', {}).get('docs', []):
+                        if fetched >= docs.get(doc['_id'], (None, 0))[1]:
+                            docs[doc['_id']] = (doc, fetched)
+                elif payload.get('status') == 'OK':
+                    key = (record['params'].get('url'), int(record['params'].get('offset', 0)))
+                    if fetched >= pages.get(key, (None, 0))[1]:
+                        pages[key] = (payload['results'].get('comments', []), fetched)
+    except EOFError: # The end of the segment is missing
+        pass
+    return docs, pages
+
+
+def rebuild_dataset(archive, processes=None):
+    '''Rebuilds the articles' and comments' dataframes, as returned by get_dataset, from the payloads
+    in the archive directory, parsing the segments across a pool of processes (all the cores by
+    default). The comments' dataframe has the comments on all the archived articles, deduplicated,
+    with the columns of their articles when they were found by an archived search, and the articles'
+    dataframe has the archived articles with comments. Nothing is requested from the APIs.'''
+
+    segments = sorted(glob.glob(os.path.join(archive, 'segment-*.jsonl.gz')))
+    docs = {}
+    pages = {}
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        for segment_docs, segment_pages in executor.map(parse_segment, segments):
+            for article_id, (doc, fetched) in segment_docs.items():
+                if fetched >= docs.get(article_id, (None, 0))[1]:
+                    docs[article_id] = (doc, fetched)
+            for key, (comments, fetched) in segment_pages.items():
+                if fetched >= pages.get(key, (None, 0))[1]:
+                    pages[key] = (comments, fetched)
+
+    articles_by_url = {doc.get('web_url'): doc for doc, _ in docs.values() if doc.get('document_type') != 'multimedia'}
+    comments_by_url = {}
+    for (article_url, offset), (comments, _) in sorted(pages.items()):
+        comments_by_url.setdefault(article_url, []).extend(comments)
+
+    articles_list = []
+    comments_data = CommentAccumulator()
+    for article_url, comments in comments_by_url.items():
+        unique_comments = []
+        comment_ids = set()
+        for comment in comments:
+            if comment['commentID'] not in comment_ids: # Drop the duplicates
+                comment_ids.add(comment['commentID'])
+                unique_comments.append(comment)
+        if not unique_comments:
+            continue
+        article = articles_by_url.get(article_url)
+        if article is not None:
+            articles_list.append(article)
+        comments_data.append(unique_comments, **(article_columns(article) if article is not None else {}))
+
+    articles_df = pd.DataFrame()
+    if articles_list:
+        articles_df = preprocess_articles(articles_list)
+    return articles_df, comments_data.to_dataframe()
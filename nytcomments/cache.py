@@ -0,0 +1,172 @@
+import os
+import gzip
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from urllib.parse import urlsplit
+from requests.exceptions import HTTPError
+
+from nytcomments.jsonp import loads, parse_comments_page
+from nytcomments.ratelimit import ARTICLES, COMMENTS
+
+INDEX_FILENAME = 'index.sqlite'
+
+# The modes of the cache
+USE = 'use' # The fresh responses are read from the cache and the others are requested and stored
+REFRESH = 'refresh' # Every response is requested and stored, replacing the cached one
+CACHE_ONLY = 'cache_only' # Every response is read from the cache, however old, and nothing is requested
+MODES = (USE, REFRESH, CACHE_ONLY)
+
+
+def successful(endpoint, content):
+    '''Returns True if the content of a response of the endpoint is a payload with the status OK.
+    The APIs also answer with HTTP 200 when the daily quota is exhausted or a page of comments is
+    not available, with a message or another status.'''
+
+    try:
+        js = parse_comments_page(content) if endpoint == COMMENTS else loads(content)
+    except ValueError:
+        return False
+    return isinstance(js, dict) and (js.get('status') == 'OK')
+
+
+class CacheMiss(HTTPError):
+    '''Raised in the mode CACHE_ONLY for a request whose response is not in the cache. It is an
+    HTTPError, so the retrieval functions skip the page or the article as they do for a missing one.'''
+
+
+class ResponseCache(object):
+    '''Stores the content of the successful responses (see successful) in the given directory, so that the same
+    requests made again (by any of the retrieval functions) are answered from the disk instead of
+    the APIs. Pass it as the cache of nytcomments.client.Client.
+
+    The responses are addressed by a hash of the endpoint, the path of the URL and the parameters
+    of the request (without the API key, so it is shared by all the keys), and stored gzipped in a
+    file named by the hash. A SQLite index records when each one was stored and last used. The
+    responses of the article search expire after articles_ttl seconds and those of the comments
+    after comments_ttl seconds (None for never), and once the responses take more than max_size
+    bytes on disk, the least recently used ones are deleted. The mode is one of USE, REFRESH and
+    CACHE_ONLY.'''
+
+    def __init__(self, directory, articles_ttl=24 * 3600, comments_ttl=3600, max_size=1024**3, mode=USE):
+        if mode not in MODES:
+            raise ValueError('Invalid mode {}. The mode must be one of: {}.'.format(mode, ', '.join(MODES)))
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.ttls = {ARTICLES: articles_ttl, COMMENTS: comments_ttl}
+        self.max_size = max_size
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(os.path.join(directory, INDEX_FILENAME), timeout=60,
+                                          check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, endpoint TEXT, '
+                                    'size INTEGER, stored REAL, accessed REAL)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+
+    @staticmethod
+    def key(endpoint, url, params):
+        '''Returns the address of the response to the request.'''
+
+        params = sorted((str(key), str(value)) for key, value in params.items() if key != 'api-key')
+        request = json.dumps([endpoint, urlsplit(url).path, params])
+        return hashlib.sha256(request.encode()).hexdigest()
+
+    def _filename(self, key):
+        return os.path.join(self.directory, key[:2], key + '.gz')
+
+    def get(self, endpoint, url, params):
+        '''Returns the content of the cached response to the request, or None if there is no fresh
+        one (always None in the mode REFRESH). Raises CacheMiss instead in the mode CACHE_ONLY.'''
+
+        if self.mode == REFRESH:
+            return None
+        key = self.key(endpoint, url, params)
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute('SELECT stored FROM responses WHERE key = ?', (key,)).fetchone()
+            ttl = self.ttls.get(endpoint)
+            fresh = (row is not None) and ((self.mode == CACHE_ONLY) or (ttl is None) or (now - row[0] <= ttl))
+            if fresh:
+                with self.connection:
+                    self.connection.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+        content = None
+        if fresh:
+            try:
+                with gzip.open(self._filename(key), 'rb') as file:
+                    content = file.read()
+            except (OSError, EOFError): # Deleted by another process or cut short
+                content = None
+        if (content is None) and (self.mode == CACHE_ONLY):
+            raise CacheMiss('No cached response for {} with the parameters {}'.format(
+                url, {key: value for key, value in params.items() if key != 'api-key'}))
+        return content
+
+    def put(self, endpoint, url, params, content):
+        '''Stores the content of the response to the request and deletes the least recently used
+        responses if the cache is full. The responses that are not successful, such as the reply
+        of the article search once the quota is exhausted, are not stored, so they are requested
+        again. Returns True if the response is stored.'''
+
+        if not successful(endpoint, content):
+            return False
+        key = self.key(endpoint, url, params)
+        filename = self._filename(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        temporary = '{}.{}.{}.tmp'.format(filename, os.getpid(), threading.get_ident())
+        with gzip.open(temporary, 'wb', compresslevel=3) as file:
+            file.write(content)
+        size = os.path.getsize(temporary)
+        os.replace(temporary, filename) # Readers never see a file half-written
+        now = time.time()
+        with self.lock:
+            with self.connection:
+                self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                                        (key, endpoint, size, now, now))
+            self._evict()
+        return True
+
+    def _evict(self):
+        '''Deletes the least recently used responses until they fit in max_size.'''
+
+        if self.max_size is None:
+            return
+        total = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_size:
+            return
+        evicted = []
+        for key, size in self.connection.execute('SELECT key, size FROM responses ORDER BY accessed'):
+            if total <= self.max_size:
+                break
+            evicted.append(key)
+            total -= size
+        with self.connection:
+            self.connection.executemany('DELETE FROM responses WHERE key = ?', [(key,) for key in evicted])
+        for key in evicted:
+            try:
+                os.remove(self._filename(key))
+            except OSError:
+                pass
+
+    def clear(self):
+        '''Deletes all the cached responses.'''
+
+        with self.lock:
+            keys = [key for key, in self.connection.execute('SELECT key FROM responses')]
+            with self.connection:
+                self.connection.execute('DELETE FROM responses')
+        for key in keys:
+            try:
+                os.remove(self._filename(key))
+            except OSError:
+                pass
+
+    def close(self):
+        '''Closes the index.'''
+
+        with self.lock:
+            self.connection.close()
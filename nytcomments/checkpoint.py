@@ -0,0 +1,145 @@
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+
+from contextlib import contextmanager
+
+CHECKPOINT_FILENAME = 'checkpoint.sqlite'
+
+
+class CheckpointStore(object):
+    '''Records the progress of a crawl in a SQLite database in the given directory as the
+    data arrives: the article search pages, the pages of comments retrieved for each article
+    and the articles whose comments are completely retrieved, along with the parameters of the
+    search. A crawl is identified by its key, so several crawls can share the same directory. Unless `resume` is True, the records
+    of a previous crawl with the same key are discarded. Once the store is closed, nothing is
+    recorded anymore, so the retrievals still running in other threads can finish safely.'''
+
+    def __init__(self, directory, crawl_key, resume=False):
+        os.makedirs(directory, exist_ok=True)
+        self.crawl_key = crawl_key
+        self.lock = threading.Lock()
+        self.closed = False
+        self.connection = sqlite3.connect(os.path.join(directory, CHECKPOINT_FILENAME),
+                                          check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute('CREATE TABLE IF NOT EXISTS search_pages '
+                                    '(crawl TEXT, page INTEGER, docs TEXT, PRIMARY KEY (crawl, page))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS comment_pages '
+                                    '(crawl TEXT, url TEXT, offset INTEGER, comments TEXT, '
+                                    'PRIMARY KEY (crawl, url, offset))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS articles_done '
+                                    '(crawl TEXT, url TEXT, PRIMARY KEY (crawl, url))')
+            self.connection.execute('CREATE TABLE IF NOT EXISTS crawls (crawl TEXT PRIMARY KEY, params TEXT)')
+            if not resume:
+                for table in ['search_pages', 'comment_pages', 'articles_done', 'crawls']:
+                    self.connection.execute('DELETE FROM {} WHERE crawl = ?'.format(table), (crawl_key,))
+
+    def search_params(self, params):
+        '''Returns the search parameters recorded for the crawl, or records the given ones and
+        returns them if there are none yet, so that a resumed crawl searches the same dates even
+        when they were filled in with the date of the first run.'''
+
+        with self.lock:
+            if self.closed:
+                return params
+            with self.connection:
+                self.connection.execute('INSERT OR IGNORE INTO crawls VALUES (?, ?)',
+                                        (self.crawl_key, json.dumps(params, sort_keys=True)))
+                row = self.connection.execute('SELECT params FROM crawls WHERE crawl = ?',
+                                              (self.crawl_key,)).fetchone()
+        return json.loads(row[0])
+
+    def search_page(self, page):
+        '''Returns the list of docs recorded for the article search page, or None.'''
+
+        with self.lock:
+            if self.closed:
+                return None
+            row = self.connection.execute('SELECT docs FROM search_pages WHERE crawl = ? AND page = ?',
+                                          (self.crawl_key, page)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def add_search_page(self, page, docs):
+        '''Records the list of docs returned for the article search page.'''
+
+        with self.lock:
+            if self.closed:
+                return
+            with self.connection:
+                self.connection.execute('INSERT OR REPLACE INTO search_pages VALUES (?, ?, ?)',
+                                        (self.crawl_key, page, json.dumps(docs)))
+
+    def comment_pages(self, article_url):
+        '''Returns the list of tuples (offset, comments) recorded for the article, sorted by offset.'''
+
+        with self.lock:
+            if self.closed:
+                return []
+            rows = self.connection.execute('SELECT offset, comments FROM comment_pages '
+                                           'WHERE crawl = ? AND url = ? ORDER BY offset',
+                                           (self.crawl_key, article_url)).fetchall()
+        return [(offset, json.loads(comments)) for offset, comments in rows]
+
+    def add_comment_page(self, article_url, offset, comments):
+        '''Records the list of comments returned for the article at the offset.'''
+
+        with self.lock:
+            if self.closed:
+                return
+            with self.connection:
+                self.connection.execute('INSERT OR REPLACE INTO comment_pages VALUES (?, ?, ?, ?)',
+                                        (self.crawl_key, article_url, offset, json.dumps(comments)))
+
+    def is_article_done(self, article_url):
+        '''Returns True if all the comments on the article are recorded.'''
+
+        with self.lock:
+            if self.closed:
+                return False
+            row = self.connection.execute('SELECT 1 FROM articles_done WHERE crawl = ? AND url = ?',
+                                          (self.crawl_key, article_url)).fetchone()
+        return row is not None
+
+    def complete_article(self, article_url):
+        '''Records that all the comments on the article are retrieved.'''
+
+        with self.lock:
+            if self.closed:
+                return
+            with self.connection:
+                self.connection.execute('INSERT OR REPLACE INTO articles_done VALUES (?, ?)',
+                                        (self.crawl_key, article_url))
+
+    def close(self):
+        '''Closes the database.'''
+
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                self.connection.close()
+
+
+def crawl_key(*args):
+    '''Returns a key identifying the crawl by the given arguments, such as the search parameters.'''
+
+    return hashlib.sha1(json.dumps(args, sort_keys=True, default=str).encode()).hexdigest()
+
+
+@contextmanager
+def immediate_transaction(connection, lock):
+    '''Runs the statements on the connection (opened with isolation_level=None) in a transaction
+    that locks the database for writing, holding the lock of its threads meanwhile.'''
+
+    with lock:
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
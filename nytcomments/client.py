@@ -0,0 +1,144 @@
+import requests
+
+from time import sleep, perf_counter
+
+from urllib.parse import urlsplit, urlunsplit
+from requests.adapters import HTTPAdapter
+
+from nytcomments.ratelimit import default_rate_limiter, parse_retry_after
+from nytcomments.metrics import Metrics, PAGE_FETCHED, RETRY, QUOTA_HIT
+
+
+class Client(object):
+    '''Sends the requests of the retrieval functions through a pooled requests session, so
+    that the connections to the NYT servers are kept alive and reused. A custom session
+    (or any object with a compatible get method) can be passed as the transport.
+
+    Every request waits for the rate_limiter, times out after `timeout` seconds and is
+    retried up to `max_retries` times on connection errors, timeouts and server errors
+    with exponential backoff, as well as on HTTP 429 responses after backing off as
+    instructed by the rate limiter.
+
+    If base_url is given (such as http://127.0.0.1:8000), the requests are sent to it
+    instead of the NYT servers, with the same paths, e.g. to a local replay server.
+    The counters, timers and hooks of the retrieval are in client.metrics (see
+    nytcomments.metrics.Metrics). If an archive is given (see nytcomments.archive.PayloadArchive),
+    the content of every successful response is appended to it, including the responses read
+    from the cache. If a cache is given (see nytcomments.cache.ResponseCache), the requests are
+    answered from it when possible, without waiting for the rate limiter, and the successful
+    responses are stored in it.'''
+
+    def __init__(self, session=None, rate_limiter=None, timeout=(10, 60), max_retries=5,
+                 backoff_factor=1., pool_size=16, base_url=None, metrics=None, archive=None, cache=None):
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['Accept-Encoding'] = 'gzip, deflate'
+        if rate_limiter is None:
+            rate_limiter = default_rate_limiter
+        self.session = session
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.base_url = base_url
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.archive = archive
+        self.cache = cache
+
+    def get(self, url, params, endpoint):
+        '''Requests the url with the given parameters from the endpoint (ARTICLES or COMMENTS)
+        and returns the response. Raises requests.HTTPError for the error responses, including
+        HTTP 429 once the retries are exhausted.'''
+
+        if self.base_url:
+            url = urlunsplit(urlsplit(self.base_url)[:2] + urlsplit(url)[2:])
+        metrics = self.metrics
+        if self.cache is not None:
+            with metrics.timer('cache'):
+                content = self.cache.get(endpoint, url, params)
+            if content is not None:
+                metrics.count('cache_hits')
+                self._archive(endpoint, params, content)
+                return build_response(url, content)
+            metrics.count('cache_misses')
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            with metrics.timer('throttle'):
+                self.rate_limiter.acquire(endpoint)
+            start = perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as error:
+                metrics.add_time('network', perf_counter() - start)
+                if last_attempt:
+                    raise
+                self._retry(endpoint, url, attempt, type(error).__name__)
+                continue
+            seconds = perf_counter() - start
+            metrics.add_time('network', seconds)
+            metrics.count('requests')
+            metrics.count('{}_requests'.format(endpoint))
+            metrics.count('bytes', len(response.content))
+
+            if response.status_code == 429:
+                self.rate_limiter.penalize(endpoint, parse_retry_after(response.headers.get('Retry-After')))
+                metrics.count('throttled')
+                if last_attempt:
+                    metrics.emit(QUOTA_HIT, endpoint=endpoint, message='HTTP 429 Too Many Requests')
+                    response.raise_for_status()
+                self._retry(endpoint, url, attempt, 'HTTP 429', backoff=False)
+                continue
+
+            if (response.status_code >= 500) & (not last_attempt):
+                self._retry(endpoint, url, attempt, 'HTTP {}'.format(response.status_code))
+                continue
+
+            self.rate_limiter.reward(endpoint)
+            response.raise_for_status()
+            metrics.emit(PAGE_FETCHED, endpoint=endpoint, url=url, status=response.status_code, 
+                         bytes=len(response.content), seconds=seconds)
+            self._archive(endpoint, params, response.content)
+            if self.cache is not None:
+                with metrics.timer('cache'):
+                    self.cache.put(endpoint, url, params, response.content)
+            return response
+
+    def _archive(self, endpoint, params, content):
+        '''Adds the content of a response, requested or read from the cache, to the archive.'''
+
+        if self.archive is not None:
+            with self.metrics.timer('archive'):
+                self.archive.add(endpoint, params, content)
+
+    def _retry(self, endpoint, url, attempt, reason, backoff=True):
+        '''Records the retry of a request and, unless the rate limiter backs off instead, waits 
+        before it with exponential backoff.'''
+
+        self.metrics.count('retries')
+        self.metrics.emit(RETRY, endpoint=endpoint, url=url, attempt=attempt + 1, reason=reason)
+        if backoff:
+            with self.metrics.timer('backoff'):
+                sleep(self.backoff_factor * 2**attempt)
+
+    def close(self):
+        '''Closes the pooled connections.'''
+
+        self.session.close()
+
+
+def build_response(url, content, status_code=200, headers=None):
+    '''Returns a requests response with the given content, such as a cached one.'''
+
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = url
+    response.encoding = 'utf-8'
+    response.headers.update(headers or {})
+    response._content = content
+    return response
+
+
+default_client = Client()
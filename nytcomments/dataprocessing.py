@@ -1,21 +1,259 @@
-import pandas as pd
+from nytcomments.lazy import pd, np
+
+from itertools import islice
+
+from nytcomments.metrics import ARTICLE_DONE
+
+# The names of the columns of the articles' dataframe, given the names of the fields of the docs
+ARTICLE_RENAMES = {'_id': 'articleID', 'document_type': 'documentType', 'new_desk': 'newDesk', 
+                   'print_page': 'printPage', 'pub_date': 'pubDate', 'section_name': 'sectionName', 
+                   'type_of_material': 'typeOfMaterial', 'web_url': 'webURL', 'word_count': 'articleWordCount'}
+
+# The columns of the articles' dataframe that get_dataset also adds to the comments' dataframe
+ARTICLE_COLUMNS = ['sectionName', 'newDesk', 'articleWordCount', 'printPage', 'typeOfMaterial']
+
+# The values that the missing values of the columns of the articles' dataframe are filled with
+ARTICLE_DEFAULTS = [('printPage', 0), ('sectionName', 'Unknown'), ('newDesk', 'Unknown'), 
+                    ('typeOfMaterial', 'Unknown'), ('byline', 'By UNKNOWN'), ('headline', 'Unknown'), 
+                    ('multimedia', 0)]
 
 def get_replies(df):
     '''Extracts the replies to the comments as well as the nested 
     replies to those replies, adds all of them to the orginal dataframe
-    and returns the dataframe.'''
+    and returns the dataframe. The column depth gives the level of each 
+    comment in its thread, starting with 1 for the comments on the article.'''
     
+    if 'depth' not in df.columns:
+        df['depth'] = 1
     if 'replyCount' in df.columns:
         selected_df = df.loc[df.replyCount>0]
         if selected_df.shape[0] > 0:
-            df_list = []
-            for idx, row in selected_df.iterrows():
-                replies_df = pd.DataFrame(row.replies)
-                replies_df['inReplyTo'] = row.commentID
-                df_list.append(replies_df)
-            all_replies_df = pd.concat([replies_df for replies_df in df_list])
-            all_replies_df = get_replies(all_replies_df)
-            df = pd.concat([df, all_replies_df])
+            replies = flatten_replies(selected_df.commentID.values, selected_df.replies.values, 
+                                      selected_df.depth.values)
+            df = pd.concat([df, pd.DataFrame(replies)])
+    return df
+
+
+def flatten_replies(comment_ids, replies, depths=None):
+    '''Given the IDs of the comments and the lists of replies nested in them (with their depths, 
+    which default to 1), walks all the levels of the replies iteratively and returns the replies 
+    as a dictionary of columns, level by level. The nested replies are left out and the columns 
+    inReplyTo and depth are added.'''
+    
+    columns = {'inReplyTo': [], 'depth': []}
+    number_rows = 0
+    
+    for reply, in_reply_to, depth in walk_replies(comment_ids, replies, depths):
+        for key in reply:
+            if key not in columns:
+                columns[key] = [None] * number_rows
+        for key, column in columns.items():
+            column.append(reply.get(key))
+        columns['inReplyTo'][-1] = in_reply_to
+        columns['depth'][-1] = depth
+        number_rows += 1
+        
+    columns.pop('replies', None)
+    return columns
+
+
+def walk_replies(comment_ids, replies, depths=None):
+    '''Given the IDs of the comments and the lists of replies nested in them (with their depths, 
+    which default to 1), yields the tuples (reply, inReplyTo, depth) for all the levels of the 
+    replies, level by level, without recursion.'''
+    
+    if depths is None:
+        depths = [1] * len(comment_ids)
+    level = [(reply, comment_id, depth + 1) for comment_id, comment_replies, depth in zip(comment_ids, replies, depths) 
+             for reply in comment_replies]
+    while level:
+        next_level = []
+        for reply, in_reply_to, depth in level:
+            yield reply, in_reply_to, depth
+            if reply.get('replyCount') and reply.get('replies'):
+                next_level.extend((nested_reply, reply['commentID'], depth + 1) for nested_reply in reply['replies'])
+        level = next_level
+
+
+def comment_rows(comments):
+    '''Given the comments on an article (as returned by the API), returns the tuple (rows, 
+    inReplyTo, depths) of the lists of the comments followed by all the replies nested in them, 
+    level by level, with the ID of the comment each one replies to (None for the comments on 
+    the article) and its depth.'''
+    
+    rows = list(comments)
+    in_reply_to = [None] * len(rows)
+    depths = [comment.get('depth') or 1 for comment in rows]
+    selected = [comment for comment in rows if comment.get('replyCount') and comment.get('replies')]
+    for reply, parent_id, depth in walk_replies([comment['commentID'] for comment in selected],
+                                                [comment['replies'] for comment in selected],
+                                                [comment.get('depth') or 1 for comment in selected]):
+        rows.append(reply)
+        in_reply_to.append(parent_id)
+        depths.append(depth)
+    return rows, in_reply_to, depths
+
+
+def comment_records(comments, **constants):
+    '''Returns the comments on an article (as returned by the API) and all the replies nested in 
+    them as a list of dictionaries, one per row of the comments' dataframe and in the same order, 
+    without the nested replies and with the columns inReplyTo (0 for the comments on the article) 
+    and depth. The keyword arguments give the values shared by all the comments, such as 
+    articleID. The values are left as they are in the API's response, without pandas.'''
+    
+    rows, in_reply_to, depths = comment_rows(comments)
+    records = []
+    for row, parent_id, depth in zip(rows, in_reply_to, depths):
+        record = {key: value for key, value in row.items() if key != 'replies'}
+        record['inReplyTo'] = parent_id if parent_id is not None else 0
+        record['depth'] = depth
+        record.update(constants)
+        records.append(record)
+    return records
+
+
+def count_comments(comments):
+    '''Returns the number of the given comments (as returned by the API) including all their replies.'''
+    
+    selected = [comment for comment in comments if comment.get('replyCount') and comment.get('replies')]
+    replies = walk_replies([comment['commentID'] for comment in selected], 
+                           [comment['replies'] for comment in selected])
+    return len(comments) + sum(1 for _ in replies)
+
+
+def limit_comments(comments, max_comments):
+    '''Returns the given comments (as returned by the API) cut down to max_comments comments in total
+    including the replies, in the order they were retrieved: the comments on the article are kept in
+    the given order along with all their replies, and the first one that does not fit is kept with
+    as many of its replies as fit, level by level. The comments kept therefore do not depend on how 
+    many pages were retrieved after them, and no reply is kept without the comment it replies to. 
+    The comment whose replies are cut is copied, so the given comments are left unchanged.'''
+
+    if count_comments(comments) <= max_comments:
+        return comments
+    limited = []
+    remaining = max(max_comments, 0)
+    for comment in comments:
+        if remaining <= 0:
+            break
+        size = count_comments([comment])
+        if size <= remaining:
+            limited.append(comment)
+            remaining -= size
+            continue
+        copy = dict(comment, replies=[])
+        limited.append(copy)
+        copies = {copy['commentID']: copy}
+        replies = walk_replies([comment['commentID']], [comment['replies']])
+        for reply, in_reply_to, _ in islice(replies, remaining - 1):
+            reply_copy = dict(reply, replies=[])
+            copies[in_reply_to]['replies'].append(reply_copy)
+            copies[reply_copy['commentID']] = reply_copy
+        break
+    return limited
+
+
+def select_new_comments(comments, since, refresh_window=0):
+    '''Given the comments on an article (as returned by the API) in the order they are retrieved 
+    (newest first) and the tuple (commentID, createDate) of the newest comment retrieved earlier, 
+    returns the comments that are newer along with the `refresh_window` most recent of the older ones.'''
+    
+    comment_id, create_date = since
+    selected = []
+    old_comments = 0
+    for comment in comments:
+        if (int(comment['createDate']), comment['commentID']) > (int(create_date), comment_id):
+            selected.append(comment)
+        elif old_comments < refresh_window:
+            selected.append(comment)
+            old_comments += 1
+    return selected
+
+
+def count_old_comments(comments, since):
+    '''Returns the number of comments that are not newer than the comment given by the tuple since.'''
+    
+    comment_id, create_date = since
+    return sum(1 for comment in comments 
+               if (int(comment['createDate']), comment['commentID']) <= (int(create_date), comment_id))
+
+
+def merge_pages(article_url, pages, error, printout, metrics, since=None, refresh_window=0, max_comments=None):
+    '''Returns the comments on the pages retrieved for the article without the duplicates, 
+    cut down to the new ones if since is given and to max_comments comments if given, and 
+    records the article in the metrics (see nytcomments.metrics.Metrics).'''
+    
+    comments = []
+    comment_ids = set()
+    for page in pages:
+        for comment in page:
+            if comment['commentID'] not in comment_ids: # Drop the duplicates
+                comment_ids.add(comment['commentID'])
+                comments.append(comment)
+    if since:
+        comments = select_new_comments(comments, since, refresh_window)
+    if max_comments is not None:
+        comments = limit_comments(comments, max_comments)
+        
+    total_comments = count_comments(comments)
+    metrics.count('rows', total_comments)
+    metrics.emit(ARTICLE_DONE, article_url=article_url, comments=total_comments, error=error)
+    if comments and printout:
+        print('Retrieved {} comments from the article with url: '.format(total_comments))
+        print(article_url)
+    return comments
+
+
+def get_last_seen(articles_df, comments_df):
+    '''Given the articles' and the comments' dataframes returned by get_dataset, returns a dictionary 
+    mapping the URL of each article to the tuple (commentID, createDate) of its newest comment.'''
+    
+    comments = comments_df.loc[comments_df.inReplyTo==0, ['articleID', 'commentID', 'createDate']]
+    comments = comments.sort_values(['createDate', 'commentID']).drop_duplicates('articleID', keep='last')
+    urls = articles_df.set_index(articles_df.articleID.astype(str)).webURL.astype(str)
+    return {urls[str(article_id)]: (int(comment_id), int(create_date)) 
+            for article_id, comment_id, create_date in comments.itertuples(index=False)
+            if str(article_id) in urls.index}
+
+
+def article_columns(article, normalized=False):
+    '''Returns the columns of the comments' dataframe taken from the article (a doc returned by 
+    the article search), or only articleID if normalized is True.'''
+    
+    if normalized:
+        return {'articleID': article['_id']}
+    return {'articleID': article['_id'], 
+            'sectionName': article.get('section_name', 'Unknown'), 
+            'newDesk': article.get('new_desk', 'Unknown'), 
+            'articleWordCount': article.get('word_count', 0), 
+            'printPage': article.get('print_page', 0), 
+            'typeOfMaterial': article.get('type_of_material', 'Unknown')}
+
+
+def join_articles(comments_df, articles_df, columns=ARTICLE_COLUMNS):
+    '''Returns the comments' dataframe with the given columns of the articles' dataframe added 
+    to each comment, matched by articleID (as returned by get_dataset with normalized=True). 
+    The articles are looked up once per category of articleID rather than once per comment, 
+    the categorical columns are taken by their codes and the comments on the articles missing 
+    from the articles' dataframe get missing values.'''
+    
+    articles = articles_df.drop_duplicates('articleID')
+    article_ids = comments_df.articleID.astype('category')
+    category_rows = pd.Index(articles.articleID.astype(str)).get_indexer(article_ids.cat.categories.astype(str))
+    codes = article_ids.cat.codes.values
+    rows = np.where(codes >= 0, category_rows[codes] if len(category_rows) else -1, -1)
+    missing = rows < 0
+    rows = np.maximum(rows, 0)
+    
+    df = comments_df.copy()
+    for column in columns:
+        values = articles[column]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            column_codes = np.where(missing, -1, values.cat.codes.values[rows])
+            df[column] = pd.Categorical.from_codes(column_codes, categories=values.cat.categories)
+        else:
+            column_values = pd.Series(values.values[rows], index=df.index)
+            df[column] = column_values.mask(missing) if missing.any() else column_values
     return df
 
 
@@ -39,6 +277,10 @@ def preprocess_comments_dataframe(df):
     df.commentTitle = df.commentTitle.astype('category')
     df.commentType = df.commentType.astype('category')
     df.createDate = df.createDate.astype('int64')
+    
+    if 'depth' in df.columns:
+        df.depth = df.depth.fillna(1).astype('int8')
+        
     df.inReplyTo = df.inReplyTo.fillna(0).astype('int32')
     
     if 'newDesk' in df.columns:
@@ -82,61 +324,162 @@ def preprocess_articles_dataframe(df):
     
     df.reset_index(inplace=True, drop=True)
     df.drop(['blog', 'score', 'uri'], axis=1, inplace=True)
-    df = df.rename(columns = {'_id': 'articleID', 'document_type': 'documentType', 
-                'new_desk': 'newDesk', 'print_page': 'printPage', 'pub_date': 'pubDate', 
-                'section_name': 'sectionName', 'type_of_material': 'typeOfMaterial', 
-                'web_url': 'webURL', 'word_count': 'articleWordCount'}) 
+    df = df.rename(columns=ARTICLE_RENAMES) 
+    
+    if 'byline' in df.columns:
+        df['byline'] = df.byline.str.get('original').fillna('By UNKNOWN')
+    if 'headline' in df.columns:
+        df['headline'] = df.headline.str.get('print_headline').fillna('Unknown').replace('', 'Unknown')
+    df['keywords'] = [[keyword['value'] for keyword in keywords] for keywords in df.keywords]
+    if 'multimedia' in df.columns:
+        df['multimedia'] = df.multimedia.str.len().fillna(0).astype('int64')
+    return _articles_dtypes(df)
+
+
+def preprocess_articles(docs, keywords_table=False):
+    '''Returns the same dataframe as preprocess_articles_dataframe for the docs returned by the
+    article search, built in a single pass over the docs, in which the nested fields (byline,
+    headline, keywords and multimedia) are extracted, instead of a pass per column. If 
+    keywords_table is True, the keywords are left out of the articles' dataframe and the tuple 
+    (articles_df, article_keywords) is returned, where article_keywords has a row per keyword 
+    with the columns articleID, rank, name and value, and articleID has the same categories in 
+    both dataframes.'''
+    
+    columns = {}
+    keywords = {'articleID': [], 'rank': [], 'name': [], 'value': []}
+    number_rows = 0
+    for doc in docs:
+        for key in doc:
+            if (key not in columns) and (key not in ('blog', 'score', 'uri')):
+                columns[key] = [None] * number_rows
+        for key, column in columns.items():
+            value = doc.get(key)
+            if (key == 'keywords') and keywords_table:
+                for keyword in value or []:
+                    keywords['articleID'].append(doc['_id'])
+                    keywords['rank'].append(keyword.get('rank'))
+                    keywords['name'].append(keyword.get('name'))
+                    keywords['value'].append(keyword.get('value'))
+                continue
+            value = _article_value(key, value)
+            column.append(value)
+        number_rows += 1
+    
+    if keywords_table:
+        columns.pop('keywords', None)
+    for key, default in [('byline', 'By UNKNOWN'), ('headline', 'Unknown'), ('multimedia', 0)]:
+        if key not in columns:
+            columns[key] = [default] * number_rows
+    df = pd.DataFrame(columns).rename(columns=ARTICLE_RENAMES)
+    df = _articles_dtypes(df)
+    if not keywords_table:
+        return df
+    
+    article_keywords = pd.DataFrame(keywords)
+    article_keywords['articleID'] = pd.Categorical(article_keywords.articleID, categories=df.articleID.cat.categories)
+    article_keywords['rank'] = article_keywords['rank'].fillna(0).astype('int16')
+    article_keywords['name'] = article_keywords.name.astype('category')
+    article_keywords['value'] = article_keywords.value.astype('category')
+    return df, article_keywords
+
+
+def article_records(docs):
+    '''Returns the docs returned by the article search as a list of dictionaries, one per row of 
+    the articles' dataframe, with the same names of the columns, the nested fields (byline, 
+    headline, keywords and multimedia) extracted and the missing values filled as in 
+    preprocess_articles. Apart from printPage, which is an int like in the dataframe, the values 
+    are not converted to other types (pubDate is left as a string), so pandas is not needed.'''
+    
+    records = []
+    for doc in docs:
+        record = {ARTICLE_RENAMES.get(key, key): _article_value(key, value) for key, value in doc.items()
+                  if key not in ('blog', 'score', 'uri')}
+        for column, default in ARTICLE_DEFAULTS:
+            if record.get(column) is None:
+                record[column] = default
+        records.append(record)
+    return records
+
+
+def _article_value(key, value):
+    '''Returns the value of the column of the articles' dataframe for the field of a doc, with
+    the nested fields extracted.'''
+    
+    if key == 'byline':
+        value = value.get('original') if value is not None else None
+        return 'By UNKNOWN' if value is None else value
+    if key == 'headline':
+        value = value.get('print_headline') if value is not None else None
+        return value if value else 'Unknown'
+    if key == 'multimedia':
+        return len(value) if value is not None else 0
+    if key == 'keywords':
+        return [keyword['value'] for keyword in value or []]
+    if (key == 'print_page') and isinstance(value, str) and value.isdigit():
+        return int(value)
+    return value
+
+
+def _articles_dtypes(df):
+    '''Fills the missing values of the articles' dataframe, with its columns renamed and the 
+    nested fields extracted, and sets the dtypes of its columns.'''
     
     if 'printPage' in df.columns:
-        df.printPage.fillna(0, inplace=True)
+        df['printPage'] = df.printPage.fillna(0)
     else: 
         df['printPage'] = 0
         
-    if 'sectionName' in df.columns:
-        df.sectionName.fillna('Unknown', inplace=True)
-    else: 
-        df['sectionName'] = 'Unknown'
-        
-    if 'newDesk' in df.columns:
-        df.newDesk.fillna('Unknown', inplace=True)
-    else: 
-        df['newDesk'] = 'Unknown'
-        
-    if 'typeOfMaterial' in df.columns:
-        df.typeOfMaterial.fillna('Unknown', inplace=True)
-    else: 
-        df['typeOfMaterial'] = 'Unknown'
+    for column in ['sectionName', 'newDesk', 'typeOfMaterial']:
+        if column in df.columns:
+            df[column] = df[column].fillna('Unknown')
+        else: 
+            df[column] = 'Unknown'
     
-    if 'byline' in df.columns:
-        df.loc[~df.byline.isnull(), 'byline'] = df.loc[~df.byline.isnull(), 
-                                'byline'].apply(lambda x: x['original']).fillna('By UNKNOWN')
-        df.loc[df.byline.isnull(), 'byline'] = 'By UNKNOWN'  
-    else:
+    if 'byline' not in df.columns:
         df['byline'] = 'By UNKNOWN'  
-    
-    if 'headline' in df.columns:
-        df.headline = df.headline.apply(lambda x: x['print_headline']).fillna('Unknown').replace('', 'Unknown')
-    else:
+    if 'headline' not in df.columns:
         df['headline'] = 'Unknown'
-        
-    df.keywords = df.keywords.apply(lambda keywords: [keyword['value'] for keyword in keywords])
-    
-    if 'multimedia' in df.columns:
-        df.multimedia = df.multimedia.apply(lambda x: len(x))
-    else:
+    if 'multimedia' not in df.columns:
         df['multimedia'] = 0
         
     if 'pubDate' in df.columns:
-        df.pubDate = pd.to_datetime(df.pubDate, errors='coerce')
+        df['pubDate'] = pd.to_datetime(df.pubDate, errors='coerce')
     
     # Specify dtypes:
-    df.articleID = df.articleID.astype('category')
-    df.byline = df.byline.astype('category')
-    df.documentType = df.documentType.astype('category')
-    df.newDesk = df.newDesk.astype('category')
-    df.printPage = df.printPage.astype('int32')
-    df.sectionName = df.sectionName.astype('category')
-    df.source = df.source.astype('category')
-    df.typeOfMaterial = df.typeOfMaterial.astype('category')
-    df.webURL = df.webURL.astype('category')
+    df['articleID'] = df.articleID.astype('category')
+    df['byline'] = df.byline.astype('category')
+    df['documentType'] = df.documentType.astype('category')
+    df['newDesk'] = df.newDesk.astype('category')
+    df['printPage'] = df.printPage.astype('int32')
+    df['sectionName'] = df.sectionName.astype('category')
+    df['source'] = df.source.astype('category')
+    df['typeOfMaterial'] = df.typeOfMaterial.astype('category')
+    df['webURL'] = df.webURL.astype('category')
     return df
+
+
+def dataset_batch(articles_list, comments_data, metrics, vocabulary=None, keywords_table=False):
+    '''Returns the preprocessed articles' and comments' dataframes for the given list of 
+    articles and the CommentAccumulator holding the comments on them, with the same 
+    categories of articleID in both, followed by the keywords' dataframe if keywords_table 
+    is True. The vocabulary, if given, codes the articles' categorical columns too, and is 
+    saved if it has a path.'''
+    
+    comments_df = comments_data.to_dataframe()
+    with metrics.timer('articles_dataframe'):
+        if keywords_table:
+            articles_df, keywords_df = preprocess_articles(articles_list, keywords_table=True)
+        else:
+            articles_df = preprocess_articles(articles_list)
+        if vocabulary is not None:
+            articles_df = vocabulary.encode(articles_df)
+            if keywords_table:
+                keywords_df = vocabulary.encode(keywords_df)
+            if vocabulary.path:
+                vocabulary.save()
+    if 'articleID' in comments_df.columns:
+        comments_df['articleID'] = comments_df.articleID.cat.set_categories(articles_df.articleID.cat.categories)
+    if keywords_table:
+        keywords_df['articleID'] = keywords_df.articleID.cat.set_categories(articles_df.articleID.cat.categories)
+        return articles_df, comments_df, keywords_df
+    return articles_df, comments_df
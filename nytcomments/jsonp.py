@@ -0,0 +1,39 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSONP_CALLBACK = b'NYTD.commentsInstance.drawComments('
+
+
+def loads(data):
+    '''Decodes the JSON in the given bytes, memoryview or string with orjson if it is installed,
+    and with the json module otherwise. Both raise json.JSONDecodeError for invalid JSON.'''
+
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+def unwrap_jsonp(content, callback=JSONP_CALLBACK):
+    '''Given the raw bytes of a JSONP response of the form callback( /**/ {...});, returns a
+    memoryview of the JSON object in it without copying the bytes. The response can also be
+    plain JSON.'''
+
+    start = content.find(callback)
+    start = 0 if start < 0 else start + len(callback)
+    start = content.find(b'{', start)
+    end = content.rfind(b'}') + 1
+    if (start < 0) | (end <= start):
+        raise json.JSONDecodeError('No JSON object found in the response', content[:100].decode('utf-8', 'replace'), 0)
+    return memoryview(content)[start:end]
+
+
+def parse_comments_page(content):
+    '''Returns the decoded JSON of a response with a page of comments, given its raw bytes.'''
+
+    return loads(unwrap_jsonp(content))
@@ -0,0 +1,24 @@
+import importlib
+
+
+class LazyModule(object):
+    '''Stands for a module that is imported when one of its attributes is first used. pandas and
+    numpy are used through it, so that importing the package (e.g. in a short-lived worker that
+    only needs the records) does not import them until a dataframe is built.'''
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        module = self._module
+        if module is None:
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        return '<lazy module {!r}>'.format(self._name)
+
+
+pd = LazyModule('pandas')
+np = LazyModule('numpy')
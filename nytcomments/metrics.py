@@ -0,0 +1,115 @@
+import os
+import threading
+
+from time import perf_counter
+from contextlib import contextmanager
+from collections import defaultdict
+
+# The events emitted during the retrieval, with the keyword arguments passed to their hooks
+PAGE_FETCHED = 'page_fetched' # endpoint, url, status, bytes, seconds
+ARTICLE_DONE = 'article_done' # article_url, comments, error
+RETRY = 'retry' # endpoint, url, attempt, reason
+QUOTA_HIT = 'quota_hit' # endpoint, message
+EVENTS = (PAGE_FETCHED, ARTICLE_DONE, RETRY, QUOTA_HIT)
+
+
+class Metrics(object):
+    '''Collects the counters (such as requests, bytes, retries and rows) and the time spent in
+    each phase of the retrieval (such as waiting for the rate limiter, the network, parsing the
+    JSON and building the dataframes), and calls the hooks registered for the events. Every
+    client (see nytcomments.client.Client) has its own Metrics, shared by all the threads that
+    use the client, so the time of a phase is summed over the threads.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hooks = defaultdict(list)
+        self.reset()
+
+    def reset(self):
+        '''Sets all the counters and timers back to zero. The hooks are kept.'''
+
+        with self.lock:
+            self.counters = defaultdict(int)
+            self.events = defaultdict(int)
+            self.phases = defaultdict(lambda: [0., 0]) # Phase -> [seconds, calls]
+
+    def on(self, event, hook):
+        '''Registers the function to be called with the keyword arguments of the event every
+        time it is emitted. The hooks are called in the thread that emits the event.'''
+
+        if event not in EVENTS:
+            raise ValueError('Invalid event {}. The event must be one of: {}.'.format(event, ', '.join(EVENTS)))
+        self.hooks[event].append(hook)
+        return hook
+
+    def emit(self, event, **data):
+        '''Counts the event and calls its hooks.'''
+
+        with self.lock:
+            self.events[event] += 1
+        for hook in self.hooks.get(event, ()):
+            hook(**data)
+
+    def count(self, name, value=1):
+        '''Adds the value to the counter.'''
+
+        with self.lock:
+            self.counters[name] += value
+
+    def add_time(self, phase, seconds):
+        '''Adds the seconds to the time spent in the phase.'''
+
+        with self.lock:
+            timer = self.phases[phase]
+            timer[0] += seconds
+            timer[1] += 1
+
+    @contextmanager
+    def timer(self, phase):
+        '''Adds the time spent in the with block to the phase.'''
+
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, perf_counter() - start)
+
+    def stats(self):
+        '''Returns a dictionary with the counters, the number of times each event was emitted and
+        the seconds and calls of each phase.'''
+
+        with self.lock:
+            return {'counters': dict(self.counters),
+                    'events': dict(self.events),
+                    'phases': {phase: {'seconds': seconds, 'calls': calls}
+                               for phase, (seconds, calls) in self.phases.items()}}
+
+    def to_prometheus(self, prefix='nytcomments'):
+        '''Returns the metrics in the Prometheus text format.'''
+
+        stats = self.stats()
+        lines = []
+        for name, value in sorted(stats['counters'].items()):
+            lines.append('# TYPE {}_{}_total counter'.format(prefix, name))
+            lines.append('{}_{}_total {}'.format(prefix, name, value))
+        if stats['events']:
+            lines.append('# TYPE {}_events_total counter'.format(prefix))
+            for event, value in sorted(stats['events'].items()):
+                lines.append('{}_events_total{{event="{}"}} {}'.format(prefix, event, value))
+        if stats['phases']:
+            lines.append('# TYPE {}_phase_seconds_total counter'.format(prefix))
+            for phase, timer in sorted(stats['phases'].items()):
+                lines.append('{}_phase_seconds_total{{phase="{}"}} {:.6f}'.format(prefix, phase, timer['seconds']))
+            lines.append('# TYPE {}_phase_calls_total counter'.format(prefix))
+            for phase, timer in sorted(stats['phases'].items()):
+                lines.append('{}_phase_calls_total{{phase="{}"}} {}'.format(prefix, phase, timer['calls']))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, filename, prefix='nytcomments'):
+        '''Writes the metrics to a file for the textfile collector of the Prometheus node exporter.
+        The file is replaced at once, so the collector never reads it half-written.'''
+
+        temporary = '{}.{}.tmp'.format(filename, os.getpid())
+        with open(temporary, 'w') as file:
+            file.write(self.to_prometheus(prefix))
+        os.replace(temporary, filename)
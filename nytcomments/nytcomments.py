@@ -1,203 +1,541 @@
-import requests
-import json
 import sys
 import os
+import queue
+import threading
 
-from time import sleep
 from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from itertools import islice
 
-from urllib.error import HTTPError
 from json.decoder import JSONDecodeError
+from requests.exceptions import HTTPError, ConnectionError as RequestsConnectionError
 
-import pandas as pd
+from nytcomments.lazy import pd
 
-from nytcomments.dataprocessing import get_replies, preprocess_comments_dataframe, preprocess_articles_dataframe
+from nytcomments.dataprocessing import get_replies, comment_records, article_records, ARTICLE_COLUMNS, \
+    article_columns, preprocess_articles, count_comments, count_old_comments, limit_comments, merge_pages, \
+    dataset_batch
+from nytcomments.accumulator import CommentAccumulator
+from nytcomments.ratelimit import ARTICLES, COMMENTS
+from nytcomments.client import default_client
+from nytcomments.checkpoint import CheckpointStore, crawl_key
+from nytcomments.jsonp import parse_comments_page
+from nytcomments.sharding import MAX_PAGES, plan_windows, window_pages
+from nytcomments.metrics import QUOTA_HIT
+from nytcomments.sinks import DatasetSink
 
 NYT_ARTICLE_API_URL = 'https://api.nytimes.com/svc/search/v2/articlesearch.json'
 COMMENTS_URL = 'http://www.nytimes.com/svc/community/V3/requestHandler?callback=NYTD.commentsInstance.drawComments&method=&cmd=GetCommentsAll&url='
+SINK_BATCH_SIZE = 10000 # Number of comments written at a time when saving in the parquet or feather format
+OUTPUTS = ('dataframe', 'records', 'arrow') # The forms of the data returned by the retrieval functions
 
     
 def get_dataset(ARTICLE_API_KEY, page_lower=0, page_upper=30, begin_date=None, end_date=None, 
                 sort='newest', query=None, filter_query=None, max_comments=100000, max_articles=10000,
-                printout=True, save=False, filename="", path=""):
+                printout=True, save=False, filename="", path="", workers=1, page_workers=1, 
+                client=None, checkpoint_dir=None, resume=False, save_format='csv', shard=False, 
+                window_workers=1, max_memory=None, spill_dir=None, normalized=False, vocabulary=None, 
+                keywords_table=False, output='dataframe'):
     '''Collects the comments on the articles of NYT by first scraping the 
     articles using NYT articles search API, calling on the customized function
     get_comments(url) to get comments on each article, processing the comments' 
     and articles' data and returning two pandas dataframes - one each for articles 
-    and comments.'''
+    and comments. The comments on up to `workers` articles of a page are 
+    retrieved at a time and the pages of comments on each article are requested 
+    up to `page_workers` at a time. All the requests are sent through the client 
+    (see nytcomments.client.Client), which defaults to the one shared by all the 
+    retrieval functions. If checkpoint_dir is given, the progress is recorded there 
+    as the data arrives, and a later call with the same arguments and resume=True 
+    continues the retrieval from where it stopped. If save_format is 'parquet' or 
+    'feather' instead of 'csv', the data is saved in batches during the retrieval 
+    (see nytcomments.sinks.DatasetSink). 
+    
+    The article search returns at most 200 pages for a query. If shard is True, the 
+    dates of the search are split into windows small enough to be crawled completely 
+    (see nytcomments.sharding.plan_windows), and up to `window_workers` windows are 
+    crawled at a time, in which case page_lower and page_upper are not used.
+    
+    max_comments and max_articles are never exceeded: the last article is cut short if 
+    needed. If max_memory is given (in bytes), the comments are spilled to compressed 
+    chunks on disk (in a temporary directory in spill_dir) whenever they take more memory 
+    than that during the retrieval, and the chunks are merged at the end.
+    
+    If normalized is True, the comments' dataframe has only the column articleID of the 
+    articles' columns, and the others (sectionName, newDesk, articleWordCount, printPage 
+    and typeOfMaterial) are left in the articles' dataframe, from which they can be added 
+    back with nytcomments.dataprocessing.join_articles. In both cases the categories of 
+    articleID are the same in the two dataframes.
+    
+    If a vocabulary is given (see nytcomments.vocabulary.Vocabulary), the columns of both 
+    dataframes that it covers are coded by it, so the datasets of different runs can be concatenated 
+    with vocabulary.concat, and the vocabulary is saved at the end if it has a path.
+    
+    If keywords_table is True, the keywords are left out of the articles' dataframe and the 
+    tuple (articles_df, comments_df, article_keywords) is returned, where article_keywords 
+    has a row per keyword of each article (see dataprocessing.preprocess_articles). It is 
+    saved along with the other dataframes.
+    
+    If output is 'records', the tuple (articles, comments) of lists of dictionaries is 
+    returned instead of the dataframes, one dictionary per row, with the values as they are 
+    in the responses (see dataprocessing.article_records and dataprocessing.comment_records), 
+    and if output is 'arrow', the tuple of the pyarrow Tables built from them. Neither needs 
+    pandas, and neither can be saved, so save, vocabulary and keywords_table are not used.'''
     
     # Initializing all the required variables 
+    if client is None:
+        client = default_client
+    _check_output(output, save)
+    if output != 'dataframe':
+        articles, comments = [], []
+        for article, article_comments in _crawl_dataset(ARTICLE_API_KEY, page_lower, page_upper, begin_date, 
+                                                        end_date, sort, query, filter_query, max_comments, 
+                                                        max_articles, printout, workers, page_workers, client, 
+                                                        checkpoint_dir, resume, shard, window_workers):
+            record = article_records([article])[0]
+            articles.append(record)
+            columns = ['articleID'] if normalized else ['articleID'] + ARTICLE_COLUMNS
+            comments.extend(comment_records(article_comments, **{column: record.get(column) for column in columns}))
+        if printout:
+            print()
+            print("Total articles stored: ", len(articles))
+            print("Total comments retrieved: ", len(comments))
+        return _output(articles, output), _output(comments, output)
+    
     articles_list = []
-    comments_df_list = []
+    comments_data = CommentAccumulator(metrics=client.metrics, max_memory=max_memory, spill_dir=spill_dir, 
+                                       vocabulary=vocabulary)
 
     articles_df = pd.DataFrame()
     comments_df = pd.DataFrame()
+    keywords_df = pd.DataFrame()
+    
+    sink = None
+    if save and (save_format != 'csv'):
+        sink = DatasetSink(path, filename, format=save_format)
+    sink_articles = [] # The batch not written to the sink yet
+    sink_comments = CommentAccumulator(metrics=client.metrics, vocabulary=vocabulary)
+    
+    for article, comments in _crawl_dataset(ARTICLE_API_KEY, page_lower, page_upper, begin_date, end_date, 
+                                            sort, query, filter_query, max_comments, max_articles, printout, 
+                                            workers, page_workers, client, checkpoint_dir, resume, 
+                                            shard, window_workers):
+        articles_list.append(article)
+        comments_data.append(comments, **article_columns(article, normalized))
+        if sink:
+            sink_articles.append(article)
+            sink_comments.append(comments, **article_columns(article, normalized))
+            if len(sink_comments) >= SINK_BATCH_SIZE:
+                sink.write(*dataset_batch(sink_articles, sink_comments, client.metrics, vocabulary, keywords_table))
+                sink_articles = []
+                sink_comments = CommentAccumulator(metrics=client.metrics, vocabulary=vocabulary)
+    
+    if sink and sink_articles: # Write the last batch
+        sink.write(*dataset_batch(sink_articles, sink_comments, client.metrics, vocabulary, keywords_table))
+            
+    if articles_list: # Check that the list is not empty
+        batch = dataset_batch(articles_list, comments_data, client.metrics, vocabulary, keywords_table)
+        if keywords_table:
+            articles_df, comments_df, keywords_df = batch
+        else:
+            articles_df, comments_df = batch
+        
+    if printout:
+        print()
+        print("Total articles stored: ", articles_df.shape[0])
+        print("Total comments retrieved: ", comments_df.shape[0])
+    if sink:
+        if printout:
+            print("The articles' and comments' data is stored in the {} format in the directories Articles{} and Comments{} in the directory {}".format(save_format, filename, filename, os.path.abspath(path)))
+    elif save:
+        articles_df.to_csv(os.path.join(path, 'Articles' + filename + '.csv'), index=False)
+        comments_df.to_csv(os.path.join(path, 'Comments' + filename + '.csv'), index=False)
+        if keywords_table:
+            keywords_df.to_csv(os.path.join(path, 'Keywords' + filename + '.csv'), index=False)
+        if printout:
+            if path=="":
+                directory = os.getcwd()
+            else:
+                directory = path
+            print("The articles' and comments' data is stored as the csv files - Articles{}.csv and Comments{}.csv in the directory {}".format(filename, filename, directory))
+    if keywords_table:
+        return articles_df, comments_df, keywords_df
+    return articles_df, comments_df
+
+
+def iter_dataset(ARTICLE_API_KEY, page_lower=0, page_upper=30, begin_date=None, end_date=None, 
+                 sort='newest', query=None, filter_query=None, max_comments=100000, max_articles=10000,
+                 printout=True, batch_size=None, workers=1, page_workers=1, client=None, 
+                 checkpoint_dir=None, resume=False, shard=False, window_workers=1, normalized=False, 
+                 vocabulary=None, keywords_table=False):
+    '''Retrieves the same data as get_dataset, but yields it as it arrives in batches of 
+    the tuples (articles_df, comments_df) of preprocessed dataframes. A batch is yielded 
+    for every article with comments or, if batch_size is given, as soon as the batch 
+    holds at least batch_size comments. With a vocabulary, the batches can be concatenated 
+    with vocabulary.concat, and the new values of the vocabulary are appended to its file after 
+    every batch if it has a path. 
+    If keywords_table is True, the batches are the tuples (articles_df, comments_df, 
+    article_keywords), like the result of get_dataset.'''
+    
+    if client is None:
+        client = default_client
+    articles_list = []
+    comments_data = CommentAccumulator(metrics=client.metrics, vocabulary=vocabulary)
+    
+    for article, comments in _crawl_dataset(ARTICLE_API_KEY, page_lower, page_upper, begin_date, end_date, 
+                                            sort, query, filter_query, max_comments, max_articles, printout, 
+                                            workers, page_workers, client, checkpoint_dir, resume, 
+                                            shard, window_workers):
+        articles_list.append(article)
+        comments_data.append(comments, **article_columns(article, normalized))
+        if (batch_size is None) or (len(comments_data) >= batch_size):
+            yield dataset_batch(articles_list, comments_data, client.metrics, vocabulary, keywords_table)
+            articles_list = []
+            comments_data = CommentAccumulator(metrics=client.metrics, vocabulary=vocabulary)
+            
+    if articles_list: # Yield the last batch
+        yield dataset_batch(articles_list, comments_data, client.metrics, vocabulary, keywords_table)
+
+
+def _crawl_dataset(ARTICLE_API_KEY, page_lower, page_upper, begin_date, end_date, sort, query, filter_query, 
+                   max_comments, max_articles, printout, workers, page_workers, client, checkpoint_dir, resume, 
+                   shard=False, window_workers=1, first_page=None):
+    '''Yields the tuples (article, comments) for the articles with comments found by the search, 
+    where article is the doc returned by the article search and comments is the list of comments 
+    on the article as returned by the API. If given, first_page is the list of the docs on the 
+    page page_lower, which was already retrieved.'''
+    
+    if shard:
+        yield from _crawl_windows(ARTICLE_API_KEY, begin_date, end_date, sort, query, filter_query, max_comments, 
+                                  max_articles, printout, workers, page_workers, client, checkpoint_dir, resume, 
+                                  window_workers)
+        return
     
     total_comments = 0
     total_articles = 0
     
     HTTPErrorCount = 0
+    error = False
+    
+    if client is None:
+        client = default_client
     
     # Setting the parameters for the retrieval 
     params, DateError = set_parameters(ARTICLE_API_KEY, page_lower, page_upper, begin_date, end_date, 
                     sort, query, filter_query) 
     
     if DateError:
-        return articles_df, comments_df
+        return
     
-    for page in range(page_lower, page_upper):
-        if total_articles < max_articles:
-            if total_comments < max_comments:
-                params['page'] = page # Every page has 10 articles
-                if printout:
-                    print("Page: ", page)
-                try:
-                    # Using NYT API to get articles search data in json format
-                    js = requests.get(NYT_ARTICLE_API_URL, params=params).json()
+    checkpoint = None
+    if checkpoint_dir:
+        # The crawl is identified by the arguments as given, before the dates left out are filled in 
+        # with today's date, and a resumed crawl searches the dates recorded by the first run
+        key = crawl_key('get_dataset', begin_date, end_date, sort, query, filter_query)
+        checkpoint = CheckpointStore(checkpoint_dir, key, resume)
+        params = _resumed_params(checkpoint, params)
+    
+    try:
+        for page in range(page_lower, page_upper):
+            if total_articles < max_articles:
+                if total_comments < max_comments:
+                    params['page'] = page # Every page has 10 articles
+                    if printout:
+                        print("Page: ", page)
+                    try:
+                        # Use the recorded search page when resuming a crawl
+                        docs = checkpoint.search_page(page) if checkpoint else None
+                        if (docs is None) and (page == page_lower) and (first_page is not None):
+                            js = {'status': 'OK', 'response': {'docs': first_page}}
+                        elif docs is None:
+                            # Using NYT API to get articles search data in json format
+                            response = client.get(NYT_ARTICLE_API_URL, params, ARTICLES)
+                            with client.metrics.timer('parse'):
+                                js = response.json()
+                        else:
+                            js = {'status': 'OK', 'response': {'docs': docs}}
+
+                        # Check whether API rate limit has exceeded
+                        if js.get('message'):
+                            client.metrics.emit(QUOTA_HIT, endpoint=ARTICLES, message=js.get('message'))
+                            if printout:
+                                print()
+                                print(js.get('message') + ' for today. No more comments can be retrieved using the article search today, however the function get_comments can be used to retrieve further comments w/o limit if the list of URL(s) of the article(s) are provided to the function.')
+                            break
 
-                    # Check whether API rate limit has exceeded
-                    if js.get('message'):
+                        # Check status to make sure data is retrieved correctly
+                        if js.get('status') == 'OK':
+                            docs = js['response']['docs']
+                            if checkpoint:
+                                checkpoint.add_search_page(page, docs)
+                            docs_length = len(docs)
+                            if docs_length==0:
+                                if printout:
+                                    print("No aricles found on page", page)
+                                break
+                            articles = [doc for doc in docs if doc['document_type'] != 'multimedia'] # Ignore multimedia articles
+                            article_urls = [article['web_url'] for article in articles] # Get the urls for the articles
+
+                            # Use the article urls to get comments 
+                            with closing(_retrieve_in_order(article_urls, workers=workers, page_workers=page_workers, 
+                                                       client=client, checkpoint=checkpoint, printout=printout, 
+                                                       remaining=lambda: max_comments - total_comments)) as results:
+                                for article, (_, comments, error) in zip(articles, results):
+                                    comments = limit_comments(comments, max_comments - total_comments)
+                                    number_comments = count_comments(comments)
+
+                                    if number_comments: # Check if the article has comments
+                                        total_articles += 1
+                                        total_comments += number_comments
+                                        yield article, comments
+                                    if error:
+                                        break
+                                    if (total_articles >= max_articles) or (total_comments >= max_comments):
+                                        break # The limits are checked before the next page
+                            if error:
+                                break
+                    except GeneratorExit: # The caller stopped the retrieval
+                        raise
+                    except KeyboardInterrupt:
                         if printout:
+                            print('KeyboardInterrupt: Retrieval interrupted.')
                             print()
-                            print(js.get('message') + ' for today. No more comments can be retrieved using the article search today, however the function get_comments can be used to retrieve further comments w/o limit if the list of URL(s) of the article(s) are provided to the function.')
                         break
-
-                    # Check status to make sure data is retrieved correctly
-                    if js.get('status') == 'OK':
-                        docs = js['response']['docs']
-                        docs_length = len(docs)
-                        if docs_length==0:
+                    except (ConnectionError, RequestsConnectionError):
+                        if printout:
+                            print('ConnectionError: Retrieval interrupted.')
+                            print()
+                        break
+                    except SystemExit:
+                        if printout:
+                            print('SystemExit: Retrieval interrupted.')
+                            print()
+                        break
+                    except HTTPError:
+                        HTTPErrorCount += 1
+                        if HTTPErrorCount < 5:
                             if printout:
-                                print("No aricles found on page", page)
-                            break
-                        for i in range(docs_length):
-                            if docs[i]['document_type'] != 'multimedia': # Ignore multimedia articles
-                                article_url = docs[i]['web_url'] # Get the url for the article
-
-                                # Use the article url to get comments 
-                                comments, error = retrieve_comments(article_url, printout=printout) 
-                                number_comments = comments.shape[0]
-
-                                if number_comments: # Check if the article has comments
-                                    article_id = docs[i]['_id']
-                                    article = docs[i]
-                                    articles_list.append(article)
-                                    total_articles += 1
-                                    comments['articleID'] = article_id
-                                    comments['sectionName'] = article.get('section_name', 'Unknown')
-                                    comments['newDesk'] = article.get('new_desk', 'Unknown')
-                                    comments['articleWordCount'] = article.get('word_count', 0)
-                                    comments['printPage'] = article.get('print_page', 0)
-                                    comments['typeOfMaterial'] = article.get('type_of_material', 'Unknown')
-                                    comments_df_list.append(comments)
-                                    total_comments += number_comments
-                                if error:
-                                    break
-                        if error:
+                                print('HTTPError:', sys.exc_info()[1])
+                                print("Page {} is skipped. Retrival is continued from the next page.".format(page))
+                                print()
+                            pass
+                        else:
+                            if printout:
+                                print(sys.exc_info()[1])
+                                print("Retrival is terminated due to repeated HTTP errors.")
+                                print()
                             break
-                except KeyboardInterrupt:
-                    if printout:
-                        print('KeyboardInterrupt: Retrieval interrupted.')
-                        print()
-                    break
-                except ConnectionError:
-                    if printout:
-                        print('ConnectionError: Retrieval interrupted.')
-                        print()
-                    break
-                except SystemExit:
-                    if printout:
-                        print('SystemExit: Retrieval interrupted.')
-                        print()
-                    break
-                except HTTPError:
-                    HTTPErrorCount += 1
-                    if HTTPErrorCount < 5:
+                    except JSONDecodeError:
                         if printout:
-                            print('HTTPError:', sys.exc_info()[1])
-                            print("Page {} is skipped. Retrival is continued from the next page.".format(page))
+                            print('JSONDecodeError: Retrieval interrupted.')
                             print()
-                        pass
-                    else:
+                        break
+                    except:
                         if printout:
-                            print(sys.exc_info()[1])
-                            print("Retrival is terminated due to repeated HTTP errors.")
+                            print(sys.exc_info()[0], sys.exc_info()[1])
+                            print("Page {} is skipped. Retrival is continued from the next page.".format(page))
                             print()
-                        break
-                except JSONDecodeError:
+                        pass
+                else:
                     if printout:
-                        print('JSONDecodeError: Retrieval interrupted.')
+                        print('Maximum limit of {} for the comments have exceeded. Terminating retrieval.'.format(max_comments))
                         print()
                     break
-                except:
-                    if printout:
-                        print(sys.exc_info()[0], sys.exc_info()[1])
-                        print("Page {} is skipped. Retrival is continued from the next page.".format(page))
-                        print()
-                    pass
             else:
                 if printout:
-                    print('Maximum limit of {} for the comments have exceeded. Terminating retrieval.'.format(max_comments))
+                    print('Maximum limit of {} for the articles have exceeded. Terminating retrieval.'.format(max_articles))
                     print()
                 break
-        else:
-            if printout:
-                print('Maximum limit of {} for the articles have exceeded. Terminating retrieval.'.format(max_articles))
-                print()
-            break
-            
-    if comments_df_list: # Check that the list is not empty
-        comments_df = pd.concat([df for df in comments_df_list])
-        comments_df = preprocess_comments_dataframe(comments_df)
-        articles_df = pd.DataFrame(articles_list)
-        articles_df = preprocess_articles_dataframe(articles_df)
-        
-    if printout:
-        print()
-        print("Total articles stored: ", articles_df.shape[0])
-        print("Total comments retrieved: ", comments_df.shape[0])
-    if save:
-        articles_df.to_csv(os.path.join(path, 'Articles' + filename + '.csv', index=False))
-        comments_df.to_csv(os.path.join(path, 'Comments' + filename + '.csv', index=False))
+    finally:
+        if checkpoint:
+            checkpoint.close()
+ 
+    
+def _resumed_params(checkpoint, params):
+    '''Returns the parameters of the search recorded in the checkpoint, with the API key of params, 
+    or records params if the crawl is new.'''
+    
+    search_params = {key: value for key, value in params.items() if key != 'api-key'}
+    return dict(checkpoint.search_params(search_params), **{'api-key': params['api-key']})
+    
+    
+def _crawl_windows(ARTICLE_API_KEY, begin_date, end_date, sort, query, filter_query, max_comments, max_articles, 
+                   printout, workers, page_workers, client, checkpoint_dir, resume, window_workers):
+    '''Splits the dates of the search into windows with at most 200 pages of articles each and 
+    yields the tuples (article, comments) like _crawl_dataset for all the windows, crawling up 
+    to `window_workers` windows at a time. The articles found in more than one window are 
+    yielded only once.'''
+    
+    if client is None:
+        client = default_client
+    
+    params, DateError = set_parameters(ARTICLE_API_KEY, 0, MAX_PAGES, begin_date, end_date, 
+                    sort, query, filter_query) 
+    if DateError:
+        return
+    if checkpoint_dir:
+        # The windows of a resumed crawl are planned for the dates of the first run, so they keep their keys
+        checkpoint = CheckpointStore(checkpoint_dir, crawl_key('windows', begin_date, end_date, sort, query, 
+                                                               filter_query), resume)
+        params = _resumed_params(checkpoint, params)
+        checkpoint.close()
+    try:
+        windows = plan_windows(client, NYT_ARTICLE_API_URL, params, printout=printout)
+    except (ConnectionError, RequestsConnectionError, HTTPError, JSONDecodeError, ValueError):
         if printout:
-            if path=="":
-                directory = os.getcwd()
-            else:
-                directory = path
-            print("The articles' and comments' data is stored as the csv files - Articles{}.csv and Comments{}.csv in the directory {}".format(filename, filename, directory))
-    return articles_df, comments_df
+            print(sys.exc_info()[0], sys.exc_info()[1])
+            print('The dates of the search could not be split. Retrieval terminated.')
+            print()
+        return
+    
+    total_comments = 0
+    total_articles = 0
+    article_ids = set()
+    
+    def crawl(window):
+        # The window is crawled with the limits left when it starts, and its first page is reused
+        window_begin, window_end, hits, docs = window
+        return _crawl_dataset(ARTICLE_API_KEY, 0, window_pages(hits), window_begin, window_end, sort, query, 
+                              filter_query, max_comments - total_comments, max_articles - total_articles, 
+                              printout, workers, page_workers, client, checkpoint_dir, resume, first_page=docs)
+    
+    results = _chain_in_order([lambda window=window: crawl(window) for window in windows], window_workers)
+    try:
+        for article, comments in results:
+            if article['_id'] in article_ids: # Drop the articles found in an earlier window
+                continue
+            article_ids.add(article['_id'])
+            comments = limit_comments(comments, max_comments - total_comments)
+            total_articles += 1
+            total_comments += count_comments(comments)
+            yield article, comments
+            if total_comments >= max_comments:
+                if printout:
+                    print('Maximum limit of {} for the comments have exceeded. Terminating retrieval.'.format(max_comments))
+                    print()
+                return
+            if total_articles >= max_articles:
+                if printout:
+                    print('Maximum limit of {} for the articles have exceeded. Terminating retrieval.'.format(max_articles))
+                    print()
+                return
+    except KeyboardInterrupt:
+        if printout:
+            print('KeyboardInterrupt: Retrieval interrupted.')
+            print()
+    finally:
+        results.close()
  
     
-def retrieve_comments(article_url, printout=True):
-    '''Given the url of an article from NYT, returns a dataframe of comments in that article'''
+def retrieve_comments(article_url, printout=True, page_workers=1, client=None, checkpoint=None, 
+                      since=None, refresh_window=0):
+    '''Given the url of an article from NYT, returns a dataframe of comments in that article.
+    If page_workers is more than 1, the total number of comments reported with the first 
+    page is used to request all the remaining pages, up to page_workers pages at a time.
+    If a checkpoint (see nytcomments.checkpoint.CheckpointStore) is given, the pages of 
+    comments are recorded in it and the pages recorded earlier are not requested again.
+    
+    If since is given as the tuple (commentID, createDate) of the newest comment retrieved 
+    earlier, the retrieval stops once it reaches the comments retrieved earlier and only 
+    the new comments are returned, along with the `refresh_window` most recent of the old 
+    comments so that their recommendations and replies are updated.'''
+    
+    if client is None:
+        client = default_client
+    comments_df = pd.DataFrame()
+    comments, error = _retrieve_records(article_url, printout, page_workers, client, checkpoint, 
+                                        since, refresh_window)
+    if comments:
+        with client.metrics.timer('replies'):
+            comments_df = pd.DataFrame(comments)
+            comments_df['inReplyTo'] = None 
+            comments_df = get_replies(comments_df)
+    return comments_df, error
+
+
+def _retrieve_records(article_url, printout=True, page_workers=1, client=None, checkpoint=None, 
+                      since=None, refresh_window=0, max_comments=None, strict=False, stop=None):
+    '''Retrieves the comments on the article like retrieve_comments, but returns the list of the 
+    comments as returned by the API, with the replies nested in them, instead of a dataframe.
+    If max_comments is given, no more pages are requested once there are enough comments and 
+    at most max_comments comments (including the replies) are returned. A page that can not be 
+    retrieved ends the retrieval with the comments on the pages before it, unless strict is True, 
+    in which case requests.HTTPError is raised, so that no incomplete list is returned. 
+    If stop (a threading.Event) is set, no more pages are requested and error is True.'''
+    
+    if (max_comments is not None) and (max_comments <= 0):
+        return [], False
     
     url = article_url.replace(':','%253A') #convert the : to an HTML entity
     url = url.replace('/','%252F')
     
     offset = 0 #Start off at the very beginning
     
-    df_list = []
-    comments_df = pd.DataFrame() # Set up a list to store the comments' data 
+    pages = [] # Set up a list to store the pages of comments
     error = False
+    done = False
+    old_comments = 0 # Count of the comments retrieved earlier in the incremental mode
+    retrieved = 0 # Count of the comments retrieved including the replies
+    
+    if client is None:
+        client = default_client
     
-    while True:
+    if checkpoint:
+        # Continue from the pages recorded earlier
+        for offset, comments in checkpoint.comment_pages(article_url):
+            pages.append(comments)
+            retrieved += count_comments(comments)
+            if since:
+                old_comments += count_old_comments(comments, since)
+        if pages:
+            offset = offset + 25
+        done = checkpoint.is_article_done(article_url)
+    
+    while not done:
+        if (max_comments is not None) and (retrieved >= max_comments):
+            break # Stop paging once there are enough comments
+        if (stop is not None) and stop.is_set():
+            error = True
+            break # The caller does not need the comments anymore
         try:
-            sleep(1) 
-            params = {'sort': "newest", 'offset': offset, 'url': article_url}
-            
-            # Get the comments data and convert it into json format
-            file = requests.get(COMMENTS_URL, params=params).text.replace('NYTD.commentsInstance.drawComments(','').replace('      /**/ ','')[:-2] 
-            js = json.loads(file) # Load the file as json
-            if js['status'] == 'OK':
-                results = js['results']
+            results = _request_comments_page(article_url, offset, client)
+            if (results is None) and strict:
+                raise HTTPError('The page of comments at offset {} could not be retrieved'.format(offset))
+            if results is not None:
                 number_comments_returned = results['totalCommentsReturned']
                 total_comments = number_comments_returned + results['totalReplyCommentsReturned']
                 if number_comments_returned:
                     comments = results['comments']
-                    df = pd.DataFrame(comments)
-                    df_list.append(df)
+                    if checkpoint:
+                        checkpoint.add_comment_page(article_url, offset, comments)
+                    pages.append(comments)
+                    retrieved += count_comments(comments)
+                    if since:
+                        old_comments += count_old_comments(comments, since)
+                        if old_comments > refresh_window: 
+                            done = True
+                            break # Break when the older comments are reached
                 else:
+                    done = True
                     break # Break when no comments are returned
+                if (page_workers > 1) & (offset == 0) & (since is None):
+                    for offset, results in _prefetch_comments_pages(article_url, results, page_workers, client, 
+                                                                    max_comments, strict, stop):
+                        if results['totalCommentsReturned']:
+                            if checkpoint:
+                                checkpoint.add_comment_page(article_url, offset, results['comments'])
+                            pages.append(results['comments'])
+                            retrieved += count_comments(results['comments'])
+                    if (stop is not None) and stop.is_set():
+                        error = True
+                        break
+                    if (max_comments is not None) and (retrieved >= max_comments):
+                        break
+                    if results['totalCommentsReturned'] < 25:
+                        done = True
+                        break # The last page is not full, so there are no more comments
+                    # Otherwise the comments posted in the meantime are retrieved page by page
             offset = offset + 25 # Increment the counter since 25 comments are scraped each time
         except KeyboardInterrupt:
             error = True
@@ -205,7 +543,7 @@ def retrieve_comments(article_url, printout=True):
                 print('KeyboardInterrupt: Retrieval interrupted.')
                 print()
             break
-        except ConnectionError:
+        except (ConnectionError, RequestsConnectionError):
             error = True
             if printout:
                 print('ConnectionError: Retrieval interrupted.')
@@ -218,6 +556,8 @@ def retrieve_comments(article_url, printout=True):
                 print()
             break
         except HTTPError:
+            if strict:
+                raise
             if printout:
                 print(sys.exc_info()[1])
                 print("Article with the URL {} is skipped. Retrival is continued from the next article.".format(article_url))
@@ -234,62 +574,243 @@ def retrieve_comments(article_url, printout=True):
             if printout:
                 print(sys.exc_info()[0], sys.exc_info()[1])
             break
-    if df_list:
-        comments_df = pd.concat([df for df in df_list])
-        comments_df.drop_duplicates(subset=['commentID'], inplace=True)
-        comments_df['inReplyTo'] = None 
-        comments_df = get_replies(comments_df)
-        
-        total_comments = comments_df.shape[0]
+    if checkpoint and done:
+        checkpoint.complete_article(article_url)
     
-        if printout:
-            print('Retrieved {} comments from the article with url: '.format(total_comments))
-            print(article_url)
+    comments = merge_pages(article_url, pages, error, printout, client.metrics, since, refresh_window, max_comments)
+    return comments, error
 
-    return comments_df, error
+
+def _request_comments_page(article_url, offset, client):
+    '''Requests the page of (at most 25) comments on the article starting at the given 
+    offset and returns the results, or None if the status of the response is not OK.'''
+    
+    params = {'sort': "newest", 'offset': offset, 'url': article_url}
+    
+    # Get the comments data and decode the json in it without copying the raw response
+    response = client.get(COMMENTS_URL, params, COMMENTS)
+    with client.metrics.timer('parse'):
+        js = parse_comments_page(response.content)
+    if js['status'] == 'OK':
+        return js['results']
+    return None
 
 
-def get_comments(article_urls, max_comments=50000, printout=True, save=False, filename="", path=""):
-    '''Given a URL or a list of URLs of New York Times articles, returns a dataframe of comments in the articles.'''
-    # Initializing all the required variables 
-    comments_df_list = []
-    comments_df = pd.DataFrame()
+def _prefetch_comments_pages(article_url, results, page_workers, client, max_comments=None, strict=False, 
+                             stop=None):
+    '''Given the results for the first page of comments on the article, requests all 
+    the remaining pages reported by the total number of comments (but no more than 
+    needed for max_comments comments), up to page_workers pages at a time, and yields 
+    the tuples (offset, results) in the order of the offsets. The pages whose status is 
+    not OK are left out, or raise requests.HTTPError if strict is True. The pages not 
+    requested yet are dropped when stop is set or the generator is closed.'''
     
-    total_comments = 0 # Initialize the count of comments in the articles
-    if type(article_urls) is str:
-        comments, _ = retrieve_comments(article_urls, printout=printout) 
-        number_comments = comments.shape[0]
+    total_comments = results.get('totalParentCommentsFound', results.get('totalCommentsFound', 0))
+    if max_comments is not None:
+        total_comments = min(total_comments, max_comments)
+    offsets = range(25, total_comments, 25)
+    
+    def request(offset):
+        if (stop is not None) and stop.is_set():
+            return None
+        return _request_comments_page(article_url, offset, client)
+    
+    executor = ThreadPoolExecutor(max_workers=page_workers)
+    futures = [executor.submit(request, offset) for offset in offsets]
+    try:
+        for offset, future in zip(offsets, futures):
+            if (stop is not None) and stop.is_set():
+                return
+            results = future.result()
+            if results is not None:
+                yield offset, results
+            elif strict:
+                raise HTTPError('The page of comments at offset {} could not be retrieved'.format(offset))
+    finally:
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
 
-        if number_comments: # Check if the article has comments
-            comments_df_list.append(comments)
-            total_comments += number_comments
-    else:
+
+def _retrieve_in_order(article_urls, workers=1, printout=True, last_seen=None, remaining=None, **kwargs):
+    '''Yields the tuples (article_url, comments, error) for the given urls in the same order
+    as the urls, retrieving the comments on up to `workers` articles at a time. The keyword 
+    arguments are passed on to _retrieve_records, along with the tuple in last_seen (if any) 
+    for each url as the argument since. If given, remaining is called when the retrieval of 
+    an article starts and returns the number of comments still allowed.'''
+    
+    stop = threading.Event() # Set when the caller stops, so the retrievals still running end
+    
+    def retrieve(article_url):
+        since = last_seen.get(article_url) if last_seen else None
+        max_comments = remaining() if remaining else None
+        return _retrieve_records(article_url, printout=printout, since=since, max_comments=max_comments, 
+                                 stop=stop, **kwargs)
+    
+    if workers <= 1:
         for article_url in article_urls:
-            if total_comments < max_comments:
-                comments, error = retrieve_comments(article_url, printout=printout) 
-                number_comments = comments.shape[0]
-
-                if number_comments: # Check if the article has comments
-                    comments_df_list.append(comments)
-                    total_comments += number_comments
-                if error:
-                    break
-            else:
+            comments, error = retrieve(article_url)
+            yield article_url, comments, error
+        return
+    
+    with closing(_map_in_order(retrieve, article_urls, workers, stop)) as futures:
+        for article_url, future in futures:
+            try:
+                comments, error = future.result()
+            except KeyboardInterrupt:
                 if printout:
-                    print('Maximum limit of {} for the comments have exceeded. Terminating retrieval.'.format(max_comments))
+                    print('KeyboardInterrupt: Retrieval interrupted.')
                     print()
+                yield article_url, [], True
                 break
+            yield article_url, comments, error
+
+
+def _chain_in_order(functions, workers, buffer_size=1):
+    '''Yields the items of the generators returned by the functions, one generator after the 
+    other, while up to `workers` of them run ahead in threads. A generator is never more than 
+    buffer_size items ahead of the caller, so nothing is retrieved long after the caller stops, 
+    and when this generator is closed, the generators still running are closed too.'''
+    
+    if workers <= 1:
+        for function in functions:
+            with closing(function()) as generator:
+                yield from generator
+        return
+    
+    stop = threading.Event()
+    
+    def put(buffer, entry):
+        while not stop.is_set():
+            try:
+                buffer.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+    
+    def run(task):
+        function, buffer = task
+        try:
+            generator = function()
+            try:
+                for item in generator:
+                    if not put(buffer, (True, item)):
+                        return
+            finally:
+                generator.close()
+        except BaseException as error: # Raised again in the caller's thread
+            put(buffer, (False, error))
+            return
+        put(buffer, (False, None))
+    
+    tasks = ((function, queue.Queue(buffer_size)) for function in functions)
+    futures = _map_in_order(run, tasks, workers, stop)
+    try:
+        for (_, buffer), _ in futures:
+            while True:
+                is_item, value = buffer.get()
+                if not is_item:
+                    if value is not None:
+                        raise value
+                    break
+                yield value
+    finally:
+        stop.set()
+        futures.close()
+
+
+def _map_in_order(function, items, workers, stop=None):
+    '''Yields the tuples (item, future) for the calls of the function on the items in the same 
+    order as the items, running up to `workers` calls at a time in threads. The calls that have 
+    not started when the generator is closed are cancelled, and stop (a threading.Event checked 
+    by the function) is set, so that the calls still running end early.'''
+    
+    items = iter(items)
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        for item in islice(items, workers):
+            pending.append((item, executor.submit(function, item)))
+        while pending:
+            item, future = pending.popleft()
+            for next_item in islice(items, 1): # Keep the pool busy
+                pending.append((next_item, executor.submit(function, next_item)))
+            yield item, future
+    finally:
+        if stop is not None:
+            stop.set()
+        for _, future in pending: # Drop the items that are no longer needed
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def get_comments(article_urls, max_comments=50000, printout=True, save=False, filename="", path="", workers=1, 
+                 page_workers=1, client=None, checkpoint_dir=None, resume=False, last_seen=None, refresh_window=0, 
+                 save_format='csv', max_memory=None, spill_dir=None, vocabulary=None, output='dataframe'):
+    '''Given a URL or a list of URLs of New York Times articles, returns a dataframe of comments in the articles.
+    The comments on up to `workers` articles are retrieved at a time and the pages of comments on each 
+    article are requested up to `page_workers` at a time. The requests are sent through the client.
+    If checkpoint_dir is given, the progress is recorded there as the data arrives, and a later call 
+    with the same URLs and resume=True continues the retrieval from where it stopped.
+    
+    last_seen can map the URLs of the articles retrieved earlier to the tuple (commentID, createDate) 
+    of their newest comment (see dataprocessing.get_last_seen), in which case only the new comments 
+    on those articles and the `refresh_window` most recent of the old ones are retrieved.
+    If save_format is 'parquet' or 'feather' instead of 'csv', the comments are saved in batches 
+    during the retrieval. max_comments is never exceeded, and max_memory limits the memory taken 
+    by the comments during the retrieval like in get_dataset. The vocabulary is used as in get_dataset.
+    If output is 'records' or 'arrow', the comments are returned as a list of dictionaries or a 
+    pyarrow Table instead of the dataframe, like in get_dataset.'''
+    # Initializing all the required variables 
+    if client is None:
+        client = default_client
+    _check_output(output, save)
+    if output != 'dataframe':
+        comments = []
+        for article_comments in _crawl_comments(article_urls, max_comments, printout, workers, page_workers, 
+                                                client, checkpoint_dir, resume, last_seen, refresh_window):
+            comments.extend(comment_records(article_comments))
+        if printout:
+            print()
+            print("Total comments retrieved: ", len(comments))
+        return _output(comments, output)
+    
+    comments_data = CommentAccumulator(metrics=client.metrics, max_memory=max_memory, spill_dir=spill_dir, 
+                                       vocabulary=vocabulary)
+    comments_df = pd.DataFrame()
+    
+    sink = None
+    if save and (save_format != 'csv'):
+        sink = DatasetSink(path, filename, format=save_format)
+    sink_comments = CommentAccumulator(metrics=client.metrics, vocabulary=vocabulary) # The batch not written yet
+    
+    for comments in _crawl_comments(article_urls, max_comments, printout, workers, page_workers, client, 
+                                    checkpoint_dir, resume, last_seen, refresh_window):
+        comments_data.append(comments)
+        if sink:
+            sink_comments.append(comments)
+            if len(sink_comments) >= SINK_BATCH_SIZE:
+                sink.write(pd.DataFrame(), sink_comments.to_dataframe())
+                sink_comments = CommentAccumulator(metrics=client.metrics, vocabulary=vocabulary)
+    
+    if sink and len(sink_comments): # Write the last batch
+        sink.write(pd.DataFrame(), sink_comments.to_dataframe())
             
-    if comments_df_list: # Check that the list is not empty
-        comments_df = pd.concat([df for df in comments_df_list])
-        comments_df = preprocess_comments_dataframe(comments_df)
+    if len(comments_data): # Check that there are comments
+        comments_df = comments_data.to_dataframe()
+    if (vocabulary is not None) and vocabulary.path:
+        vocabulary.save()
         
     if printout:
         print()
         print("Total comments retrieved: ", comments_df.shape[0]) 
         
-    if save:
-        comments_df.to_csv(os.path.join(path, 'Comments' + filename + '.csv', index=False))
+    if sink:
+        if printout:
+            print("The comments' data is stored in the {} format in the directory Comments{} in the directory {}".format(save_format, filename, os.path.abspath(path)))
+    elif save:
+        comments_df.to_csv(os.path.join(path, 'Comments' + filename + '.csv'), index=False)
         if printout:
             if path=="":
                 directory = os.getcwd()
@@ -298,42 +819,225 @@ def get_comments(article_urls, max_comments=50000, printout=True, save=False, fi
             print("The comments' data is stored as the csv file Comments{}.csv in the directory {}".format(filename, directory))
 
     return comments_df
+
+
+def iter_comments(article_urls, max_comments=50000, printout=True, batch_size=None, workers=1, page_workers=1, 
+                  client=None, checkpoint_dir=None, resume=False, last_seen=None, refresh_window=0, 
+                  vocabulary=None):
+    '''Retrieves the same comments as get_comments, but yields them as they arrive in batches of 
+    preprocessed dataframes. A batch is yielded for every article with comments or, if batch_size 
+    is given, as soon as the batch holds at least batch_size comments. The vocabulary is used as 
+    in iter_dataset.'''
+    
+    if client is None:
+        client = default_client
+    comments_data = CommentAccumulator(metrics=client.metrics, vocabulary=vocabulary)
+    
+    for comments in _crawl_comments(article_urls, max_comments, printout, workers, page_workers, client, 
+                                    checkpoint_dir, resume, last_seen, refresh_window):
+        comments_data.append(comments)
+        if (batch_size is None) or (len(comments_data) >= batch_size):
+            yield _comments_batch(comments_data, vocabulary)
+            comments_data = CommentAccumulator(metrics=client.metrics, vocabulary=vocabulary)
+            
+    if len(comments_data): # Yield the last batch
+        yield _comments_batch(comments_data, vocabulary)
+
+
+def _comments_batch(comments_data, vocabulary=None):
+    '''Returns the comments' dataframe of the CommentAccumulator and saves the vocabulary, if 
+    given with a path.'''
+    
+    comments_df = comments_data.to_dataframe()
+    if (vocabulary is not None) and vocabulary.path:
+        vocabulary.save()
+    return comments_df
+
+
+def _crawl_comments(article_urls, max_comments, printout, workers, page_workers, client, 
+                    checkpoint_dir, resume, last_seen, refresh_window):
+    '''Yields the lists of comments (as returned by the API) on the given articles that have comments.'''
+    
+    total_comments = 0 # Initialize the count of comments in the articles
+    if client is None:
+        client = default_client
+        
+    checkpoint = None
+    if checkpoint_dir:
+        if type(article_urls) is not str: # The crawl is identified by all the URLs, even when they come from a generator
+            article_urls = list(article_urls)
+        checkpoint = CheckpointStore(checkpoint_dir, crawl_key('get_comments', article_urls), resume)
+        
+    try:
+        if type(article_urls) is str:
+            since = last_seen.get(article_urls) if last_seen else None
+            comments, _ = _retrieve_records(article_urls, printout=printout, page_workers=page_workers, 
+                                            client=client, checkpoint=checkpoint, since=since, 
+                                            refresh_window=refresh_window, max_comments=max_comments) 
+            number_comments = count_comments(comments)
+
+            if number_comments: # Check if the article has comments
+                total_comments += number_comments
+                yield comments
+        else:
+            with closing(_retrieve_in_order(article_urls, workers=workers, page_workers=page_workers, 
+                                                       client=client, checkpoint=checkpoint, printout=printout, 
+                                                       last_seen=last_seen, refresh_window=refresh_window, 
+                                                       remaining=lambda: max_comments - total_comments)) as results:
+                for _, comments, error in results:
+                    comments = limit_comments(comments, max_comments - total_comments)
+                    number_comments = count_comments(comments)
+
+                    if number_comments: # Check if the article has comments
+                        total_comments += number_comments
+                        yield comments
+                    if error:
+                        break
+                    if total_comments >= max_comments:
+                        if printout:
+                            print('Maximum limit of {} for the comments have exceeded. Terminating retrieval.'.format(max_comments))
+                            print()
+                        break
+    finally:
+        if checkpoint:
+            checkpoint.close()
         
 
 def get_articles(ARTICLE_API_KEY, page_lower=0, page_upper=50, begin_date=None, end_date=None, 
                 sort='newest', query=None, filter_query=None, max_articles=10000,
-                printout=True, save=False, filename="", path=""):
+                printout=True, save=False, filename="", path="", client=None, save_format='csv', 
+                shard=False, window_workers=1, keywords_table=False, output='dataframe'):
     '''Collects the data on the articles of NYT using NYT articles search API, processes the 
-    articles' data and returns a pandas dataframe for articles.'''
+    articles' data and returns a pandas dataframe for articles. The requests are sent 
+    through the client. The data can be saved in the 'csv', 'parquet' or 'feather' format.
+    If shard is True, the dates of the search are split into windows with at most 200 pages 
+    each, which are crawled up to `window_workers` at a time, like in get_dataset. If 
+    keywords_table is True, the tuple (articles_df, article_keywords) is returned instead, 
+    with the keywords in article_keywords like in get_dataset. If output is 'records' or 'arrow', 
+    the articles are returned as a list of dictionaries or a pyarrow Table instead of the 
+    dataframe, like in get_dataset, with their keywords in the column keywords.'''
     
-    # Initializing all the required variables 
-    articles_df = pd.DataFrame()
-    articles_list = []
-    total_articles = 0
-    
-    HTTPErrorCount = 0
+    if client is None:
+        client = default_client
+    _check_output(output, save)
     
     # Setting the parameters for the retrieval
     params, DateError = set_parameters(ARTICLE_API_KEY, page_lower, page_upper, begin_date, end_date, 
                     sort, query, filter_query) 
     
     if DateError:
-        return articles_df, comments_df
+        if output != 'dataframe':
+            return _output([], output)
+        return (pd.DataFrame(), pd.DataFrame()) if keywords_table else pd.DataFrame()
+    
+    if shard:
+        articles_list = _crawl_article_windows(params, max_articles, printout, client, window_workers)
+    else:
+        articles_list = _crawl_articles(params, page_lower, page_upper, max_articles, printout, client)
+    if output != 'dataframe':
+        if printout:
+            print()
+            print("Total articles stored: ", len(articles_list))
+        return _output(article_records(articles_list), output)
+    
+    # Initializing all the required variables 
+    articles_df = pd.DataFrame()
+    keywords_df = pd.DataFrame()
+    if articles_list and keywords_table:
+        articles_df, keywords_df = preprocess_articles(articles_list, keywords_table=True)
+    elif articles_list:
+        articles_df = preprocess_articles(articles_list)
+        
+    if printout:
+        print()
+        print("Total articles stored: ", articles_df.shape[0])
+    if save and (save_format != 'csv'):
+        DatasetSink(path, filename, format=save_format).write(articles_df, keywords_df=keywords_df)
+        if printout:
+            print("The articles' data is stored in the {} format in the directory Articles{} in the directory {}".format(save_format, filename, os.path.abspath(path)))
+    elif save:
+        articles_df.to_csv(os.path.join(path, 'Articles' + filename + '.csv'), index=False)
+        if keywords_table:
+            keywords_df.to_csv(os.path.join(path, 'Keywords' + filename + '.csv'), index=False)
+        if printout:
+            if path=="":
+                directory = os.getcwd()
+            else:
+                directory = path
+            print("The articles' data is stored as the csv file - Articles{}.csv in the directory {}".format(filename, directory))
+    if keywords_table:
+        return articles_df, keywords_df
+    return articles_df
+
+
+def _crawl_article_windows(params, max_articles, printout, client, window_workers):
+    '''Splits the dates of the search with the given parameters into windows with at most 200 
+    pages each and returns the list of the articles found in all the windows, crawling up to 
+    `window_workers` windows at a time. The articles found in more than one window are kept once.'''
+    
+    try:
+        windows = plan_windows(client, NYT_ARTICLE_API_URL, params, printout=printout)
+    except (ConnectionError, RequestsConnectionError, HTTPError, JSONDecodeError, ValueError):
+        if printout:
+            print(sys.exc_info()[0], sys.exc_info()[1])
+            print('The dates of the search could not be split. Retrieval terminated.')
+            print()
+        return []
+    
+    articles_list = []
+    article_ids = set()
+    
+    def crawl(window):
+        # The window is crawled with the limit left when it starts, and its first page is reused
+        window_begin, window_end, hits, docs = window
+        window_params = dict(params, begin_date=window_begin, end_date=window_end)
+        return _crawl_articles(window_params, 0, window_pages(hits), max_articles - len(articles_list), 
+                               printout, client, first_page=docs, stop=stop)
+    
+    stop = threading.Event()
+    with closing(_map_in_order(crawl, windows, max(window_workers, 1), stop)) as futures:
+        for _, future in futures:
+            for article in future.result():
+                if article['_id'] not in article_ids: # Drop the articles found in an earlier window
+                    article_ids.add(article['_id'])
+                    articles_list.append(article)
+            if len(articles_list) >= max_articles:
+                if printout:
+                    print('Maximum limit of {} for the articles have exceeded. Terminating retrieval.'.format(max_articles))
+                break
+    return articles_list[:max_articles]
+
+
+def _crawl_articles(params, page_lower, page_upper, max_articles, printout, client, first_page=None, stop=None):
+    '''Returns the list of the articles found on the pages of the article search with the 
+    given parameters. If given, first_page is the list of the docs on the page page_lower, 
+    which was already retrieved. If stop (a threading.Event) is set, no more pages are requested.'''
+    
+    articles_list = []
+    total_articles = 0
+    
+    HTTPErrorCount = 0
     
     for page in range(page_lower, page_upper):
+        if (stop is not None) and stop.is_set():
+            break
         if total_articles < max_articles:
-            sleep(1)
-            
             params['page'] = page # Every page has 10 articles
             
             if printout:
                 print("Page: ", page)
             try:
-                # Using NYT API to get articles search data in json format
-                js = requests.get(NYT_ARTICLE_API_URL, params=params).json()
+                if (page == page_lower) and (first_page is not None):
+                    js = {'status': 'OK', 'response': {'docs': first_page}}
+                else:
+                    # Using NYT API to get articles search data in json format
+                    response = client.get(NYT_ARTICLE_API_URL, params, ARTICLES)
+                    with client.metrics.timer('parse'):
+                        js = response.json()
                 
                 # First check whether API rate limit has exceeded
                 if js.get('message'):
+                    client.metrics.emit(QUOTA_HIT, endpoint=ARTICLES, message=js.get('message'))
                     if printout:
                         print('NYT' + js.get('message') + 'for today. No more comments can be retrieved using the article search today, however the function get_comments can be used to retrieve further comments w/o limit if the URLs of the articles are given to the function manually.')
                     break
@@ -358,7 +1062,7 @@ def get_articles(ARTICLE_API_KEY, page_lower=0, page_upper=50, begin_date=None,
                     print('KeyboardInterrupt: Retrieval interrupted.')
                 break
             
-            except ConnectionError:
+            except (ConnectionError, RequestsConnectionError):
                 if printout:
                     print('ConnectionError: Retrieval interrupted.')
                 break
@@ -388,21 +1092,42 @@ def get_articles(ARTICLE_API_KEY, page_lower=0, page_upper=50, begin_date=None,
             if printout:
                 print('Maximum limit of {} for the articles have exceeded. Terminating retrieval.'.format(max_articles))
             break
-    articles_df = pd.DataFrame(articles_list)
-    articles_df = preprocess_articles_dataframe(articles_df)
-        
-    if printout:
-        print()
-        print("Total articles stored: ", articles_df.shape[0])
-    if save:
-        articles_df.to_csv(os.path.join(path, 'Articles' + filename + '.csv', index=False))
-        if printout:
-            if path=="":
-                directory = os.getcwd()
-            else:
-                directory = path
-            print("The articles' data is stored as the csv file - Articles{}.csv in the directory {}".format(filename, directory))
-    return articles_df
+    return articles_list
+
+
+def _check_output(output, save):
+    '''Raises ValueError if the output is not one of OUTPUTS, or if the data is to be saved 
+    without being returned as dataframes.'''
+    
+    if output not in OUTPUTS:
+        raise ValueError('Invalid output {}. The output must be one of: {}.'.format(output, ', '.join(OUTPUTS)))
+    if save and (output != 'dataframe'):
+        raise ValueError("The data can only be saved with output='dataframe'.")
+
+
+def _output(records, output):
+    '''Returns the list of records for the output 'records', or the pyarrow Table built from 
+    them for the output 'arrow'.'''
+    
+    if output != 'arrow':
+        return records
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("pyarrow is required for output='arrow'. It can be installed with: pip install pyarrow")
+    return pyarrow.Table.from_pylist(records)
+
+
+def _format_date(date):
+    '''Returns the date in the format %Y%m%d. The dates already in that format are checked 
+    with datetime, so that pandas is only imported to parse the other formats.'''
+    
+    if isinstance(date, str) and (len(date) == 8) and date.isdigit():
+        try:
+            return datetime.strptime(date, '%Y%m%d').strftime('%Y%m%d')
+        except ValueError:
+            pass
+    return pd.to_datetime(date, errors='coerce').strftime('%Y%m%d')
 
 
 def set_parameters(ARTICLE_API_KEY, page_lower, page_upper, begin_date, end_date, 
@@ -462,7 +1187,7 @@ def set_parameters(ARTICLE_API_KEY, page_lower, page_upper, begin_date, end_date
             
     if begin_date: # Check begin_date is not None
         try:
-            begin_date = pd.to_datetime(begin_date, errors='coerce').strftime('%Y%m%d')
+            begin_date = _format_date(begin_date)
         except:
             print("Error: The end_date is not entered in any of the recognizable formats. The retrieval is terminated. Please call the function again with the date entered in the format %Y%m%d.")
             Error = True
@@ -471,7 +1196,7 @@ def set_parameters(ARTICLE_API_KEY, page_lower, page_upper, begin_date, end_date
     
     if end_date: # Check end_date is not None
         try:
-            end_date = pd.to_datetime(end_date, errors='coerce').strftime('%Y%m%d')
+            end_date = _format_date(end_date)
         except:
             print("Error: The end_date is not entered in any of the recognizable formats. The retrieval is terminated. Please call the function again with the date entered in the format %Y%m%d.")
             Error = True
@@ -0,0 +1,458 @@
+'''Plans a retrieval of the article search that takes more than one day of its quota: the pages
+of the search are estimated from the number of hits and scheduled across the days, each run
+spends what is left of the day's budget on the pending pages, and the articles found are ranked
+by the number of comments expected on them for the comments endpoint, which has no daily quota.
+
+Usage: python -m nytcomments.planner plan PLAN API_KEY BEGIN_DATE END_DATE [--query Q] [--filter-query FQ]
+                                          [--daily-budget 500]
+       python -m nytcomments.planner run PLAN API_KEY
+       python -m nytcomments.planner status PLAN
+       python -m nytcomments.planner calibrate PLAN ARTICLES_CSV COMMENTS_CSV
+       python -m nytcomments.planner queue PLAN QUEUE [--limit N]'''
+
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import threading
+
+from math import log
+from datetime import datetime, timezone
+from requests.exceptions import HTTPError, RequestException
+
+from nytcomments.ratelimit import ARTICLES
+from nytcomments.client import default_client
+from nytcomments.checkpoint import immediate_transaction
+from nytcomments.metrics import QUOTA_HIT
+from nytcomments.sharding import MAX_PAGES, PAGE_SIZE, search_dates, search_window, split_window, window_pages
+from nytcomments.nytcomments import NYT_ARTICLE_API_URL, set_parameters
+
+DAILY_BUDGET = 500 # The Article Search API allows 500 requests per day and API key
+
+# The expected number of comments on an article of each type of material, used until the planner
+# is calibrated with a dataset retrieved earlier. They are rough, but keep the opinion pieces and
+# the news ahead of the notices that are never open for comments.
+MATERIAL_RATES = {'Op-Ed': 400, 'Editorial': 400, 'News': 150, 'Analysis': 150, 'News Analysis': 150,
+                  'Letter': 30, 'Review': 30, 'Interview': 30, 'Brief': 10, 'Obituary (Obit)': 10,
+                  'Correction': 0, 'Paid Death Notice': 0}
+DEFAULT_RATE = 20
+FRONT_PAGE_FACTOR = 3 # The articles on the front page of the print edition get more comments
+
+
+class CrawlPlanner(object):
+    '''Keeps the plan of a retrieval of the article search in a SQLite database at path, so that
+    it can be carried out over several days and runs.
+
+    plan estimates the number of pages of every date window of the search from the hits reported
+    for it (like nytcomments.sharding.plan_windows) and schedules them across the days with
+    daily_budget requests a day, counting the requests made for the estimate, which stops when
+    the budget of the current day (in UTC) is spent and is carried on by the next runs. run then
+    requests the pending pages until the budget of the day is spent or the API reports that the
+    quota is exhausted, and records the articles found. The articles are scored by the
+    number of comments expected on them, from their type of material, their section and their
+    place in the print edition, and ranked_articles and add_to_queue give them in that order to
+    get_comments or to a nytcomments.workqueue.WorkQueue.'''
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        with self.transaction() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value TEXT)')
+            connection.execute('CREATE TABLE IF NOT EXISTS pages (id INTEGER PRIMARY KEY, begin_date TEXT, '
+                               'end_date TEXT, page INTEGER, articles INTEGER, day INTEGER, status TEXT, '
+                               'UNIQUE (begin_date, end_date, page))')
+            connection.execute('CREATE TABLE IF NOT EXISTS windows (begin_date TEXT, end_date TEXT, '
+                               'PRIMARY KEY (begin_date, end_date))')
+            connection.execute('CREATE TABLE IF NOT EXISTS calls (day TEXT PRIMARY KEY, used INTEGER)')
+            connection.execute('CREATE TABLE IF NOT EXISTS articles (article_id TEXT PRIMARY KEY, url TEXT, '
+                               'section TEXT, material TEXT, print_page TEXT, score REAL, status TEXT, doc TEXT)')
+            connection.execute('CREATE TABLE IF NOT EXISTS rates (section TEXT, material TEXT, rate REAL, '
+                               'PRIMARY KEY (section, material))')
+
+    def transaction(self):
+        '''Runs the statements in a transaction that locks the database for writing.'''
+
+        return immediate_transaction(self.connection, self.lock)
+
+    def _setting(self, key, default=None):
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM settings WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else default
+
+    @property
+    def daily_budget(self):
+        return self._setting('daily_budget', DAILY_BUDGET)
+
+    def plan(self, ARTICLE_API_KEY, begin_date, end_date, query=None, filter_query=None, sort='newest',
+             daily_budget=DAILY_BUDGET, client=None, printout=True):
+        '''Estimates the pages of the search with the given parameters and schedules them across
+        the days, the pages with the most articles first. The requests made for the estimate are
+        taken from the budget of the current day, and the windows of dates left to count when it
+        is spent, or when the API fails, are counted by the next calls of plan or run. The pages
+        already in the plan keep their status, so a plan can be extended with more dates. Returns
+        the number of days the pages counted so far take.'''
+
+        if client is None:
+            client = default_client
+        params, DateError = set_parameters(ARTICLE_API_KEY, 0, 0, begin_date, end_date, sort, query, filter_query)
+        if DateError:
+            return 0
+        search_params = {key: value for key, value in params.items() if key != 'api-key'}
+
+        with self.transaction() as connection:
+            for key, value in [('params', search_params), ('daily_budget', daily_budget)]:
+                connection.execute('INSERT OR REPLACE INTO settings VALUES (?, ?)', (key, json.dumps(value)))
+            connection.execute('INSERT OR IGNORE INTO windows VALUES (?, ?)', search_dates(params))
+        estimated = self._estimate(params, client, printout)
+        days = self._schedule()
+        if printout:
+            with self.lock:
+                pages = self.connection.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+            print('The search has {} pages{}. Days needed with {} requests a day: {}.'.format(
+                pages, '' if estimated else ' counted so far', daily_budget, days))
+        return days
+
+    def _estimate(self, params, client, printout):
+        '''Counts the hits of the windows of dates not counted yet, splitting the ones with more
+        articles than the pages of the search return, and adds the pages of the others to the plan,
+        with the articles on their first page. Stops when the budget of the current day is spent or
+        a request fails, leaving the windows not counted for the next run. Returns True when every
+        window is counted.'''
+
+        max_hits = MAX_PAGES * PAGE_SIZE
+        while True:
+            with self.lock:
+                window = self.connection.execute('SELECT begin_date, end_date FROM windows '
+                                                 'ORDER BY begin_date LIMIT 1').fetchone()
+            if window is None:
+                return True
+            if not self.remaining_calls():
+                if printout:
+                    print("The budget for today is spent. The estimate continues with the next run tomorrow.")
+                return False
+            begin, end = window
+            before = _article_requests(client)
+            error = None
+            try:
+                hits, docs = search_window(client, NYT_ARTICLE_API_URL, params, begin, end)
+            except (RequestException, ValueError) as caught:
+                error = caught
+            self._spend(_article_requests(client) - before)
+            if isinstance(error, RequestException):
+                if printout:
+                    print(error, ". The estimate continues with the next run.")
+                return False
+            if error is not None: # The quota is exhausted before the budget
+                self._exhaust(client, str(error), printout)
+                return False
+
+            if (hits > max_hits) & (begin < end):
+                with self.transaction() as connection:
+                    connection.execute('DELETE FROM windows WHERE begin_date = ? AND end_date = ?', window)
+                    connection.executemany('INSERT OR IGNORE INTO windows VALUES (?, ?)', split_window(begin, end))
+                continue
+            if (hits > max_hits) & printout:
+                print('The {} articles on {} are more than the article search returns. Only the first {} are retrieved.'.format(hits, begin, max_hits))
+            pages = [(begin, end, page, min(PAGE_SIZE, hits - page * PAGE_SIZE)) for page in range(window_pages(hits))]
+            with self.transaction() as connection:
+                connection.execute('DELETE FROM windows WHERE begin_date = ? AND end_date = ?', window)
+                connection.executemany("INSERT OR IGNORE INTO pages (begin_date, end_date, page, articles, status) "
+                                       "VALUES (?, ?, ?, ?, 'pending')", pages)
+                first_page = connection.execute('SELECT id FROM pages WHERE begin_date = ? AND end_date = ? '
+                                                'AND page = 0', window).fetchone()
+            if first_page is not None:
+                self._add_articles(first_page[0], docs)
+
+    def _exhaust(self, client, message, printout):
+        '''Records that the quota of the current day is exhausted, so no more requests are made today.'''
+
+        client.metrics.emit(QUOTA_HIT, endpoint=ARTICLES, message=message)
+        budget = self.daily_budget
+        with self.transaction() as connection:
+            connection.execute('INSERT OR REPLACE INTO calls VALUES (?, ?)', (_today(), budget))
+        if printout:
+            print(message + ' for today. The retrieval continues with the next run tomorrow.')
+
+    def _schedule(self):
+        '''Assigns the pending pages to the days, starting with what is left of the current day,
+        the pages with the most articles first and otherwise in the order of the search. Returns
+        the number of days.'''
+
+        budget = self.daily_budget
+        with self.transaction() as connection:
+            pending = [page_id for page_id, in connection.execute(
+                "SELECT id FROM pages WHERE status = 'pending' ORDER BY articles DESC, id")]
+            left_today = max(budget - self._used(connection), 0)
+            days = [_day(position, left_today, budget) for position in range(len(pending))]
+            connection.executemany('UPDATE pages SET day = ? WHERE id = ?', zip(days, pending))
+        return len(set(days))
+
+    def _used(self, connection):
+        row = connection.execute('SELECT used FROM calls WHERE day = ?', (_today(),)).fetchone()
+        return row[0] if row is not None else 0
+
+    def _spend(self, calls):
+        '''Records the requests made to the article search today.'''
+
+        with self.transaction() as connection:
+            connection.execute('INSERT OR IGNORE INTO calls VALUES (?, 0)', (_today(),))
+            connection.execute('UPDATE calls SET used = used + ? WHERE day = ?', (calls, _today()))
+
+    def remaining_calls(self):
+        '''Returns the number of requests left in the budget of the current day.'''
+
+        budget = self.daily_budget
+        with self.lock:
+            return max(budget - self._used(self.connection), 0)
+
+    def run(self, ARTICLE_API_KEY, client=None, printout=True):
+        '''Counts the windows of dates left by the estimate of plan, then requests the pending
+        pages of the plan, in the order of the schedule, until the budget of the current day is
+        spent, the API reports that the quota is exhausted or every page is done, and records the
+        articles on them. A page that fails is left pending for the next run, which also starts
+        over when the connection to the API fails. Returns the number of new articles.'''
+
+        if client is None:
+            client = default_client
+        search_params = self._setting('params')
+        if search_params is None:
+            raise ValueError('The planner has no plan yet. Call plan first.')
+        params = dict(search_params, **{'api-key': ARTICLE_API_KEY})
+        with self.lock:
+            before = self.connection.execute('SELECT COUNT(*) FROM articles').fetchone()[0]
+        if self._estimate(params, client, printout):
+            self._schedule()
+            with self.lock:
+                pending = self.connection.execute("SELECT id, begin_date, end_date, page FROM pages WHERE "
+                                                  "status = 'pending' ORDER BY day, articles DESC, id").fetchall()
+        else:
+            pending = []
+
+        HTTPErrorCount = 0
+        for page_id, begin, end, page in pending:
+            if not self.remaining_calls():
+                if printout:
+                    print("The budget for today is spent. The retrieval continues with the next run tomorrow.")
+                break
+            before_calls = _article_requests(client)
+            try:
+                response = client.get(NYT_ARTICLE_API_URL, dict(params, begin_date=begin, end_date=end, page=page),
+                                      ARTICLES)
+                js = response.json()
+            except HTTPError:
+                HTTPErrorCount += 1
+                if printout:
+                    print(sys.exc_info()[1], ". Page {} of {}-{} is left for the next run.".format(page, begin, end))
+                if HTTPErrorCount < 5:
+                    continue
+                break
+            except RequestException:
+                if printout:
+                    print(sys.exc_info()[1], ". The retrieval continues with the next run.")
+                break
+            finally:
+                self._spend(_article_requests(client) - before_calls)
+
+            if js.get('message'): # The quota is exhausted before the budget
+                self._exhaust(client, js.get('message'), printout)
+                break
+            if js.get('status') != 'OK':
+                continue
+            self._add_articles(page_id, js['response']['docs'])
+
+        days = self._schedule()
+        with self.lock:
+            new_articles = self.connection.execute('SELECT COUNT(*) FROM articles').fetchone()[0] - before
+        if printout:
+            print('New articles found: {}. Days left in the plan: {}.'.format(new_articles, days))
+        return new_articles
+
+    def _add_articles(self, page_id, docs):
+        '''Records the articles on a page and marks the page done. Returns the number of new articles.'''
+
+        rates = self._rates()
+        rows = [(doc['_id'], doc.get('web_url'), doc.get('section_name'), doc.get('type_of_material'),
+                 doc.get('print_page'), expected_comments(doc, rates), json.dumps(doc)) for doc in docs]
+        with self.transaction() as connection:
+            before = connection.execute('SELECT COUNT(*) FROM articles').fetchone()[0]
+            connection.executemany("INSERT OR IGNORE INTO articles VALUES (?, ?, ?, ?, ?, ?, 'pending', ?)", rows)
+            connection.execute("UPDATE pages SET status = 'done' WHERE id = ?", (page_id,))
+            return connection.execute('SELECT COUNT(*) FROM articles').fetchone()[0] - before
+
+    def _rates(self):
+        with self.lock:
+            return {(section, material): rate for section, material, rate
+                    in self.connection.execute('SELECT section, material, rate FROM rates')}
+
+    def calibrate(self, articles_df, comments_df):
+        '''Learns the number of comments expected on the articles of each section and type of
+        material from a dataset retrieved earlier (the dataframes returned by get_dataset) and
+        scores the articles of the plan again with it.'''
+
+        counts = comments_df.groupby(comments_df.articleID.astype(str)).size()
+        articles = articles_df[['articleID', 'sectionName', 'typeOfMaterial']].astype(str)
+        articles['comments'] = articles.articleID.map(counts).fillna(0).values
+        rates = [(section, material, rate) for (section, material), rate
+                 in articles.groupby(['sectionName', 'typeOfMaterial']).comments.mean().items()]
+        rates.extend(('', material, rate) for material, rate
+                     in articles.groupby('typeOfMaterial').comments.mean().items())
+        with self.transaction() as connection:
+            connection.execute('DELETE FROM rates')
+            connection.executemany('INSERT INTO rates VALUES (?, ?, ?)', rates)
+        rates = self._rates()
+        with self.lock:
+            docs = self.connection.execute('SELECT article_id, doc FROM articles').fetchall()
+        with self.transaction() as connection:
+            connection.executemany('UPDATE articles SET score = ? WHERE article_id = ?',
+                                   ((expected_comments(json.loads(doc), rates), article_id)
+                                    for article_id, doc in docs))
+
+    def ranked_articles(self, limit=None):
+        '''Returns the list of tuples (url, expected_comments) of the articles whose comments are
+        not queued yet, the ones expected to have the most comments first.'''
+
+        with self.lock:
+            return self.connection.execute("SELECT url, score FROM articles WHERE status = 'pending' "
+                                           "ORDER BY score DESC, article_id LIMIT ?",
+                                           (-1 if limit is None else limit,)).fetchall()
+
+    def mark_queued(self, article_urls):
+        '''Marks the articles whose comments are retrieved or queued, so they are not ranked again.'''
+
+        with self.transaction() as connection:
+            connection.executemany("UPDATE articles SET status = 'queued' WHERE url = ?",
+                                   ((article_url,) for article_url in article_urls))
+
+    def add_to_queue(self, queue, limit=None):
+        '''Adds the URLs of the ranked articles to the work queue in their order, which is the
+        order the workers lease them in, and marks them queued. Returns the number added.'''
+
+        article_urls = [article_url for article_url, _ in self.ranked_articles(limit)]
+        added = queue.add(article_urls)
+        self.mark_queued(article_urls)
+        return added
+
+    def docs(self):
+        '''Returns the list of the docs of all the articles found, as returned by the article
+        search, which nytcomments.dataprocessing.preprocess_articles turns into the articles'
+        dataframe.'''
+
+        with self.lock:
+            return [json.loads(doc) for doc, in self.connection.execute('SELECT doc FROM articles ORDER BY rowid')]
+
+    def status(self):
+        '''Returns a dictionary with the number of windows of dates not counted yet, the number
+        of pages pending and done, the number of days the pending pages take, the requests left today and the number of articles pending and
+        queued.'''
+
+        counts = {'pages_pending': 0, 'pages_done': 0, 'articles_pending': 0, 'articles_queued': 0}
+        with self.lock:
+            counts['windows_left'] = self.connection.execute('SELECT COUNT(*) FROM windows').fetchone()[0]
+            for status, count in self.connection.execute('SELECT status, COUNT(*) FROM pages GROUP BY 1'):
+                counts['pages_' + status] = count
+            for status, count in self.connection.execute('SELECT status, COUNT(*) FROM articles GROUP BY 1'):
+                counts['articles_' + status] = count
+            counts['days_left'] = self.connection.execute("SELECT COUNT(DISTINCT day) FROM pages "
+                                                          "WHERE status = 'pending'").fetchone()[0]
+        counts['calls_left_today'] = self.remaining_calls()
+        return counts
+
+    def close(self):
+        '''Closes the database.'''
+
+        self.connection.close()
+
+
+def expected_comments(article, rates=None):
+    '''Returns the number of comments expected on the article (a doc returned by the article
+    search): the mean number of comments on the articles of its section and type of material,
+    or of its type of material, in the dataset the rates were calibrated with, and otherwise
+    a rough rate for its type of material, raised for the articles on the front page.'''
+
+    section = article.get('section_name') or 'Unknown'
+    material = article.get('type_of_material') or 'Unknown'
+    if rates:
+        for key in [(section, material), ('', material)]:
+            if key in rates:
+                return rates[key]
+    rate = MATERIAL_RATES.get(material, DEFAULT_RATE)
+    if str(article.get('print_page')) == '1':
+        rate *= FRONT_PAGE_FACTOR
+    return rate * (1 + log(1 + (article.get('word_count') or 0)) / 10) # Longer articles break the ties
+
+
+def _article_requests(client):
+    '''Returns the number of requests the client has sent to the article search, cached ones excluded.'''
+
+    return client.metrics.stats()['counters'].get('{}_requests'.format(ARTICLES), 0)
+
+
+def _today():
+    return datetime.now(timezone.utc).strftime('%Y%m%d')
+
+
+def _day(position, left_today, budget):
+    '''Returns the day (0 for today) of the page at the given position of the schedule.'''
+
+    if position < left_today:
+        return 0
+    return 1 + (position - left_today) // budget
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command')
+    plan_parser = subparsers.add_parser('plan', help='estimate the pages of the search and schedule them')
+    plan_parser.add_argument('plan')
+    plan_parser.add_argument('api_key')
+    plan_parser.add_argument('begin_date')
+    plan_parser.add_argument('end_date')
+    plan_parser.add_argument('--query')
+    plan_parser.add_argument('--filter-query')
+    plan_parser.add_argument('--daily-budget', type=int, default=DAILY_BUDGET)
+    run_parser = subparsers.add_parser('run', help="request the pending pages with today's budget")
+    run_parser.add_argument('plan')
+    run_parser.add_argument('api_key')
+    status_parser = subparsers.add_parser('status', help='print the progress of the plan')
+    status_parser.add_argument('plan')
+    calibrate_parser = subparsers.add_parser('calibrate', help='learn the expected comments from a dataset')
+    calibrate_parser.add_argument('plan')
+    calibrate_parser.add_argument('articles_csv')
+    calibrate_parser.add_argument('comments_csv')
+    queue_parser = subparsers.add_parser('queue', help='add the ranked articles to a work queue')
+    queue_parser.add_argument('plan')
+    queue_parser.add_argument('queue')
+    queue_parser.add_argument('--limit', type=int)
+    args = parser.parse_args(argv)
+
+    if args.command is None:
+        parser.print_help()
+        return 1
+    planner = CrawlPlanner(args.plan)
+    try:
+        if args.command == 'plan':
+            planner.plan(args.api_key, args.begin_date, args.end_date, query=args.query,
+                         filter_query=args.filter_query, daily_budget=args.daily_budget)
+        elif args.command == 'run':
+            planner.run(args.api_key)
+        elif args.command == 'status':
+            print(planner.status())
+        elif args.command == 'calibrate':
+            import pandas as pd
+            planner.calibrate(pd.read_csv(args.articles_csv), pd.read_csv(args.comments_csv))
+        elif args.command == 'queue':
+            from nytcomments.workqueue import WorkQueue
+            queue = WorkQueue(args.queue)
+            print('Added {} URLs to the queue.'.format(planner.add_to_queue(queue, args.limit)))
+            queue.close()
+    finally:
+        planner.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
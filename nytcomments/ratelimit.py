@@ -0,0 +1,116 @@
+import threading
+
+from time import monotonic, sleep
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+ARTICLES = 'articles' # The NYT Article Search API
+COMMENTS = 'comments' # The community endpoint used for the comments
+
+# The Article Search API allows 10 requests per minute. The community endpoint has no published
+# limit, so it is throttled to one request per second as it always has been.
+ARTICLES_RATE = 10 / 60
+COMMENTS_RATE = 1.
+
+
+class TokenBucket(object):
+    '''Allows on average `rate` requests per second with bursts of up to `capacity` requests.
+    The bucket is safe to share between threads. Each HTTP 429 response halves the rate and
+    pauses the requests for the duration given by the Retry-After header, and every successful
+    request raises the rate back towards its original value.'''
+
+    def __init__(self, rate, capacity=1):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        '''Takes a token from the bucket and returns the number of seconds to wait before using it.'''
+
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return max(0, -self.tokens / self.rate, self.paused_until - now)
+
+    def acquire(self):
+        '''Blocks until a request is allowed.'''
+
+        sleep(self.reserve())
+
+    def penalize(self, retry_after=None):
+        '''Slows down the requests after an HTTP 429 response.'''
+
+        with self.lock:
+            self.rate = max(self.rate / 2, self.max_rate / 64)
+            if retry_after is None:
+                retry_after = 1 / self.rate
+            self.paused_until = max(self.paused_until, monotonic() + retry_after)
+            self.tokens = min(self.tokens, 0)
+
+    def reward(self):
+        '''Speeds the requests back up after a successful response.'''
+
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 16)
+
+
+class RateLimiter(object):
+    '''Keeps separate token buckets for the Article Search API and the community endpoint.
+    A single rate limiter can be shared by all the retrieval functions, even when they
+    run in several threads at a time.'''
+
+    def __init__(self, articles_rate=ARTICLES_RATE, comments_rate=COMMENTS_RATE,
+                 articles_capacity=1, comments_capacity=1):
+        self.buckets = {ARTICLES: TokenBucket(articles_rate, articles_capacity),
+                        COMMENTS: TokenBucket(comments_rate, comments_capacity)}
+
+    def acquire(self, endpoint):
+        '''Blocks until a request to the endpoint is allowed.'''
+
+        self.buckets[endpoint].acquire()
+
+    def reserve(self, endpoint):
+        '''Takes a token for a request to the endpoint and returns the number of seconds to wait
+        before sending it, for the callers that wait without blocking (see nytcomments.aioclient).'''
+
+        return self.buckets[endpoint].reserve()
+
+    def penalize(self, endpoint, retry_after=None):
+        '''Slows down the requests to the endpoint after an HTTP 429 response.'''
+
+        self.buckets[endpoint].penalize(retry_after)
+
+    def reward(self, endpoint):
+        '''Speeds the requests to the endpoint back up after a successful response.'''
+
+        self.buckets[endpoint].reward()
+
+
+def parse_retry_after(value):
+    '''Returns the number of seconds given by a Retry-After header, or None if it is missing or invalid.'''
+
+    if not value:
+        return None
+    try:
+        return max(0., float(value))
+    except ValueError:
+        pass
+    try:
+        retry_date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_date is None:
+        return None
+    if retry_date.tzinfo is None:
+        retry_date = retry_date.replace(tzinfo=timezone.utc)
+    return max(0., (retry_date - datetime.now(timezone.utc)).total_seconds())
+
+
+default_rate_limiter = RateLimiter()
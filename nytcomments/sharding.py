@@ -0,0 +1,89 @@
+from math import ceil
+from datetime import timedelta
+
+from nytcomments.lazy import pd
+
+from nytcomments.ratelimit import ARTICLES
+
+MAX_PAGES = 200 # The Article Search API returns at most 200 pages for a query
+PAGE_SIZE = 10 # Every page has 10 articles
+FIRST_DATE = '20081031' # Used when the search has no begin_date
+
+
+def plan_windows(client, url, params, max_hits=MAX_PAGES * PAGE_SIZE, printout=True):
+    '''Splits the dates of the article search with the given parameters into windows with at
+    most max_hits articles each, so that every window can be crawled without reaching the cap
+    on the number of pages. The number of articles in a window is the number of hits reported
+    by the first page of the search, and the windows with more hits are split in halves until
+    they are small enough or only one day is left. Returns the list of tuples (begin_date,
+    end_date, hits, docs) of the windows with articles, in the order given by the sort parameter,
+    where docs are the articles on the first page of the window, so that the crawl of the window
+    can start from the second page.'''
+
+    windows = []
+    stack = [search_dates(params)]
+    while stack:
+        begin, end = stack.pop()
+        hits, docs = search_window(client, url, params, begin, end)
+        if (hits > max_hits) & (begin < end):
+            earlier, later = split_window(begin, end)
+            stack.append(later)
+            stack.append(earlier) # The earlier half is searched first
+            continue
+        if hits > max_hits:
+            if printout:
+                print('The {} articles on {} are more than the article search returns. Only the first {} are retrieved.'.format(hits, pd.to_datetime(begin).date(), max_hits))
+        if hits:
+            windows.append((begin, end, hits, docs))
+
+    if params.get('sort') != 'oldest':
+        windows.reverse()
+    if printout:
+        print('The search is split into {} date windows with {} articles in total.'.format(len(windows), sum(window[2] for window in windows)))
+        print()
+    return windows
+
+
+def search_dates(params):
+    '''Returns the tuple (begin_date, end_date) of the dates searched with the given parameters,
+    from the first date of the comments to today when they have none.'''
+
+    begin_date = pd.to_datetime(params.get('begin_date', FIRST_DATE))
+    end_date = pd.to_datetime(params['end_date']) if params.get('end_date') else pd.Timestamp.today().normalize()
+    return begin_date.strftime('%Y%m%d'), end_date.strftime('%Y%m%d')
+
+
+def split_window(begin_date, end_date):
+    '''Returns the two halves of the window between the given dates (strings YYYYMMDD) as tuples
+    (begin_date, end_date), the earlier first.'''
+
+    begin, end = pd.to_datetime(begin_date), pd.to_datetime(end_date)
+    middle = begin + timedelta(days=(end - begin).days // 2)
+    return ((begin.strftime('%Y%m%d'), middle.strftime('%Y%m%d')),
+            ((middle + timedelta(days=1)).strftime('%Y%m%d'), end.strftime('%Y%m%d')))
+
+
+def count_hits(client, url, params, begin_date, end_date):
+    '''Returns the number of articles found by the article search with the given parameters
+    between the given dates.'''
+
+    return search_window(client, url, params, begin_date, end_date)[0]
+
+
+def search_window(client, url, params, begin_date, end_date):
+    '''Requests the first page of the article search with the given parameters between the given
+    dates and returns the tuple (hits, docs) of the number of articles found and the articles on
+    the page. Raises ValueError with the message of the API if the search fails, such as when the
+    daily quota is exhausted.'''
+
+    window_params = dict(params, begin_date=begin_date, end_date=end_date, page=0)
+    js = client.get(url, window_params, ARTICLES).json()
+    if js.get('status') != 'OK':
+        raise ValueError(js.get('message', 'The article search failed.'))
+    return js['response']['meta']['hits'], js['response']['docs']
+
+
+def window_pages(hits):
+    '''Returns the number of pages of the article search with the given number of hits.'''
+
+    return min(MAX_PAGES, ceil(hits / PAGE_SIZE))
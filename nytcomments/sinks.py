@@ -0,0 +1,116 @@
+import os
+import json
+import uuid
+
+from nytcomments.lazy import pd
+
+FORMATS = {'parquet': 'parquet', 'feather': 'ipc', 'arrow': 'ipc'}
+CATEGORICAL_KEY = b'nytcomments.categorical' # The schema metadata listing the categorical columns
+
+
+class DatasetSink(object):
+    '''Writes batches of the preprocessed articles' and comments' dataframes as they arrive to
+    two partitioned datasets in the directories Articles{filename} and Comments{filename} in the
+    given path (and the keywords' dataframes to Keywords{filename}), in the Parquet or the Arrow IPC (Feather) format. Every batch is written to new
+    files in the partitions given by partition_cols, where pubDay is the publication date of the
+    article.
+    The categorical columns are stored dictionary-encoded and listed in the metadata of the
+    schema, so read_dataset gives them back as categoricals, including the partition columns and
+    the integer ones (such as userID and parentID), which Parquet stores as plain integers.
+    Requires pyarrow.'''
+
+    def __init__(self, path="", filename="", format='parquet', partition_cols=('sectionName', 'pubDay')):
+        try:
+            import pyarrow
+            import pyarrow.dataset
+        except ImportError:
+            raise ImportError('pyarrow is required to save the data in the {} format. '
+                              'It can be installed with: pip install pyarrow'.format(format))
+        if format not in FORMATS:
+            raise ValueError('Invalid format {}. The format must be one of: {}.'.format(format, ', '.join(FORMATS)))
+        self.pa = pyarrow
+        self.path = path
+        self.filename = filename
+        self.format = format
+        self.partition_cols = list(partition_cols)
+        self.batch = 0
+        self.run = uuid.uuid4().hex[:8] # Keeps the files of separate runs apart
+
+    def write(self, articles_df, comments_df=None, keywords_df=None):
+        '''Writes a batch of articles and, if given, the comments on them and their keywords.'''
+
+        pub_days = pd.Series(dtype=object)
+        if articles_df.shape[0]:
+            articles_df = articles_df.copy()
+            if 'pubDate' in articles_df.columns:
+                articles_df['pubDay'] = pd.to_datetime(articles_df.pubDate, errors='coerce', utc=True).dt.strftime('%Y-%m-%d')
+            else:
+                articles_df['pubDay'] = None
+            articles_df['pubDay'] = articles_df.pubDay.fillna('Unknown')
+            pub_days = articles_df.set_index(articles_df.articleID.astype(str)).pubDay
+            if 'keywords' in articles_df.columns: # Lists are stored as strings, like in the csv files
+                articles_df['keywords'] = articles_df.keywords.astype(str)
+            self._write_table(articles_df, 'Articles')
+
+        if (comments_df is not None) and comments_df.shape[0]:
+            comments_df = comments_df.copy()
+            if 'articleID' in comments_df.columns:
+                comments_df['pubDay'] = comments_df.articleID.astype(str).map(pub_days).fillna('Unknown')
+            else:
+                comments_df['pubDay'] = 'Unknown'
+            self._write_table(comments_df, 'Comments')
+
+        if (keywords_df is not None) and keywords_df.shape[0]:
+            self._write_table(keywords_df.copy(), 'Keywords')
+        self.batch += 1
+
+    def _write_table(self, df, name):
+        '''Converts the dataframe to an Arrow table and writes it to the dataset with the given name.'''
+
+        pa = self.pa
+        partition_cols = [col for col in self.partition_cols if col in df.columns]
+        categorical = [col for col in df.columns if isinstance(df[col].dtype, pd.CategoricalDtype)]
+        for col in partition_cols:
+            df[col] = df[col].astype(str)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+
+        # Columns without any values are stored as strings so that the batches share a schema
+        fields = []
+        for field in table.schema:
+            if pa.types.is_null(field.type):
+                field = field.with_type(pa.string())
+            elif pa.types.is_dictionary(field.type) and pa.types.is_null(field.type.value_type):
+                field = field.with_type(pa.dictionary(field.type.index_type, pa.string()))
+            fields.append(field)
+        metadata = dict(table.schema.metadata or {})
+        metadata[CATEGORICAL_KEY] = json.dumps(categorical).encode()
+        table = table.cast(pa.schema(fields, metadata=metadata))
+
+        extension = 'parquet' if self.format == 'parquet' else 'arrow'
+        pa.dataset.write_dataset(table, os.path.join(self.path, name + self.filename), format=FORMATS[self.format],
+                                 partitioning=partition_cols, partitioning_flavor='hive',
+                                 basename_template='part-{}-{}-{{i}}.{}'.format(self.run, self.batch, extension),
+                                 existing_data_behavior='overwrite_or_ignore')
+
+
+def read_dataset(path="", filename="", format='parquet', keywords_table=False):
+    '''Reads the articles' and comments' datasets written by DatasetSink and returns two pandas
+    dataframes, with the categorical columns they were written with. If keywords_table is True,
+    the tuple (articles_df, comments_df, article_keywords) is returned, with the keywords' dataset.'''
+
+    import pyarrow.dataset as ds
+
+    dataframes = []
+    for name in ['Articles', 'Comments'] + (['Keywords'] if keywords_table else []):
+        directory = os.path.join(path, name + filename)
+        if os.path.isdir(directory):
+            dataset = ds.dataset(directory, format=FORMATS[format], partitioning='hive')
+            df = dataset.to_table().to_pandas()
+            categorical = json.loads((dataset.schema.metadata or {}).get(CATEGORICAL_KEY, b'[]'))
+            for col in categorical:
+                if (col in df.columns) and not isinstance(df[col].dtype, pd.CategoricalDtype):
+                    df[col] = df[col].astype('category')
+            dataframes.append(df)
+        else:
+            dataframes.append(pd.DataFrame())
+    return tuple(dataframes)
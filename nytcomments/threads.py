@@ -0,0 +1,137 @@
+from nytcomments.lazy import pd, np
+
+
+class ThreadIndex(object):
+    '''An index of the threads of the comments in a comments' dataframe (as returned by get_dataset
+    or get_comments), built once with numpy so that the questions about the threads do not need
+    repeated self-merges of the dataframe.
+
+    The comments are sorted by commentID, and the replies to each of them are stored in CSR form:
+    the replies to the comment at position i are children[offsets[i]:offsets[i + 1]]. The depth in
+    the thread (1 for the comments on the article), the position of the root of the thread, and the
+    number of comments and the sum of the recommendations in the subtree of each comment (including
+    itself) are precomputed. A reply whose parent is not in the dataframe is treated as a root, and
+    when a commentID appears more than once, its first row is used.'''
+
+    def __init__(self, comments_df):
+        self.df = comments_df
+        number_rows = comments_df.shape[0]
+        ids = comments_df.commentID.values.astype('int64')
+        order = np.argsort(ids, kind='stable')
+        unique = np.ones(number_rows, dtype=bool)
+        unique[1:] = ids[order][1:] != ids[order][:-1]
+        order = order[unique]
+
+        self.rows = order # Position in the dataframe of the comment at each position of the index
+        self.ids = ids[order]
+        size = len(self.ids)
+        if 'inReplyTo' in comments_df.columns:
+            parent_ids = comments_df.inReplyTo.values.astype('int64')[order]
+        else:
+            parent_ids = np.zeros(size, dtype='int64')
+        if 'recommendations' in comments_df.columns:
+            recommendations = comments_df.recommendations.values.astype('int64')[order]
+        else:
+            recommendations = np.zeros(size, dtype='int64')
+
+        positions = np.minimum(np.searchsorted(self.ids, parent_ids), max(size - 1, 0))
+        found = (parent_ids != 0) & (self.ids[positions] == parent_ids) if size else np.zeros(0, dtype=bool)
+        self.parent = np.where(found, positions, -1)
+
+        replies = np.flatnonzero(self.parent >= 0)
+        self.children = replies[np.argsort(self.parent[replies], kind='stable')]
+        self.offsets = np.zeros(size + 1, dtype='int64')
+        np.cumsum(np.bincount(self.parent[replies], minlength=size), out=self.offsets[1:])
+
+        # Walk the threads level by level from the roots
+        self.depth = np.zeros(size, dtype='int32')
+        self.root = np.arange(size)
+        levels = []
+        level = np.flatnonzero(self.parent < 0)
+        depth = 1
+        while len(level):
+            self.depth[level] = depth
+            levels.append(level)
+            level = self._children_of(level)
+            self.root[level] = self.root[self.parent[level]]
+            depth += 1
+
+        # Sum the subtrees from the deepest level up
+        self.subtree_size = np.ones(size, dtype='int64')
+        self.subtree_recommendations = recommendations.copy()
+        for level in reversed(levels[1:]):
+            np.add.at(self.subtree_size, self.parent[level], self.subtree_size[level])
+            np.add.at(self.subtree_recommendations, self.parent[level], self.subtree_recommendations[level])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _children_of(self, positions):
+        '''Returns the positions of all the replies to the comments at the given positions.'''
+
+        starts = self.offsets[positions]
+        lengths = self.offsets[positions + 1] - starts
+        total = lengths.sum()
+        if not total:
+            return np.zeros(0, dtype='int64')
+        shifts = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        return self.children[shifts + np.arange(total)]
+
+    def position(self, comment_id):
+        '''Returns the position of the comment in the index. Raises KeyError if it is not there.'''
+
+        position = np.searchsorted(self.ids, comment_id)
+        if (position >= len(self.ids)) or (self.ids[position] != comment_id):
+            raise KeyError(comment_id)
+        return position
+
+    def _subtree_positions(self, position):
+        levels = [np.array([position])]
+        while len(levels[-1]):
+            levels.append(self._children_of(levels[-1]))
+        return np.concatenate(levels)
+
+    def subtree(self, comment_id):
+        '''Returns the rows of the comment and all the replies under it, level by level, in time
+        proportional to their number.'''
+
+        return self.df.iloc[self.rows[self._subtree_positions(self.position(comment_id))]]
+
+    def thread(self, comment_id):
+        '''Returns the rows of the whole thread that the comment is part of, from its root.'''
+
+        return self.df.iloc[self.rows[self._subtree_positions(self.root[self.position(comment_id)])]]
+
+    def replies(self, comment_id):
+        '''Returns the rows of the direct replies to the comment.'''
+
+        position = self.position(comment_id)
+        return self.df.iloc[self.rows[self.children[self.offsets[position]:self.offsets[position + 1]]]]
+
+    def to_dataframe(self):
+        '''Returns a dataframe with the index of the comments' dataframe and the columns depth,
+        rootID, subtreeSize and subtreeRecommendations of each comment.'''
+
+        positions = np.searchsorted(self.ids, self.df.commentID.values.astype('int64'))
+        return pd.DataFrame({'depth': self.depth[positions],
+                             'rootID': self.ids[self.root[positions]],
+                             'subtreeSize': self.subtree_size[positions],
+                             'subtreeRecommendations': self.subtree_recommendations[positions]},
+                            index=self.df.index)
+
+    def thread_stats(self):
+        '''Returns a dataframe with a row per thread, with the columns rootID, size (the number of
+        comments), replies, recommendations (the sum over the thread) and maxDepth, along with
+        articleID if the comments have it.'''
+
+        roots = np.flatnonzero(self.parent < 0)
+        max_depth = np.zeros(len(self.ids), dtype='int32')
+        np.maximum.at(max_depth, self.root, self.depth)
+        stats = pd.DataFrame({'rootID': self.ids[roots],
+                              'size': self.subtree_size[roots],
+                              'replies': self.subtree_size[roots] - 1,
+                              'recommendations': self.subtree_recommendations[roots],
+                              'maxDepth': max_depth[roots]})
+        if 'articleID' in self.df.columns:
+            stats.insert(0, 'articleID', self.df.articleID.iloc[self.rows[roots]].values)
+        return stats
@@ -0,0 +1,177 @@
+import os
+import json
+import threading
+
+from itertools import islice
+
+from nytcomments.lazy import pd, np
+
+# The categorical columns coded by default: the ones with few values, which stay few however much
+# data is retrieved. The columns with a value per comment or per user (such as permID, parentID or
+# userDisplayName) would make the vocabulary, and the categories of every batch, grow without end.
+# sharing, timespeople and trusted are stored as their codes, which are the codes of the vocabulary.
+VOCABULARY_COLUMNS = ('sectionName', 'newDesk', 'typeOfMaterial', 'commentType', 'status',
+                      'documentType', 'source', 'sharing', 'timespeople', 'trusted')
+
+
+class Vocabulary(object):
+    '''Gives every value of the low-cardinality categorical columns (VOCABULARY_COLUMNS, or the
+    given columns) a code that never changes: the values of each column are numbered in the order
+    they are first seen, and the numbering is extended as new values arrive and appended to a file
+    at path (a JSON line per value), to be loaded again by the next runs.
+
+    Passed to get_dataset, iter_dataset, get_comments or iter_comments (or to CommentAccumulator),
+    the columns of the vocabulary are coded by it instead of by the sorted values of each dataframe:
+    the categories of a column are the values that the dataframe uses, in the order of their codes
+    in the vocabulary. The dataframes of different batches, streams and runs can then be
+    concatenated with concat, which keeps the columns categorical. The other categorical columns
+    are coded as without a vocabulary.'''
+
+    def __init__(self, path=None, columns=VOCABULARY_COLUMNS):
+        self.path = path
+        self.names = frozenset(columns)
+        self.lock = threading.Lock()
+        self.columns = {} # Column name -> dictionary mapping each value to its code
+        self.saved = {} # Column name -> number of its values in the file at path
+        if (path is not None) and os.path.exists(path):
+            with open(path) as file:
+                for line in file:
+                    if line.strip():
+                        name, value = json.loads(line)
+                        codes = self.columns.setdefault(name, {})
+                        codes.setdefault(value, len(codes))
+            self.saved = {name: len(codes) for name, codes in self.columns.items()}
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def codes(self, name):
+        '''Returns the dictionary mapping the values of the column to their codes, which the new
+        values are added to.'''
+
+        with self.lock:
+            return self.columns.setdefault(name, {})
+
+    def categories(self, name):
+        '''Returns the list of the values of the column in the order of their codes.'''
+
+        return list(self.codes(name))
+
+    def categorical(self, name, codes):
+        '''Returns the categorical with the given codes of the vocabulary (-1 for the missing
+        values), whose categories are only the values it uses, in the order of their codes.'''
+
+        codes = np.asarray(codes)
+        used = np.unique(codes[codes >= 0])
+        values = self.codes(name)
+        with self.lock:
+            values = list(values) if len(used) else []
+        categories = [values[code] for code in used]
+        new_codes = np.where(codes >= 0, np.searchsorted(used, codes), -1).astype('int32')
+        return pd.Categorical.from_codes(new_codes, categories=categories)
+
+    def encode(self, df, columns=None):
+        '''Returns the dataframe with its categorical columns of the vocabulary (or the given ones
+        among them) recoded with the vocabulary, which is extended with their new values.'''
+
+        if columns is None:
+            columns = [name for name in df.columns if isinstance(df[name].dtype, pd.CategoricalDtype)]
+        columns = [name for name in columns if name in self.names]
+        if not columns:
+            return df
+        df = df.copy()
+        for name in columns:
+            df[name] = self.categorical(name, self._global_codes(name, df[name]))
+        return df
+
+    def _global_codes(self, name, series):
+        '''Returns the codes of the values of the series in the vocabulary, adding the new ones.'''
+
+        codes = self.codes(name)
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            values, categories = series.cat.codes.values, series.cat.categories
+        else:
+            values, categories = pd.factorize(series)
+        with self.lock:
+            remap = np.array([codes.setdefault(value, len(codes)) for value in categories], dtype='int32')
+        return np.where(values >= 0, remap[np.maximum(values, 0)] if len(remap) else -1, -1)
+
+    def concat(self, dfs):
+        '''Concatenates the dataframes (such as the batches of iter_dataset or the datasets of
+        separate runs coded by the vocabulary), keeping their categorical columns categorical.
+        The codes of each dataframe are remapped to the categories of the result, which are the
+        values used by any of them.'''
+
+        dfs = list(dfs)
+        order = []
+        categorical = []
+        for df in dfs:
+            for name in df.columns:
+                if name not in order:
+                    order.append(name)
+                if isinstance(df[name].dtype, pd.CategoricalDtype) and (name not in categorical):
+                    categorical.append(name)
+
+        columns = {}
+        for name in categorical:
+            parts = [df[name] if name in df.columns else None for df in dfs]
+            if name in self.names:
+                codes = np.concatenate([self._global_codes(name, part) if part is not None
+                                        else np.full(len(df), -1, dtype='int32') for part, df in zip(parts, dfs)])
+                columns[name] = self.categorical(name, codes)
+            else:
+                columns[name] = _union_categorical(parts, [len(df) for df in dfs])
+        df = pd.concat([df.drop(columns=[name for name in categorical if name in df.columns]) for df in dfs],
+                       ignore_index=True)
+        for name, column in columns.items():
+            df[name] = column
+        return df[order]
+
+    def save(self, path=None):
+        '''Appends the values added since the vocabulary was loaded or last saved to path, which
+        defaults to the path it was loaded from, so the file is never rewritten. Saving to another
+        path writes all the values to a new file.'''
+
+        path = path if path is not None else self.path
+        same_file = path == self.path
+        saved = self.saved if same_file else {}
+        with self.lock:
+            lines = []
+            for name, codes in self.columns.items():
+                lines.extend(json.dumps([name, value], default=_json_value)
+                             for value in islice(codes, saved.get(name, 0), None))
+            counts = {name: len(codes) for name, codes in self.columns.items()}
+        if lines or not same_file:
+            with open(path, 'a' if same_file else 'w') as file:
+                file.writelines(line + '\n' for line in lines)
+        if same_file:
+            self.saved = counts
+
+
+def _union_categorical(parts, lengths):
+    '''Returns the concatenation of the categoricals (None for the missing ones, with the given
+    lengths), with their categories merged and sorted like astype('category') does.'''
+
+    indexes = [part.cat.categories for part in parts if part is not None]
+    categories = indexes[0].append(indexes[1:]).unique()
+    try:
+        categories = categories.sort_values()
+    except TypeError: # The values can not be compared
+        pass
+    codes = []
+    for part, length in zip(parts, lengths):
+        if (part is None) or (not len(part.cat.categories)):
+            codes.append(np.full(length, -1))
+            continue
+        part_codes = part.cat.codes.values
+        remap = categories.get_indexer(part.cat.categories)
+        codes.append(np.where(part_codes >= 0, remap[np.maximum(part_codes, 0)], -1))
+    return pd.Categorical.from_codes(np.concatenate(codes).astype('int32'), categories=categories)
+
+
+def _json_value(value):
+    '''Converts the numpy scalars to the Python ones for json.'''
+
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError('{!r} can not be saved in the vocabulary'.format(value))
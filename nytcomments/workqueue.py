@@ -0,0 +1,263 @@
+'''A work queue that spreads the retrieval of the comments on a list of articles across several
+processes or machines sharing the queue database (and the directory of shards).
+
+Usage: python -m nytcomments.workqueue add QUEUE URLS_FILE
+       python -m nytcomments.workqueue work QUEUE SHARD_DIR [--processes 4] [--page-workers 1]
+       python -m nytcomments.workqueue status QUEUE
+       python -m nytcomments.workqueue merge QUEUE SHARD_DIR OUTPUT_CSV'''
+
+import os
+import sys
+import gzip
+import json
+import time
+import socket
+import sqlite3
+import argparse
+import threading
+
+from multiprocessing import Process
+from requests.exceptions import HTTPError
+
+from nytcomments.nytcomments import _retrieve_records
+from nytcomments.checkpoint import immediate_transaction
+from nytcomments.accumulator import CommentAccumulator
+
+LEASE_SECONDS = 3600 # Must be longer than the retrieval of the comments on any article
+MAX_ATTEMPTS = 3
+
+
+class WorkQueue(object):
+    '''Keeps the article URLs to retrieve in a SQLite database that can be shared by several
+    worker processes, also on other machines if the database is on a shared filesystem with
+    working file locks. A worker leases a URL for lease_seconds, writes the comments on the
+    article to a shard and marks the URL done. The leases of the workers that died expire
+    and the URLs are leased again, up to max_attempts times.'''
+
+    def __init__(self, path, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        with self.transaction() as connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS tasks '
+                               '(id INTEGER PRIMARY KEY, url TEXT UNIQUE, status TEXT, worker TEXT, '
+                               'expires REAL, attempts INTEGER, shard TEXT)')
+
+    def transaction(self):
+        '''Runs the statements in a transaction that locks the database for writing.'''
+
+        return immediate_transaction(self.connection, self.lock)
+
+    def add(self, article_urls):
+        '''Adds the URLs to the queue, except the ones already in it, and returns the number added.'''
+
+        if isinstance(article_urls, str):
+            article_urls = [article_urls]
+        with self.transaction() as connection:
+            before = connection.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+            connection.executemany("INSERT OR IGNORE INTO tasks (url, status, attempts) VALUES (?, 'pending', 0)",
+                                   ((article_url,) for article_url in article_urls))
+            return connection.execute('SELECT COUNT(*) FROM tasks').fetchone()[0] - before
+
+    def lease(self, worker_id):
+        '''Leases the next pending URL, or the next one whose lease has expired, to the worker and
+        returns the tuple (task_id, article_url), or None if there is nothing left to lease.'''
+
+        now = time.time()
+        with self.transaction() as connection:
+            row = connection.execute("SELECT id, url, status FROM tasks WHERE attempts < ? AND "
+                                     "(status = 'pending' OR (status = 'leased' AND expires < ?)) "
+                                     "ORDER BY id LIMIT 1", (self.max_attempts, now)).fetchone()
+            if row is None:
+                return None
+            task_id, article_url, status = row
+            # An expired lease counts as a failed attempt
+            connection.execute("UPDATE tasks SET status = 'leased', worker = ?, expires = ?, attempts = attempts + ? "
+                               "WHERE id = ?", (worker_id, now + self.lease_seconds, int(status == 'leased'), task_id))
+        return task_id, article_url
+
+    def complete(self, task_id, worker_id, shard):
+        '''Marks the URL leased by the worker done, with the name of the shard holding its comments.
+        Returns False if the lease was taken over by another worker in the meantime.'''
+
+        with self.transaction() as connection:
+            cursor = connection.execute("UPDATE tasks SET status = 'done', shard = ?, expires = NULL "
+                                        "WHERE id = ? AND worker = ? AND status = 'leased'", (shard, task_id, worker_id))
+            return cursor.rowcount > 0
+
+    def release(self, task_id, worker_id):
+        '''Gives back the URL leased by the worker after a failed attempt, so it can be leased again.'''
+
+        with self.transaction() as connection:
+            connection.execute("UPDATE tasks SET status = 'pending', worker = NULL, expires = NULL, "
+                               "attempts = attempts + 1 WHERE id = ? AND worker = ? AND status = 'leased'",
+                               (task_id, worker_id))
+
+    def status(self):
+        '''Returns a dictionary with the number of URLs that are pending, leased, done and failed
+        (the ones that are not done after max_attempts attempts).'''
+
+        counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        with self.lock:
+            rows = self.connection.execute("SELECT CASE WHEN status != 'done' AND attempts >= ? THEN 'failed' "
+                                           "ELSE status END, COUNT(*) FROM tasks GROUP BY 1",
+                                           (self.max_attempts,)).fetchall()
+        counts.update(rows)
+        return counts
+
+    def shards(self):
+        '''Returns the list of tuples (article_url, shard) of the URLs that are done, in the order
+        they were added.'''
+
+        with self.lock:
+            return self.connection.execute("SELECT url, shard FROM tasks WHERE status = 'done' "
+                                           "ORDER BY id").fetchall()
+
+    def close(self):
+        '''Closes the database.'''
+
+        self.connection.close()
+
+
+def write_shard(shard_dir, task_id, article_url, comments):
+    '''Writes the comments on the article (as returned by the API) to a gzipped JSON shard and
+    returns its name. The shard is written to a temporary file first, so it is never incomplete.'''
+
+    shard = '{}.json.gz'.format(task_id)
+    filename = os.path.join(shard_dir, shard)
+    temporary = '{}.{}.tmp'.format(filename, os.getpid())
+    with gzip.open(temporary, 'wt', encoding='utf-8') as file:
+        json.dump({'url': article_url, 'comments': comments}, file)
+    os.replace(temporary, filename)
+    return shard
+
+
+def read_shard(shard_dir, shard):
+    '''Returns the URL of the article and the list of comments in the shard.'''
+
+    with gzip.open(os.path.join(shard_dir, shard), 'rt', encoding='utf-8') as file:
+        data = json.load(file)
+    return data['url'], data['comments']
+
+
+def run_worker(queue_path, shard_dir, worker_id=None, page_workers=1, client=None, printout=True,
+               lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+    '''Leases the URLs in the queue one at a time, retrieves the comments on each article and
+    writes them to a shard in shard_dir, until the queue is empty or the connection fails. A URL
+    whose comments are not all retrieved (a page failed after the retries of the client) is given
+    back to the queue, to be leased again until it has failed max_attempts times, and the worker
+    goes on with the next one. Returns the number of articles completed.'''
+
+    queue = WorkQueue(queue_path, lease_seconds, max_attempts)
+    if worker_id is None:
+        worker_id = '{}-{}'.format(socket.gethostname(), os.getpid())
+    os.makedirs(shard_dir, exist_ok=True)
+
+    completed = 0
+    try:
+        while True:
+            leased = queue.lease(worker_id)
+            if leased is None:
+                break
+            task_id, article_url = leased
+            try:
+                comments, error = _retrieve_records(article_url, printout=printout, page_workers=page_workers,
+                                                    client=client, strict=True)
+            except HTTPError:
+                if printout:
+                    print(sys.exc_info()[1], '. The URL {} is given back to the queue.'.format(article_url))
+                queue.release(task_id, worker_id)
+                continue
+            if error:
+                queue.release(task_id, worker_id)
+                break
+            shard = write_shard(shard_dir, task_id, article_url, comments)
+            if queue.complete(task_id, worker_id, shard):
+                completed += 1
+    finally:
+        queue.close()
+    if printout:
+        print('Worker {} completed {} articles.'.format(worker_id, completed))
+    return completed
+
+
+def run_workers(queue_path, shard_dir, processes=4, **kwargs):
+    '''Runs run_worker in the given number of processes and waits for all of them to finish.
+    Each process sends its requests through its own client and rate limiter.'''
+
+    workers = [Process(target=run_worker, args=(queue_path, shard_dir), kwargs=kwargs) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def merge_shards(queue_path, shard_dir, printout=True):
+    '''Returns the preprocessed comments' dataframe of all the articles that are done in the queue,
+    like the one returned by get_comments.'''
+
+    queue = WorkQueue(queue_path)
+    try:
+        shards = queue.shards()
+        counts = queue.status()
+    finally:
+        queue.close()
+
+    comments_data = CommentAccumulator()
+    for _, shard in shards:
+        _, comments = read_shard(shard_dir, shard)
+        comments_data.append(comments)
+    comments_df = comments_data.to_dataframe()
+
+    if printout:
+        print("Total comments retrieved: ", comments_df.shape[0])
+        if counts['pending'] + counts['leased'] + counts['failed']:
+            print('{pending} articles are pending, {leased} are leased and {failed} failed.'.format(**counts))
+    return comments_df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command')
+    add_parser = subparsers.add_parser('add', help='add the URLs in a file (one per line) to the queue')
+    add_parser.add_argument('queue')
+    add_parser.add_argument('urls_file')
+    work_parser = subparsers.add_parser('work', help='retrieve the comments on the articles in the queue')
+    work_parser.add_argument('queue')
+    work_parser.add_argument('shard_dir')
+    work_parser.add_argument('--processes', type=int, default=1)
+    work_parser.add_argument('--page-workers', type=int, default=1)
+    status_parser = subparsers.add_parser('status', help='print the number of articles in each state')
+    status_parser.add_argument('queue')
+    merge_parser = subparsers.add_parser('merge', help='save the comments in the shards to a csv file')
+    merge_parser.add_argument('queue')
+    merge_parser.add_argument('shard_dir')
+    merge_parser.add_argument('output')
+    args = parser.parse_args(argv)
+
+    if args.command == 'add':
+        with open(args.urls_file) as file:
+            article_urls = [line.strip() for line in file if line.strip()]
+        queue = WorkQueue(args.queue)
+        print('Added {} URLs to the queue.'.format(queue.add(article_urls)))
+        queue.close()
+    elif args.command == 'work':
+        run_workers(args.queue, args.shard_dir, processes=args.processes, page_workers=args.page_workers)
+    elif args.command == 'status':
+        queue = WorkQueue(args.queue)
+        print(queue.status())
+        queue.close()
+    elif args.command == 'merge':
+        merge_shards(args.queue, args.shard_dir).to_csv(args.output, index=False)
+    else:
+        parser.print_help()
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -14,8 +14,14 @@ setup(name='nytcomments',
       author_email='kesar01@gmail.com',
       license='MIT',
       packages=['nytcomments'],
+      python_requires='>=3.7',
       install_requires=[
           'requests',
           'pandas',
       ],
+      extras_require={
+          'parquet': ['pyarrow'],
+          'fast': ['orjson'],
+          'async': ['aiohttp'],
+      },
       zip_safe=False)
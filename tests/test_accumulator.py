@@ -0,0 +1,45 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from replay_server import ReplayServer
+
+from nytcomments.client import Client
+from nytcomments.ratelimit import RateLimiter
+from nytcomments.nytcomments import get_comments, get_dataset
+
+
+@pytest.fixture(scope='module')
+def server():
+    server = ReplayServer(number_articles=20, comments_per_article=(0, 300), depth=3).start()
+    yield server
+    server.stop()
+
+
+def client(server):
+    return Client(rate_limiter=RateLimiter(1e6, 1e6), base_url=server.url)
+
+
+def test_spilled_comments_are_the_same(server, tmp_path):
+    urls = [article['web_url'] for article in server.articles]
+    expected = get_comments(urls, printout=False, client=client(server))
+    spilling_client = client(server)
+    comments_df = get_comments(urls, printout=False, client=spilling_client, max_memory=50000,
+                               spill_dir=str(tmp_path))
+    assert spilling_client.metrics.stats()['counters']['spilled_rows'] > 0
+    assert comments_df.equals(expected)
+    assert os.listdir(str(tmp_path)) == [] # The chunks are deleted with the accumulator
+
+
+def test_get_dataset_spills_with_workers(server, tmp_path):
+    kwargs = dict(page_upper=2, begin_date='20000101', end_date='20301231', printout=False, workers=3)
+    articles_df, expected = get_dataset('key', client=client(server), **kwargs)
+    spilling_client = client(server)
+    spilled_articles_df, comments_df = get_dataset('key', client=spilling_client, max_memory=50000,
+                                                   spill_dir=str(tmp_path), **kwargs)
+    assert spilling_client.metrics.stats()['counters']['spilled_rows'] > 0
+    assert spilled_articles_df.equals(articles_df)
+    assert comments_df.equals(expected)
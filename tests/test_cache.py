@@ -0,0 +1,79 @@
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from replay_server import ReplayServer
+
+from nytcomments.cache import ResponseCache
+from nytcomments.archive import PayloadArchive
+from nytcomments.client import Client
+from nytcomments.jsonp import JSONP_CALLBACK
+from nytcomments.ratelimit import ARTICLES, COMMENTS, RateLimiter
+from nytcomments.nytcomments import NYT_ARTICLE_API_URL, get_comments
+
+SEARCH_PARAMS = {'api-key': 'key', 'begin_date': '20000101', 'end_date': '20301231', 'page': 0}
+
+
+def client(server, cache):
+    return Client(rate_limiter=RateLimiter(1e6, 1e6), base_url=server.url, cache=cache)
+
+
+def test_quota_reply_is_not_cached(tmp_path):
+    cache = ResponseCache(str(tmp_path))
+    server = ReplayServer(number_articles=10, quota=0).start()
+    try:
+        js = client(server, cache).get(NYT_ARTICLE_API_URL, SEARCH_PARAMS, ARTICLES).json()
+    finally:
+        server.stop()
+    assert 'message' in js
+    assert cache.get(ARTICLES, NYT_ARTICLE_API_URL, SEARCH_PARAMS) is None
+
+    server = ReplayServer(number_articles=10).start()
+    try:
+        js = client(server, cache).get(NYT_ARTICLE_API_URL, SEARCH_PARAMS, ARTICLES).json()
+        assert js['status'] == 'OK'
+        assert server.requests['articles'] == 1
+        client(server, cache).get(NYT_ARTICLE_API_URL, SEARCH_PARAMS, ARTICLES)
+        assert server.requests['articles'] == 1
+    finally:
+        server.stop()
+        cache.close()
+
+
+@pytest.mark.parametrize('endpoint, content, stored', [
+    (ARTICLES, json.dumps({'status': 'OK', 'response': {'docs': []}}).encode(), True),
+    (ARTICLES, json.dumps({'message': 'API rate limit exceeded'}).encode(), False),
+    (ARTICLES, b'<html>Service Unavailable</html>', False),
+    (COMMENTS, JSONP_CALLBACK + json.dumps({'status': 'OK', 'results': {'comments': []}}).encode() + b');', True),
+    (COMMENTS, JSONP_CALLBACK + json.dumps({'status': 'ERROR', 'results': {}}).encode() + b');', False),
+])
+def test_only_successful_payloads_are_cached(tmp_path, endpoint, content, stored):
+    cache = ResponseCache(str(tmp_path))
+    params = {'url': 'https://www.nytimes.com/a.html', 'offset': 0}
+    assert cache.put(endpoint, 'https://api.example.com/path', params, content) == stored
+    assert cache.get(endpoint, 'https://api.example.com/path', params) == (content if stored else None)
+    cache.close()
+
+
+def test_cached_responses_are_archived(tmp_path):
+    server = ReplayServer(number_articles=1, comments_per_article=(30, 30)).start()
+    article_url = server.articles[0]['web_url']
+    cache = ResponseCache(str(tmp_path / 'cache'))
+    try:
+        shapes, pages = [], []
+        for name in ['requested', 'cached']:
+            archive = PayloadArchive(str(tmp_path / name))
+            comments_client = Client(rate_limiter=RateLimiter(1e6, 1e6), base_url=server.url, cache=cache, archive=archive)
+            shapes.append(get_comments(article_url, printout=False, client=comments_client).shape)
+            pages.append(archive.comment_pages(article_url))
+            archive.close()
+        assert shapes[0] == shapes[1]
+        assert pages[0] == pages[1]
+        assert comments_client.metrics.stats()['counters']['cache_hits'] == len(pages[1]) == server.requests['comments']
+    finally:
+        server.stop()
+        cache.close()
@@ -0,0 +1,62 @@
+import os
+import sys
+import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from replay_server import ReplayServer
+
+import nytcomments.nytcomments as nytcomments
+from nytcomments.client import Client
+from nytcomments.ratelimit import RateLimiter
+from nytcomments.nytcomments import get_dataset, get_comments
+
+
+def client(server):
+    return Client(rate_limiter=RateLimiter(1e6, 1e6), base_url=server.url)
+
+
+def on_day(monkeypatch, day):
+    class FixedDate(datetime.datetime):
+        @classmethod
+        def today(cls):
+            return cls(2019, 1, day)
+    monkeypatch.setattr(nytcomments, 'datetime', FixedDate)
+
+
+def test_resume_with_default_dates_on_a_later_day(tmp_path, monkeypatch):
+    kwargs = dict(page_upper=4, printout=False, checkpoint_dir=str(tmp_path))
+    server = ReplayServer(number_articles=40, comments_per_article=(0, 60), quota=2).start()
+    try:
+        on_day(monkeypatch, 1)
+        articles_df, _ = get_dataset('key', client=client(server), **kwargs) # Stopped by the quota
+    finally:
+        server.stop()
+    assert articles_df.shape[0] < 40
+
+    server = ReplayServer(number_articles=40, comments_per_article=(0, 60)).start()
+    try:
+        on_day(monkeypatch, 2)
+        articles_df, comments_df = get_dataset('key', client=client(server), resume=True, **kwargs)
+        resumed = dict(server.requests)
+        expected_articles, expected_comments = get_dataset('key', client=client(server), page_upper=4, printout=False)
+    finally:
+        server.stop()
+    assert resumed['articles'] == 2 # Only the pages the quota stopped
+    assert articles_df.equals(expected_articles)
+    assert comments_df.equals(expected_comments)
+
+
+def test_resume_comments_from_a_generator_of_urls(tmp_path):
+    server = ReplayServer(number_articles=6, comments_per_article=(30, 60)).start()
+    urls = [article['web_url'] for article in server.articles]
+    try:
+        first = get_comments((url for url in urls), printout=False, client=client(server),
+                             checkpoint_dir=str(tmp_path))
+        requests = server.requests['comments']
+        resumed = get_comments((url for url in urls), printout=False, client=client(server),
+                               checkpoint_dir=str(tmp_path), resume=True)
+    finally:
+        server.stop()
+    assert server.requests['comments'] == requests # Every article was recorded as done
+    assert resumed.equals(first)
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+from requests.exceptions import HTTPError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from replay_server import ReplayServer
+
+from nytcomments.client import Client
+from nytcomments.metrics import QUOTA_HIT
+from nytcomments.ratelimit import ARTICLES, RateLimiter
+from nytcomments.nytcomments import NYT_ARTICLE_API_URL
+
+
+def test_throttled_request_raises_once_the_retries_are_exhausted():
+    server = ReplayServer(number_articles=1, throttle_rate=1.).start()
+    client = Client(rate_limiter=RateLimiter(1e6, 1e6), base_url=server.url, max_retries=2)
+    events = []
+    client.metrics.on(QUOTA_HIT, lambda **data: events.append(data))
+    try:
+        with pytest.raises(HTTPError) as error:
+            client.get(NYT_ARTICLE_API_URL, {'api-key': 'key', 'page': 0}, ARTICLES)
+    finally:
+        server.stop()
+    assert error.value.response.status_code == 429
+    assert server.requests['throttled'] == 3
+    assert len(events) == 1
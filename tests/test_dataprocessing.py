@@ -0,0 +1,83 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from replay_server import ReplayServer
+
+from nytcomments.client import Client
+from nytcomments.ratelimit import RateLimiter
+from nytcomments.vocabulary import Vocabulary
+from nytcomments.dataprocessing import join_articles, preprocess_articles, preprocess_articles_dataframe
+from nytcomments.nytcomments import get_dataset, iter_dataset
+
+SEARCH = dict(begin_date='20000101', end_date='20301231', printout=False)
+
+
+@pytest.fixture(scope='module')
+def server():
+    server = ReplayServer(number_articles=30, comments_per_article=(0, 200), depth=3).start()
+    yield server
+    server.stop()
+
+
+def client(server):
+    return Client(rate_limiter=RateLimiter(1e6, 1e6), base_url=server.url)
+
+
+def test_normalized_comments_join_back(server):
+    articles_df, comments_df = get_dataset('key', page_upper=3, client=client(server), workers=2, **SEARCH)
+    normalized_articles_df, normalized_df = get_dataset('key', page_upper=3, client=client(server), workers=2,
+                                                        normalized=True, **SEARCH)
+    assert normalized_articles_df.equals(articles_df)
+    assert normalized_df.shape[1] < comments_df.shape[1]
+    assert normalized_df.memory_usage(deep=True).sum() < comments_df.memory_usage(deep=True).sum()
+    assert join_articles(normalized_df, normalized_articles_df)[comments_df.columns].equals(comments_df)
+
+
+def test_single_pass_preprocessing_is_the_same(server):
+    docs = server.articles
+    expected = preprocess_articles_dataframe(pd.DataFrame(docs))
+    articles_df = preprocess_articles(docs)
+    assert list(articles_df.columns) == list(expected.columns)
+    assert articles_df.equals(expected)
+
+    articles_df, keywords_df = preprocess_articles(docs, keywords_table=True)
+    assert articles_df.equals(expected.drop(columns='keywords'))
+    assert list(keywords_df.columns) == ['articleID', 'rank', 'name', 'value']
+    assert keywords_df.shape[0] == sum(len(doc['keywords']) for doc in docs)
+    assert list(keywords_df.articleID.cat.categories) == list(articles_df.articleID.cat.categories)
+    first = keywords_df[keywords_df.articleID == docs[0]['_id']]
+    assert list(first.value) == [keyword['value'] for keyword in docs[0]['keywords']]
+
+
+def test_get_dataset_returns_the_keywords_table(server):
+    articles_df, comments_df, keywords_df = get_dataset('key', page_upper=2, client=client(server),
+                                                        keywords_table=True, **SEARCH)
+    assert 'keywords' not in articles_df.columns
+    assert set(keywords_df.articleID.astype(str)) == set(articles_df.articleID.astype(str))
+    assert comments_df.shape[0] > 0
+
+
+def test_batches_concatenate_with_the_vocabulary(server, tmp_path):
+    path = str(tmp_path / 'vocabulary.jsonl')
+    articles_df, comments_df = get_dataset('key', page_upper=3, client=client(server), **SEARCH)
+    first_articles_df, first_df = get_dataset('key', page_upper=1, client=client(server),
+                                              vocabulary=Vocabulary(path), **SEARCH)
+    vocabulary = Vocabulary(path) # Loaded from the file saved by the first run
+    batches = list(iter_dataset('key', page_lower=1, page_upper=3, client=client(server), vocabulary=vocabulary,
+                                batch_size=500, **SEARCH))
+    assert len(batches) > 1
+
+    all_articles_df = vocabulary.concat([first_articles_df] + [batch[0] for batch in batches])
+    all_df = vocabulary.concat([first_df] + [batch[1] for batch in batches])
+    for name in vocabulary.names & set(all_df.columns):
+        if isinstance(comments_df[name].dtype, pd.CategoricalDtype): # sharing, timespeople and trusted are codes
+            assert isinstance(all_df[name].dtype, pd.CategoricalDtype), name
+    assert all_articles_df.shape == articles_df.shape
+    assert all_df.shape == comments_df.shape
+    for name in ['commentID', 'userID', 'sectionName', 'recommendations']:
+        assert list(all_df[name].astype(str)) == list(comments_df[name].astype(str)), name
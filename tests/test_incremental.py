@@ -0,0 +1,47 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from replay_server import ReplayServer, make_comment
+
+from nytcomments.client import Client
+from nytcomments.ratelimit import RateLimiter
+from nytcomments.dataprocessing import get_last_seen
+from nytcomments.nytcomments import get_comments, get_dataset
+
+
+def client(server):
+    return Client(rate_limiter=RateLimiter(1e6, 1e6), base_url=server.url)
+
+
+def add_new_comments(server, article_url, number_comments):
+    comments = server.comments[article_url]
+    newest = comments[0]['commentID']
+    new_comments = [make_comment(newest + i, 1) for i in range(number_comments, 0, -1)]
+    comments[:0] = new_comments
+    return [comment['commentID'] for comment in new_comments]
+
+
+def test_only_the_new_comments_are_retrieved():
+    server = ReplayServer(number_articles=6, comments_per_article=(60, 120)).start()
+    try:
+        articles_df, comments_df = get_dataset('key', page_upper=1, begin_date='20000101', end_date='20301231',
+                                               printout=False, client=client(server))
+        last_seen = get_last_seen(articles_df, comments_df)
+        assert len(last_seen) == 6
+        urls = sorted(last_seen)
+        new_ids = add_new_comments(server, urls[0], 3) + add_new_comments(server, urls[1], 30)
+
+        requests = server.requests['comments']
+        new_df = get_comments(urls, last_seen=last_seen, printout=False, client=client(server), workers=2)
+        assert sorted(new_df.commentID) == sorted(new_ids)
+        # The retrieval of an article stops at the first page with old comments
+        assert server.requests['comments'] - requests == len(urls) + 1
+
+        refreshed_df = get_comments(urls, last_seen=last_seen, refresh_window=5, printout=False, client=client(server))
+    finally:
+        server.stop()
+    parents = refreshed_df[refreshed_df.inReplyTo == 0]
+    assert set(new_ids) <= set(parents.commentID)
+    assert parents.shape[0] == len(new_ids) + 5 * len(urls)
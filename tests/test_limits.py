@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from replay_server import ReplayServer
+
+from nytcomments.client import Client
+from nytcomments.ratelimit import RateLimiter
+from nytcomments.nytcomments import get_comments, get_dataset
+
+
+@pytest.fixture(scope='module')
+def server():
+    server = ReplayServer(number_articles=10, comments_per_article=(100, 600), depth=3).start()
+    yield server
+    server.stop()
+
+
+def client(server):
+    return Client(rate_limiter=RateLimiter(1e6, 1e6), base_url=server.url)
+
+
+def test_get_comments_limit_does_not_depend_on_workers(server):
+    urls = [article['web_url'] for article in server.articles]
+    expected = get_comments(urls, max_comments=2000, printout=False, client=client(server))
+    assert expected.shape[0] == 2000
+    for kwargs in [dict(workers=5), dict(page_workers=3), dict(workers=3, page_workers=3)]:
+        comments_df = get_comments(urls, max_comments=2000, printout=False, client=client(server), **kwargs)
+        assert comments_df.equals(expected), kwargs
+
+
+def test_get_dataset_limit_does_not_depend_on_workers(server):
+    kwargs = dict(page_upper=1, begin_date='20000101', end_date='20301231', max_comments=1500, printout=False)
+    articles_df, comments_df = get_dataset('key', client=client(server), **kwargs)
+    assert comments_df.shape[0] == 1500
+    articles_df2, comments_df2 = get_dataset('key', client=client(server), workers=4, page_workers=2, **kwargs)
+    assert articles_df2.equals(articles_df)
+    assert comments_df2.equals(comments_df)
+
+
+def test_no_requests_after_the_limit_is_reached():
+    server = ReplayServer(number_articles=8, comments_per_article=(400, 400), latency=0.02).start()
+    urls = [article['web_url'] for article in server.articles]
+    try:
+        comments_df = get_comments(urls, max_comments=1000, printout=False, client=client(server), workers=4,
+                                   page_workers=2)
+        requests = server.requests['comments']
+        time.sleep(0.5)
+        # only the requests in flight when get_comments returned may still be answered
+        assert server.requests['comments'] <= requests + 4 * 2
+    finally:
+        server.stop()
+    assert comments_df.shape[0] == 1000
@@ -0,0 +1,71 @@
+import os
+import sys
+import subprocess
+
+import pandas as pd
+import pytest
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks')
+sys.path.insert(0, BENCHMARKS)
+
+from replay_server import ReplayServer
+
+from nytcomments.client import Client
+from nytcomments.ratelimit import RateLimiter
+from nytcomments.nytcomments import get_articles, get_comments, get_dataset
+
+SEARCH = dict(page_upper=2, begin_date='20000101', end_date='20301231', printout=False)
+
+
+@pytest.fixture(scope='module')
+def server():
+    server = ReplayServer(number_articles=20, comments_per_article=(0, 200), depth=3).start()
+    yield server
+    server.stop()
+
+
+def client(server):
+    return Client(rate_limiter=RateLimiter(1e6, 1e6), base_url=server.url)
+
+
+def test_records_have_the_rows_of_the_dataframes(server):
+    articles_df, comments_df = get_dataset('key', client=client(server), **SEARCH)
+    articles, comments = get_dataset('key', client=client(server), output='records', **SEARCH)
+    records_df = pd.DataFrame(comments)
+    assert sorted(records_df.columns) == sorted(comments_df.columns)
+    assert list(records_df.commentID) == list(comments_df.commentID)
+    assert list(records_df.inReplyTo) == list(comments_df.inReplyTo)
+    assert list(records_df.articleID) == list(comments_df.articleID.astype(str))
+    assert sorted(pd.DataFrame(articles).columns) == sorted(articles_df.columns)
+    assert [article['articleID'] for article in articles] == list(articles_df.articleID.astype(str))
+
+
+def test_arrow_tables(server):
+    pytest.importorskip('pyarrow')
+    urls = [article['web_url'] for article in server.articles]
+    comments = get_comments(urls, max_comments=1000, printout=False, client=client(server), output='records')
+    table = get_comments(urls, max_comments=1000, printout=False, client=client(server), output='arrow')
+    assert table.num_rows == len(comments) == 1000
+    assert table.column('commentID').to_pylist() == [comment['commentID'] for comment in comments]
+    assert get_articles('key', client=client(server), output='arrow', **SEARCH).num_rows == 20
+
+
+@pytest.mark.parametrize('options', [dict(output='csv'), dict(output='records', save=True)])
+def test_invalid_output(server, options):
+    with pytest.raises(ValueError):
+        get_articles('key', client=client(server), **dict(SEARCH, **options))
+
+
+def test_records_do_not_import_pandas(server):
+    code = '''import sys
+from nytcomments.client import Client
+from nytcomments.ratelimit import RateLimiter
+from nytcomments.nytcomments import get_comments
+comments = get_comments(sys.argv[1:], printout=False, output='records',
+                        client=Client(rate_limiter=RateLimiter(1e6, 1e6), base_url={!r}))
+print(len(comments), 'pandas' in sys.modules, 'numpy' in sys.modules)'''.format(server.url)
+    urls = [article['web_url'] for article in server.articles[:3]]
+    output = subprocess.check_output([sys.executable, '-c', code] + urls, cwd=os.path.dirname(BENCHMARKS))
+    number_comments, pandas_imported, numpy_imported = output.decode().split()
+    assert int(number_comments) > 0
+    assert (pandas_imported, numpy_imported) == ('False', 'False')
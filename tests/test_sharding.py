@@ -0,0 +1,40 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from replay_server import ReplayServer
+
+from nytcomments.client import Client
+from nytcomments.ratelimit import RateLimiter
+from nytcomments.nytcomments import get_articles, get_dataset
+
+
+def client(server):
+    return Client(rate_limiter=RateLimiter(1e6, 1e6), base_url=server.url)
+
+
+def test_shards_reach_past_the_page_cap():
+    server = ReplayServer(number_articles=2300, comments_per_article=(0, 0)).start()
+    try:
+        kwargs = dict(begin_date='20000101', end_date='20301231', printout=False)
+        capped_df = get_articles('key', page_upper=200, client=client(server), **kwargs)
+        articles_df = get_articles('key', client=client(server), shard=True, window_workers=3, **kwargs)
+    finally:
+        server.stop()
+    assert capped_df.shape[0] == 2000
+    assert articles_df.shape[0] == 2300
+    assert sorted(articles_df.articleID.astype(str)) == sorted(article['_id'] for article in server.articles)
+
+
+def test_sharded_dataset_is_the_same():
+    server = ReplayServer(number_articles=40, comments_per_article=(0, 100)).start()
+    try:
+        kwargs = dict(begin_date='20000101', end_date='20301231', printout=False, workers=2)
+        articles_df, comments_df = get_dataset('key', page_upper=5, client=client(server), **kwargs)
+        sharded_articles_df, sharded_comments_df = get_dataset('key', client=client(server), shard=True,
+                                                               window_workers=3, **kwargs)
+    finally:
+        server.stop()
+    assert sorted(sharded_articles_df.articleID.astype(str)) == sorted(articles_df.articleID.astype(str))
+    assert sorted(sharded_comments_df.commentID) == sorted(comments_df.commentID)
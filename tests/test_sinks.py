@@ -0,0 +1,55 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from replay_server import ReplayServer
+
+from nytcomments.client import Client
+from nytcomments.ratelimit import RateLimiter
+from nytcomments.nytcomments import get_dataset
+from nytcomments.sinks import DatasetSink, read_dataset
+
+
+@pytest.mark.parametrize('format', ['parquet', 'feather'])
+def test_categorical_columns_survive_the_round_trip(tmp_path, format):
+    articles_df = pd.DataFrame({'articleID': pd.Categorical(['a', 'b']), 'pubDate': ['2018-01-01', '2018-01-02'],
+                                'sectionName': pd.Categorical(['U.S.', 'World'])})
+    comments_df = pd.DataFrame({'articleID': pd.Categorical(['a', 'b', 'b']), 'userID': pd.Categorical([5, 7, 5]),
+                                'parentID': pd.Categorical([0, 0, 11]), 'sectionName': pd.Categorical(['U.S.', 'World', 'World'])})
+    keywords_df = pd.DataFrame({'articleID': pd.Categorical(['a']), 'value': pd.Categorical(['Politics'])})
+    sink = DatasetSink(str(tmp_path), format=format)
+    sink.write(articles_df, comments_df, keywords_df)
+
+    articles, comments, keywords = read_dataset(str(tmp_path), format=format, keywords_table=True)
+    for name in ['articleID', 'userID', 'parentID', 'sectionName']:
+        assert isinstance(comments[name].dtype, pd.CategoricalDtype), name
+    comments = comments.sort_values('userID', kind='stable').reset_index(drop=True)
+    assert list(comments.userID) == [5, 5, 7]
+    assert list(comments.userID.cat.categories) == [5, 7]
+    assert isinstance(articles.sectionName.dtype, pd.CategoricalDtype)
+    assert list(keywords.value) == ['Politics']
+    assert isinstance(keywords.value.dtype, pd.CategoricalDtype)
+
+
+def test_saved_dataset_is_read_back(tmp_path):
+    server = ReplayServer(number_articles=30, comments_per_article=(0, 200), depth=3).start()
+    try:
+        articles_df, comments_df = get_dataset('key', page_upper=3, begin_date='20000101', end_date='20301231',
+                                               printout=False, save=True, path=str(tmp_path), save_format='parquet',
+                                               client=Client(rate_limiter=RateLimiter(1e6, 1e6), base_url=server.url))
+    finally:
+        server.stop()
+    articles, comments = read_dataset(str(tmp_path))
+    assert articles.shape[0] == articles_df.shape[0]
+    assert comments.shape[0] == comments_df.shape[0]
+    comments = comments.sort_values('commentID').reset_index(drop=True)
+    expected = comments_df.sort_values('commentID').reset_index(drop=True)
+    for name in ['commentID', 'userID', 'inReplyTo', 'sectionName', 'createDate']:
+        assert list(comments[name].astype(str)) == list(expected[name].astype(str)), name
+    assert isinstance(comments.sectionName.dtype, pd.CategoricalDtype)
@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from replay_server import ReplayServer
+
+from nytcomments.client import Client
+from nytcomments.ratelimit import RateLimiter
+from nytcomments.threads import ThreadIndex
+from nytcomments.nytcomments import get_dataset
+
+
+@pytest.fixture(scope='module')
+def comments_df():
+    server = ReplayServer(number_articles=20, comments_per_article=(0, 200), depth=4, branching=2).start()
+    try:
+        return get_dataset('key', page_upper=2, begin_date='20000101', end_date='20301231', printout=False,
+                           client=Client(rate_limiter=RateLimiter(1e6, 1e6), base_url=server.url))[1]
+    finally:
+        server.stop()
+
+
+def naive_threads(comments_df):
+    '''Returns the root, the number of comments and the sum of the recommendations of the subtree
+    of every comment, found by walking up from every comment to its root.'''
+
+    parents = dict(zip(comments_df.commentID, comments_df.inReplyTo))
+    recommendations = dict(zip(comments_df.commentID, comments_df.recommendations))
+    sizes = dict.fromkeys(parents, 0)
+    totals = dict.fromkeys(parents, 0)
+    roots = {}
+    for comment_id in parents:
+        ancestor = comment_id
+        while True:
+            sizes[ancestor] += 1
+            totals[ancestor] += recommendations[comment_id]
+            if parents[ancestor] not in parents:
+                break
+            ancestor = parents[ancestor]
+        roots[comment_id] = ancestor
+    return roots, sizes, totals
+
+
+def test_index_matches_the_threads(comments_df):
+    index = ThreadIndex(comments_df)
+    threads_df = index.to_dataframe()
+    roots, sizes, totals = naive_threads(comments_df)
+    assert len(index) == comments_df.shape[0]
+    assert list(threads_df.depth) == list(comments_df.depth)
+    assert list(threads_df.rootID) == list(comments_df.commentID.map(roots))
+    assert list(threads_df.subtreeSize) == list(comments_df.commentID.map(sizes))
+    assert list(threads_df.subtreeRecommendations) == list(comments_df.commentID.map(totals))
+
+    deepest = comments_df.commentID[comments_df.depth == comments_df.depth.max()].iloc[0]
+    root = roots[deepest]
+    thread = index.thread(deepest)
+    assert thread.shape[0] == sizes[root]
+    assert set(thread.commentID.map(roots)) == {root}
+    assert sorted(index.replies(root).commentID) == sorted(comments_df.commentID[comments_df.inReplyTo == root])
+
+    stats = index.thread_stats()
+    assert stats['size'].sum() == len(index)
+    assert ThreadIndex(comments_df.iloc[:0]).thread_stats().shape[0] == 0
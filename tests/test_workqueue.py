@@ -0,0 +1,43 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+from replay_server import ReplayServer
+
+from nytcomments.client import Client
+from nytcomments.ratelimit import RateLimiter
+from nytcomments.dataprocessing import count_comments
+from nytcomments.workqueue import WorkQueue, run_worker, merge_shards
+
+
+def test_failed_pages_are_retried_until_every_comment_is_merged(tmp_path):
+    server = ReplayServer(number_articles=8, comments_per_article=(20, 120), depth=2, error_rate=0.3).start()
+    queue_path, shard_dir = str(tmp_path / 'queue.sqlite'), str(tmp_path / 'shards')
+    queue = WorkQueue(queue_path, max_attempts=100)
+    urls = [article['web_url'] for article in server.articles]
+    queue.add(urls)
+    queue.close()
+    client = Client(rate_limiter=RateLimiter(1e6, 1e6), base_url=server.url, max_retries=0)
+    try:
+        completed = run_worker(queue_path, shard_dir, client=client, printout=False, max_attempts=100)
+    finally:
+        server.stop()
+    assert completed == len(urls)
+    assert server.requests['errors'] > 0
+    served = sum(count_comments(server.comments[url]) for url in urls)
+    assert merge_shards(queue_path, shard_dir, printout=False).shape[0] == served
+
+
+def test_task_fails_after_max_attempts(tmp_path):
+    server = ReplayServer(number_articles=2, comments_per_article=(30, 30), error_rate=1.).start()
+    queue_path, shard_dir = str(tmp_path / 'queue.sqlite'), str(tmp_path / 'shards')
+    queue = WorkQueue(queue_path, max_attempts=2)
+    queue.add([article['web_url'] for article in server.articles])
+    client = Client(rate_limiter=RateLimiter(1e6, 1e6), base_url=server.url, max_retries=0)
+    try:
+        assert run_worker(queue_path, shard_dir, client=client, printout=False, max_attempts=2) == 0
+    finally:
+        server.stop()
+    assert queue.status() == {'pending': 0, 'leased': 0, 'done': 0, 'failed': 2}
+    queue.close()